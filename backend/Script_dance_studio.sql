@@ -79,10 +79,33 @@ CREATE TABLE "classes" (
   "teacher_id" int NOT NULL,
   "date" DATE NOT NULL,
   "current_capacity" int NOT NULL DEFAULT 0 CHECK (current_capacity >= 0),
+  "duration_minutes" int NOT NULL DEFAULT 60 CHECK (duration_minutes > 0 AND duration_minutes <= 720),
+  "series_id" int,
   "created_at" timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP,
   "updated_at" timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP
 );
 
+CREATE TABLE "class_series" (
+  "id" serial PRIMARY KEY,
+  "type" varchar(18) NOT NULL,
+  "hall_id" int,
+  "teacher_id" int NOT NULL,
+  "time" time NOT NULL,
+  "duration_minutes" int NOT NULL DEFAULT 60 CHECK (duration_minutes > 0 AND duration_minutes <= 720),
+  "weekdays" varchar(13) NOT NULL,
+  "start_date" DATE NOT NULL,
+  "end_date" DATE NOT NULL CHECK (end_date >= start_date),
+  "created_at" timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  "updated_at" timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE "waitlist" (
+  "id" serial PRIMARY KEY,
+  "class_id" int NOT NULL,
+  "student_id" int NOT NULL,
+  "created_at" timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
 CREATE TABLE "attendance" (
   "id" serial PRIMARY KEY,
   "presence" varchar(15) NOT NULL DEFAULT 'Записан' CHECK (presence IN ('Записан', 'Присутствовал')),
@@ -93,6 +116,17 @@ CREATE TABLE "attendance" (
   "updated_at" timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP
 );
 
+-- Сводная посещаемость по дням: ведется триггерами ниже (hall_id = 0 — занятие без зала)
+CREATE TABLE "attendance_daily" (
+  "date" DATE NOT NULL,
+  "type" varchar(18) NOT NULL,
+  "teacher_id" int NOT NULL,
+  "hall_id" int NOT NULL DEFAULT 0,
+  "registered" int NOT NULL DEFAULT 0,
+  "present" int NOT NULL DEFAULT 0,
+  PRIMARY KEY ("date", "type", "teacher_id", "hall_id")
+);
+
 CREATE TABLE "admins" (
   "id" serial PRIMARY KEY,
   "user_id" int NOT NULL,
@@ -123,6 +157,21 @@ ALTER TABLE "classes" ADD CONSTRAINT fk_classes_hall_id
 ALTER TABLE "classes" ADD CONSTRAINT fk_classes_teacher_id 
   FOREIGN KEY (teacher_id) REFERENCES teachers(id) ON DELETE CASCADE;
 
+ALTER TABLE "classes" ADD CONSTRAINT fk_classes_series_id 
+  FOREIGN KEY (series_id) REFERENCES class_series(id) ON DELETE SET NULL;
+
+ALTER TABLE "class_series" ADD CONSTRAINT fk_class_series_hall_id 
+  FOREIGN KEY (hall_id) REFERENCES halls(id) ON DELETE SET NULL;
+
+ALTER TABLE "class_series" ADD CONSTRAINT fk_class_series_teacher_id 
+  FOREIGN KEY (teacher_id) REFERENCES teachers(id) ON DELETE CASCADE;
+
+ALTER TABLE "waitlist" ADD CONSTRAINT fk_waitlist_class_id 
+  FOREIGN KEY (class_id) REFERENCES classes(id) ON DELETE CASCADE;
+
+ALTER TABLE "waitlist" ADD CONSTRAINT fk_waitlist_student_id 
+  FOREIGN KEY (student_id) REFERENCES students(id) ON DELETE CASCADE;
+
 ALTER TABLE "attendance" ADD CONSTRAINT fk_attendance_student_id 
   FOREIGN KEY (student_id) REFERENCES students(id) ON DELETE SET NULL;
 
@@ -136,15 +185,24 @@ ALTER TABLE "admins" ADD CONSTRAINT fk_admins_user_id
   FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE;
 
 -- Создание индексов
-CREATE INDEX idx_users_email ON users(email);
+-- (те же индексы объявлены в __table_args__ моделей ll1.py; users.email индексируется через UNIQUE)
 CREATE INDEX idx_users_role ON users(role);
 CREATE INDEX idx_students_user_id ON students(user_id);
 CREATE INDEX idx_payments_students_id ON payments(student_id);
 CREATE INDEX idx_teachers_user_id ON teachers(user_id);
-CREATE INDEX idx_classes_date ON classes(date);
 CREATE INDEX idx_subscriptions_status ON subscriptions(status);
-CREATE INDEX idx_attendance_student_id ON attendance(student_id);
+CREATE INDEX idx_subscriptions_student_status ON subscriptions(student_id, status);
+CREATE INDEX idx_classes_date_time ON classes(date, time, id);
+CREATE INDEX idx_classes_teacher_date_time ON classes(teacher_id, date, time);
+CREATE INDEX idx_classes_hall_date_time ON classes(hall_id, date, time);
+CREATE INDEX idx_classes_series_date ON classes(series_id, date);
+CREATE INDEX idx_class_series_teacher_id ON class_series(teacher_id);
+CREATE UNIQUE INDEX uq_attendance_student_class ON attendance(student_id, class_id);
 CREATE INDEX idx_attendance_class_id ON attendance(class_id);
+CREATE INDEX idx_attendance_student_id_id ON attendance(student_id, id);
+CREATE INDEX idx_waitlist_class_id ON waitlist(class_id, id);
+CREATE UNIQUE INDEX uq_waitlist_class_student ON waitlist(class_id, student_id);
+CREATE INDEX idx_waitlist_student_id ON waitlist(student_id);
 CREATE INDEX idx_admins_user_id ON admins(user_id);
 
 -- Триггеры для обновления updated_at
@@ -186,6 +244,11 @@ CREATE TRIGGER update_classes_updated_at
     FOR EACH ROW
     EXECUTE FUNCTION update_updated_at_column();
 
+CREATE TRIGGER update_class_series_updated_at
+    BEFORE UPDATE ON class_series
+    FOR EACH ROW
+    EXECUTE FUNCTION update_updated_at_column();
+
 CREATE TRIGGER update_attendance_updated_at
     BEFORE UPDATE ON attendance
     FOR EACH ROW
@@ -211,3 +274,121 @@ $$ LANGUAGE plpgsql;
 -- 2. Создаём триггер, который срабатывает перед обновлением записи
 CREATE TRIGGER update_status_when_no_classes_left
 BEFORE UPDATE ON subscriptions
+FOR EACH ROW
+EXECUTE FUNCTION check_remaining_classes();
+
+-- Текущая вместимость занятия не может превышать вместимость зала
+CREATE OR REPLACE FUNCTION check_class_capacity()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF NEW.hall_id IS NOT NULL AND NEW.current_capacity >
+        (SELECT capacity FROM halls WHERE id = NEW.hall_id) THEN
+        RAISE EXCEPTION 'Текущая вместимость не может превышать вместимость зала';
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER check_class_capacity
+    BEFORE INSERT OR UPDATE OF current_capacity, hall_id ON classes
+    FOR EACH ROW
+    EXECUTE FUNCTION check_class_capacity();
+
+-- Вместимость зала нельзя уменьшить ниже числа записанных на его занятия
+CREATE OR REPLACE FUNCTION check_hall_capacity()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM classes WHERE hall_id = NEW.id AND current_capacity > NEW.capacity) THEN
+        RAISE EXCEPTION 'Вместимость зала меньше числа записанных на занятия';
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER check_hall_capacity
+    BEFORE UPDATE OF capacity ON halls
+    FOR EACH ROW
+    EXECUTE FUNCTION check_hall_capacity();
+
+-- Сводная посещаемость attendance_daily меняется вместе с attendance в той же транзакции;
+-- перенос занятия переносит его счетчики на новый ключ (как ATTENDANCE_DAILY_TRIGGERS_POSTGRESQL в ll1.py)
+CREATE OR REPLACE FUNCTION attendance_daily_add(
+    p_date DATE, p_type VARCHAR, p_teacher_id INTEGER, p_hall_id INTEGER,
+    p_registered INTEGER, p_present INTEGER
+)
+RETURNS VOID AS $$
+BEGIN
+    IF p_date IS NULL OR (p_registered = 0 AND p_present = 0) THEN
+        RETURN;
+    END IF;
+    INSERT INTO attendance_daily (date, type, teacher_id, hall_id, registered, present)
+    VALUES (p_date, p_type, p_teacher_id, COALESCE(p_hall_id, 0), p_registered, p_present)
+    ON CONFLICT (date, type, teacher_id, hall_id) DO UPDATE
+        SET registered = attendance_daily.registered + EXCLUDED.registered,
+            present = attendance_daily.present + EXCLUDED.present;
+    DELETE FROM attendance_daily
+    WHERE date = p_date AND type = p_type AND teacher_id = p_teacher_id
+        AND hall_id = COALESCE(p_hall_id, 0) AND registered = 0 AND present = 0;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION attendance_daily_on_attendance()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM attendance_daily_add(c.date, c.type, c.teacher_id, c.hall_id,
+                                     -(OLD.presence = 'REGISTERED')::int, -(OLD.presence = 'PRESENT')::int)
+        FROM classes c WHERE c.id = OLD.class_id;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM attendance_daily_add(c.date, c.type, c.teacher_id, c.hall_id,
+                                     (NEW.presence = 'REGISTERED')::int, (NEW.presence = 'PRESENT')::int)
+        FROM classes c WHERE c.id = NEW.class_id;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER attendance_daily_on_attendance
+    AFTER INSERT OR DELETE OR UPDATE OF presence, class_id ON attendance
+    FOR EACH ROW
+    EXECUTE FUNCTION attendance_daily_on_attendance();
+
+CREATE OR REPLACE FUNCTION attendance_daily_on_class()
+RETURNS TRIGGER AS $$
+DECLARE
+    v_registered INTEGER;
+    v_present INTEGER;
+BEGIN
+    SELECT COUNT(*) FILTER (WHERE presence = 'REGISTERED'), COUNT(*) FILTER (WHERE presence = 'PRESENT')
+    INTO v_registered, v_present
+    FROM attendance WHERE class_id = NEW.id;
+    PERFORM attendance_daily_add(OLD.date, OLD.type, OLD.teacher_id, OLD.hall_id, -v_registered, -v_present);
+    PERFORM attendance_daily_add(NEW.date, NEW.type, NEW.teacher_id, NEW.hall_id, v_registered, v_present);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER attendance_daily_on_class
+    AFTER UPDATE OF date, type, teacher_id, hall_id ON classes
+    FOR EACH ROW
+    WHEN (OLD.date IS DISTINCT FROM NEW.date OR OLD.type IS DISTINCT FROM NEW.type
+          OR OLD.teacher_id IS DISTINCT FROM NEW.teacher_id OR OLD.hall_id IS DISTINCT FROM NEW.hall_id)
+    EXECUTE FUNCTION attendance_daily_on_class();
+
+-- Версия схемы для migrate.py: база из этого скрипта соответствует всем миграциям ниже
+CREATE TABLE "schema_migrations" (
+  "version" varchar(10) PRIMARY KEY,
+  "name" varchar(200) NOT NULL,
+  "applied_at" timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+INSERT INTO schema_migrations (version, name) VALUES
+  ('0001', 'Базовая схема'),
+  ('0002', 'Триггеры вместимости занятий и залов'),
+  ('0003', 'Индексы горячих запросов'),
+  ('0004', 'Длительность занятий'),
+  ('0005', 'Серии повторяющихся занятий'),
+  ('0006', 'Лист ожидания'),
+  ('0007', 'Сводная посещаемость по дням'),
+  ('0008', 'Индекс истории посещаемости студента');
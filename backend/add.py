@@ -1,17 +1,18 @@
 # Импорт необходимых модулей
-from ll1 import SQLModel
 from ll1 import *
 from datetime import  date, time, timedelta
 from passlib.context import CryptContext
 from sqlmodel import Session, select
 from main import get_password_hash
+from migrate import upgrade
 
 # Инициализация контекста для хеширования паролей
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 def add_initial_data():
     """Добавление тестовых данных в базу данных"""
-    SQLModel.metadata.create_all(engine)
+    # Схема создается и обновляется миграциями (migrate.py), вместе с индексами и триггерами
+    upgrade(engine)
       
     try:
         with Session(engine) as session:
@@ -0,0 +1,398 @@
+# Контроль допуска записей на занятия внутри процесса.
+# Когда открывается запись к популярному преподавателю, сотни одновременных
+# POST /classes/{id}/enroll упираются в блокировку одной строки classes и по очереди
+# проходят каждый свою транзакцию. Здесь попытки записи на одно занятие встают
+# в очередь занятия, а очередь разбирается пачками: одна транзакция на пачку
+# (блокировка строки, две проверки, один UPDATE classes и один многострочный INSERT
+# в attendance). Пока пачка пишется, в очереди копится следующая.
+# Очереди разбираются под asyncio.Lock шарда (class_id % числа шардов), поэтому
+# одновременно пишется не больше одной пачки на шард. Когда мест на занятии не
+# осталось, следующие попытки отклоняются сразу, без обращения к БД, до отмены
+# записи или изменения занятия (forget) или истечения ADMISSION_FULL_TTL_SECONDS
+# (места могли освободиться в другом процессе).
+# Правильность не зависит от этого слоя: пачка пишется с блокировкой строки занятия,
+# так что при нескольких процессах зал все равно не переполняется.
+import asyncio
+import os
+import time
+from collections import namedtuple
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+from fastapi import HTTPException, status
+from sqlalchemy import insert, select, update
+from sqlalchemy.exc import IntegrityError
+
+from ll1 import AttendanceStatus, async_session
+from enrollment import (
+    DUPLICATE, attendance_table, classes_table, enrollment_result, halls_table, rejection, subscriptions_table,
+    usable_subscription_conditions
+)
+
+ENROLLMENT_ADMISSION = os.environ.get("ENROLLMENT_ADMISSION", "1") == "1"
+ADMISSION_SHARDS = int(os.environ.get("ADMISSION_SHARDS", "64"))
+ADMISSION_BATCH_WINDOW_MS = float(os.environ.get("ADMISSION_BATCH_WINDOW_MS", "2"))
+ADMISSION_MAX_BATCH = int(os.environ.get("ADMISSION_MAX_BATCH", "64"))
+ADMISSION_FULL_TTL_SECONDS = float(os.environ.get("ADMISSION_FULL_TTL_SECONDS", "2"))
+
+# Данные для enrollment.rejection по одному студенту пачки
+Diagnosis = namedtuple("Diagnosis", "already_enrolled capacity current_capacity has_subscription")
+
+Outcome = Union[Dict[str, Any], HTTPException]
+
+
+def full_rejection() -> HTTPException:
+    return HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Зал уже заполнен")
+
+
+def apply_batch(session, class_id: int, student_ids: List[int]) -> Tuple[List[Outcome], Optional[int]]:
+    """
+    Запись пачки студентов на одно занятие в одной транзакции (синхронная Session,
+    из async-кода — через run_sync). Места достаются в порядке очереди.
+    Возвращает результат для каждого студента (словарь как у enroll_student или
+    HTTPException с причиной отказа) и число свободных мест после пачки.
+    """
+    now = datetime.now()
+    row = session.exec(
+        select(
+            classes_table.c.id, classes_table.c.date, classes_table.c.type, classes_table.c.teacher_id,
+            classes_table.c.hall_id, classes_table.c.current_capacity, halls_table.c.capacity
+        )
+        .select_from(classes_table)
+        .outerjoin(halls_table, halls_table.c.id == classes_table.c.hall_id)
+        .where(classes_table.c.id == class_id)
+        .with_for_update(of=classes_table)
+    ).first()
+    if row is None or row.capacity is None:
+        session.rollback()
+        return [rejection(None if row is None else Diagnosis(False, None, 0, False)) for _ in student_ids], None
+
+    enrolled = set(session.exec(
+        select(attendance_table.c.student_id)
+        .where(attendance_table.c.class_id == class_id, attendance_table.c.student_id.in_(student_ids))
+    ).scalars().all())
+    subscribed = set(session.exec(
+        select(subscriptions_table.c.student_id).distinct()
+        .where(subscriptions_table.c.student_id.in_(student_ids), *usable_subscription_conditions(row.date))
+    ).scalars().all())
+
+    free = max(row.capacity - row.current_capacity, 0)
+    seated: List[int] = []
+    outcomes: List[Optional[Outcome]] = []
+    for student_id in student_ids:
+        if student_id in enrolled or student_id in seated:
+            outcomes.append(DUPLICATE)
+        elif student_id not in subscribed:
+            outcomes.append(rejection(Diagnosis(False, row.capacity, row.current_capacity, False)))
+        elif len(seated) >= free:
+            outcomes.append(full_rejection())
+        else:
+            seated.append(student_id)
+            outcomes.append(None)
+
+    if not seated:
+        session.rollback()
+        return outcomes, free
+
+    try:
+        session.exec(
+            update(classes_table)
+            .where(classes_table.c.id == class_id)
+            .values(current_capacity=classes_table.c.current_capacity + len(seated), updated_at=now)
+        )
+        attendance_ids = dict(session.exec(
+            insert(attendance_table)
+            .values([
+                {
+                    "student_id": student_id, "class_id": class_id, "teacher_id": row.teacher_id,
+                    "presence": AttendanceStatus.REGISTERED, "created_at": now, "updated_at": now
+                }
+                for student_id in seated
+            ])
+            .returning(attendance_table.c.student_id, attendance_table.c.id)
+        ).all())
+        session.commit()
+    except IntegrityError:
+        # Студент пачки успел записаться мимо очереди (другой процесс) — пачку повторять клиентам
+        session.rollback()
+        retry = HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Не удалось записаться, попробуйте еще раз")
+        return [retry if outcome is None else outcome for outcome in outcomes], None
+
+    for n, student_id in enumerate(seated, start=1):
+        outcomes[outcomes.index(None)] = {
+            **enrollment_result(row, attendance_ids[student_id]),
+            "current_capacity": row.current_capacity + n
+        }
+    return outcomes, free - len(seated)
+
+
+class _ClassQueue:
+    __slots__ = ("pending", "draining", "full_at")
+
+    def __init__(self):
+        self.pending: List[Tuple[int, asyncio.Future]] = []
+        self.draining = False
+        self.full_at: Optional[float] = None
+
+
+class AdmissionControl:
+    """
+    Очереди попыток записи по занятиям с разбором пачками под шардированными
+    asyncio.Lock. Шарды и очереди привязаны к event loop, в котором работают.
+    """
+
+    def __init__(self, shards: int = ADMISSION_SHARDS, batch_window_ms: float = ADMISSION_BATCH_WINDOW_MS,
+                 max_batch: int = ADMISSION_MAX_BATCH, full_ttl: float = ADMISSION_FULL_TTL_SECONDS,
+                 session_factory=async_session):
+        self.shard_count = shards
+        self.batch_window = batch_window_ms / 1000
+        self.max_batch = max_batch
+        self.full_ttl = full_ttl
+        self.session_factory = session_factory
+        self._loop = None
+        self._shards: List[asyncio.Lock] = []
+        self._queues: Dict[int, _ClassQueue] = {}
+        self._tasks = set()
+        self.requests = 0
+        self.enrolled = 0
+        self.rejected_without_db = 0
+        self.batches = 0
+        self.batched_requests = 0
+        self.max_batch_seen = 0
+        self.max_queue_depth = 0
+
+    def _bind(self) -> None:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._shards = [asyncio.Lock() for _ in range(self.shard_count)]
+            self._queues = {}
+
+    def _is_full(self, queue: _ClassQueue) -> bool:
+        if queue.full_at is not None and time.monotonic() - queue.full_at >= self.full_ttl:
+            queue.full_at = None
+        return queue.full_at is not None
+
+    def forget(self, class_id: Optional[int] = None) -> None:
+        """Сброс отметки «мест нет» для занятия (или для всех занятий)"""
+        # Синхронные эндпоинты вызывают forget из потоков threadpool, а очереди принадлежат
+        # event loop, поэтому из чужого потока сброс передается в loop
+        loop = self._loop
+        if loop is None:
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is loop:
+            self._forget(class_id)
+        elif not loop.is_closed():
+            try:
+                loop.call_soon_threadsafe(self._forget, class_id)
+            except RuntimeError:
+                # loop закрылся между проверкой и вызовом; при новом loop очереди создаются заново
+                pass
+
+    def _forget(self, class_id: Optional[int]) -> None:
+        queues = self._queues.values() if class_id is None else filter(None, [self._queues.get(class_id)])
+        for queue in queues:
+            queue.full_at = None
+
+    async def enroll(self, student_id: int, class_id: int) -> Dict[str, Any]:
+        """Запись через очередь занятия; результат и ошибки — как у enrollment.enroll_student"""
+        self._bind()
+        self.requests += 1
+        queue = self._queues.get(class_id)
+        if queue is None:
+            queue = self._queues[class_id] = _ClassQueue()
+        if self._is_full(queue):
+            self.rejected_without_db += 1
+            raise full_rejection()
+
+        future = self._loop.create_future()
+        queue.pending.append((student_id, future))
+        self.max_queue_depth = max(self.max_queue_depth, len(queue.pending))
+        if not queue.draining:
+            queue.draining = True
+            task = asyncio.ensure_future(self._drain(class_id, queue))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        return await future
+
+    async def _drain(self, class_id: int, queue: _ClassQueue) -> None:
+        try:
+            async with self._shards[class_id % self.shard_count]:
+                while queue.pending:
+                    if self.batch_window:
+                        await asyncio.sleep(self.batch_window)
+                    batch = queue.pending[:self.max_batch]
+                    del queue.pending[:len(batch)]
+                    # Клиент мог отключиться, пока ждал очереди
+                    batch = [(student_id, future) for student_id, future in batch if not future.done()]
+                    if not batch:
+                        continue
+                    await self._apply(class_id, queue, batch)
+        finally:
+            queue.draining = False
+            if not queue.pending and queue.full_at is None:
+                self._queues.pop(class_id, None)
+
+    async def _apply(self, class_id: int, queue: _ClassQueue, batch: List[Tuple[int, asyncio.Future]]) -> None:
+        try:
+            async with self.session_factory() as session:
+                outcomes, free = await session.run_sync(apply_batch, class_id, [student_id for student_id, _ in batch])
+        except Exception as e:
+            print(f"Ошибка записи пачки на занятие {class_id}: {str(e)}")
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        self.batches += 1
+        self.batched_requests += len(batch)
+        self.max_batch_seen = max(self.max_batch_seen, len(batch))
+        for (_, future), outcome in zip(batch, outcomes):
+            if isinstance(outcome, HTTPException):
+                if not future.done():
+                    future.set_exception(outcome)
+            else:
+                self.enrolled += 1
+                if not future.done():
+                    future.set_result(outcome)
+
+        if free == 0:
+            queue.full_at = time.monotonic()
+            waiting, queue.pending = queue.pending, []
+            self.rejected_without_db += len(waiting)
+            for _, future in waiting:
+                if not future.done():
+                    future.set_exception(full_rejection())
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": ENROLLMENT_ADMISSION,
+            "shards": self.shard_count,
+            "queue_depth": sum(len(queue.pending) for queue in self._queues.values()),
+            "max_queue_depth": self.max_queue_depth,
+            "full_classes": sum(1 for queue in self._queues.values() if queue.full_at is not None),
+            "requests": self.requests,
+            "enrolled": self.enrolled,
+            "rejected_without_db": self.rejected_without_db,
+            "batches": self.batches,
+            "avg_batch": round(self.batched_requests / self.batches, 2) if self.batches else 0.0,
+            "max_batch": self.max_batch_seen
+        }
+
+
+admission = AdmissionControl()
+
+
+if __name__ == "__main__":
+    # Бенчмарк всплеска: одновременные записи на занятие в зале на 20 мест —
+    # напрямую (enroll_student, транзакция на запрос) и через очередь с пачками.
+    # Создает свои зал, занятия и студентов — запускать на отдельной БД:
+    #   DATABASE_URL=sqlite:////tmp/admission.db python backend/admission.py
+    #   DATABASE_URL=postgresql://.../admission_test python backend/admission.py
+    from collections import Counter
+    from datetime import date, time as time_of_day, timedelta
+    from time import perf_counter
+
+    from sqlalchemy import func
+    from sqlmodel import Session, SQLModel
+
+    from ll1 import (
+        Classes, Gender, Halls, PaymentMethod, Payments, Students, Subscriptions, SubscriptionStatus, Teachers,
+        UserRole, Users, engine, get_async_engine
+    )
+    from enrollment import enroll_student
+
+    STUDENTS = int(os.environ.get("ADMISSION_BENCH_STUDENTS", "500"))
+    SEATS = 20
+
+    SQLModel.metadata.create_all(engine)
+    tag = datetime.now().strftime("%Y%m%d%H%M%S%f")
+    with Session(engine) as session:
+        teacher_user = Users(email=f"admission-teacher-{tag}@example.local", password_hash="-", role=UserRole.TEACHER)
+        session.add(teacher_user)
+        session.flush()
+        teacher = Teachers(user_id=teacher_user.id, full_name="Всплеск записи", experience=1,
+                           specialization="test", phone="+70000000000")
+        hall = Halls(hall_number=int(tag[-9:]), capacity=SEATS, description="Всплеск записи")
+        session.add_all([teacher, hall])
+        session.flush()
+        classes = [
+            Classes(time=time_of_day(10 + n, 0), type="Spike", hall_id=hall.id, teacher_id=teacher.id,
+                    date=date.today() + timedelta(days=1))
+            for n in range(2)
+        ]
+        session.add_all(classes)
+        student_ids = []
+        for n in range(STUDENTS):
+            user = Users(email=f"admission-{tag}-{n}@example.local", password_hash="-", role=UserRole.STUDENT)
+            session.add(user)
+            session.flush()
+            student = Students(user_id=user.id, full_name=f"Студент {n}", date_of_birth=date(2000, 1, 1),
+                               gender=Gender.FEMALE, phone="+70000000000")
+            session.add(student)
+            session.flush()
+            payment = Payments(student_id=student.id, amount=1, payment_method=PaymentMethod.CARD)
+            session.add(payment)
+            session.flush()
+            session.add(Subscriptions(student_id=student.id, payment_id=payment.id, status=SubscriptionStatus.ACTIVE,
+                                      end_date=date.today() + timedelta(days=30)))
+            student_ids.append(student.id)
+        session.commit()
+        direct_class_id, admitted_class_id = classes[0].id, classes[1].id
+
+    control = AdmissionControl()
+    db_stats = get_async_engine().sync_engine.stats
+
+    async def direct(student_id):
+        async with async_session() as session:
+            return await enroll_student(session, student_id, direct_class_id)
+
+    async def admitted(student_id):
+        return await control.enroll(student_id, admitted_class_id)
+
+    async def spike(attempt):
+        async def one(student_id):
+            started = perf_counter()
+            try:
+                await attempt(student_id)
+                outcome = "записан"
+            except HTTPException as e:
+                outcome = e.detail
+            return outcome, perf_counter() - started
+
+        queries, checkouts = db_stats.queries, db_stats.checkouts
+        started = perf_counter()
+        results = await asyncio.gather(*(one(student_id) for student_id in student_ids))
+        elapsed = perf_counter() - started
+        latencies = sorted(latency for _, latency in results)
+        return {
+            "outcomes": Counter(outcome for outcome, _ in results),
+            "elapsed_ms": elapsed * 1000,
+            "p99_ms": latencies[int(len(latencies) * 0.99) - 1] * 1000,
+            "queries": db_stats.queries - queries,
+            "checkouts": db_stats.checkouts - checkouts
+        }
+
+    async def scenario():
+        return await spike(direct), await spike(admitted)
+
+    before, after = asyncio.run(scenario())
+    for title, result in (("напрямую", before), ("через очередь", after)):
+        print(f"{title}: {STUDENTS} записей на {SEATS} мест за {result['elapsed_ms']:.0f} мс, "
+              f"p99={result['p99_ms']:.0f} мс, запросов к БД {result['queries']}, "
+              f"соединений {result['checkouts']}: {dict(result['outcomes'])}")
+    print(f"  {control.stats()}")
+
+    with Session(engine) as session:
+        for class_id in (direct_class_id, admitted_class_id):
+            capacity = session.get(Classes, class_id).current_capacity
+            enrolled = session.exec(
+                select(func.count()).select_from(attendance_table).where(attendance_table.c.class_id == class_id)
+            ).one()[0]
+            assert capacity == SEATS and enrolled == SEATS, (class_id, capacity, enrolled)
+    assert after["outcomes"]["записан"] == SEATS
+    print("OK: в обоих случаях занято ровно столько мест, сколько вмещает зал")
@@ -0,0 +1,90 @@
+# Сводная посещаемость по дням (таблица attendance_daily, модель ll1.AttendanceDaily).
+# Счетчики ведут триггеры ll1.ATTENDANCE_DAILY_TRIGGERS_* в той же транзакции, что и
+# изменение attendance или перенос занятия, поэтому они верны при любом пути записи:
+# ORM, Core-запросы записи на занятия и переклички, удаление студентов и занятий.
+# rebuild пересчитывает таблицу из attendance целиком (после восстановления из бэкапа,
+# ручных правок в БД или работы с отключенными триггерами); check только сравнивает.
+#
+# Запуск:
+#   python backend/attendance_rollup.py rebuild   — пересобрать attendance_daily из attendance
+#   python backend/attendance_rollup.py check     — расхождения attendance_daily с attendance
+import sys
+from typing import Dict, List, Tuple
+
+from sqlalchemy import case, delete, func, insert, select, text
+from sqlalchemy.engine import Connection
+
+from ll1 import Attendance, AttendanceDaily, AttendanceStatus, Classes, engine
+
+attendance_table = Attendance.__table__
+classes_table = Classes.__table__
+daily_table = AttendanceDaily.__table__
+
+KEY_COLUMNS = ("date", "type", "teacher_id", "hall_id")
+
+
+def live_statement():
+    """Счетчики attendance_daily, посчитанные по attendance"""
+    key = [
+        classes_table.c.date, classes_table.c.type, classes_table.c.teacher_id,
+        func.coalesce(classes_table.c.hall_id, 0).label("hall_id")
+    ]
+    return (
+        select(
+            *key,
+            func.sum(case((attendance_table.c.presence == AttendanceStatus.REGISTERED, 1), else_=0)).label("registered"),
+            func.sum(case((attendance_table.c.presence == AttendanceStatus.PRESENT, 1), else_=0)).label("present")
+        )
+        .select_from(attendance_table.join(classes_table, classes_table.c.id == attendance_table.c.class_id))
+        .group_by(*key)
+    )
+
+
+def rebuild(connection: Connection) -> int:
+    """Пересборка attendance_daily одним INSERT ... SELECT; возвращает число строк"""
+    if connection.dialect.name == "postgresql":
+        # Запись в attendance ждет конца пересборки, чтобы триггер не прибавил
+        # строку, которая уже попала в SELECT
+        connection.execute(text("LOCK TABLE attendance IN SHARE MODE"))
+    connection.execute(delete(daily_table))
+    connection.execute(
+        insert(daily_table).from_select(list(KEY_COLUMNS) + ["registered", "present"], live_statement())
+    )
+    return connection.execute(select(func.count()).select_from(daily_table)).scalar_one()
+
+
+def drift(connection: Connection) -> List[Tuple[tuple, Tuple[int, int], Tuple[int, int]]]:
+    """Ключи, где счетчики расходятся: (ключ, (registered, present) по attendance, то же в attendance_daily)"""
+    def counters(statement) -> Dict[tuple, Tuple[int, int]]:
+        return {
+            tuple(row[:4]): (row.registered, row.present)
+            for row in connection.execute(statement)
+            if row.registered or row.present
+        }
+
+    expected = counters(live_statement())
+    actual = counters(select(daily_table))
+    return [
+        (key, expected.get(key, (0, 0)), actual.get(key, (0, 0)))
+        for key in sorted(expected.keys() | actual.keys(), key=str)
+        if expected.get(key) != actual.get(key)
+    ]
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else "check"
+    if command == "rebuild":
+        with engine.begin() as connection:
+            print(f"attendance_daily пересобрана: {rebuild(connection)} строк")
+    elif command == "check":
+        with engine.connect() as connection:
+            problems = drift(connection)
+        for key, expected, actual in problems[:50]:
+            print(f"{dict(zip(KEY_COLUMNS, key))}: по attendance {expected}, в attendance_daily {actual}")
+        if problems:
+            print(f"Расхождений: {len(problems)}. Исправить: python backend/attendance_rollup.py rebuild")
+            sys.exit(1)
+        print("attendance_daily совпадает с attendance")
+    else:
+        print(f"Неизвестная команда: {command}. Доступны: rebuild, check")
+        sys.exit(2)
@@ -0,0 +1,278 @@
+# Статистика посещаемости, посчитанная в БД.
+# Раньше все записи attendance за период загружались в Python и раскладывались
+# по словарям — память и время росли вместе с историей. Теперь статистика читает
+# только сводную таблицу attendance_daily (строка на день, тип занятия, преподавателя
+# и зал; ее ведут триггеры, см. attendance_rollup.py), так что стоимость запроса
+# зависит от числа дней, а не от числа записей. Все разрезы (по типу занятия,
+# по преподавателю, по дате и итог) считает один запрос: в PostgreSQL — GROUP BY
+# GROUPING SETS, в остальных СУБД (SQLite для разработки) — UNION ALL из четырех GROUP BY.
+# Тот же запрос по самой attendance (LIVE) остается для сверки и бенчмарка.
+from collections import namedtuple
+from datetime import date
+from typing import Any, Dict, Optional
+
+from fastapi import HTTPException, status
+from sqlalchemy import case, cast, func, literal, null, select, tuple_, union_all
+from sqlmodel import Session
+
+from ll1 import Attendance, AttendanceDaily, AttendanceStatus, Classes
+
+attendance_table = Attendance.__table__
+classes_table = Classes.__table__
+daily_table = AttendanceDaily.__table__
+
+# Откуда считается статистика: таблица, колонки разрезов и фильтров, счетчики total/present/registered
+Source = namedtuple("Source", "from_clause date type teacher_id counters")
+
+ROLLUP = Source(
+    daily_table, daily_table.c.date, daily_table.c.type, daily_table.c.teacher_id,
+    (
+        func.sum(daily_table.c.registered + daily_table.c.present).label("total"),
+        func.sum(daily_table.c.present).label("present"),
+        func.sum(daily_table.c.registered).label("registered"),
+    )
+)
+
+LIVE = Source(
+    attendance_table.join(classes_table, classes_table.c.id == attendance_table.c.class_id),
+    classes_table.c.date, classes_table.c.type, classes_table.c.teacher_id,
+    (
+        func.count().label("total"),
+        func.sum(case((attendance_table.c.presence == AttendanceStatus.PRESENT, 1), else_=0)).label("present"),
+        func.sum(case((attendance_table.c.presence == AttendanceStatus.REGISTERED, 1), else_=0)).label("registered"),
+    )
+)
+
+
+def breakdowns(source: Source) -> Dict[str, Any]:
+    """Разрезы статистики: имя в ответе -> колонка"""
+    return {"by_dance_type": source.type, "by_teacher": source.teacher_id, "by_date": source.date}
+
+
+def _filters(source: Source, date_from: Optional[date], date_to: Optional[date], dance_type: Optional[str],
+             teacher_id: Optional[int]) -> list:
+    filters = []
+    if date_from:
+        filters.append(source.date >= date_from)
+    if date_to:
+        filters.append(source.date <= date_to)
+    if dance_type:
+        filters.append(source.type == dance_type)
+    if teacher_id:
+        filters.append(source.teacher_id == teacher_id)
+    return filters
+
+
+def grouping_sets_statement(source: Source, filters: list):
+    """Все разрезы одним GROUP BY GROUPING SETS (PostgreSQL)"""
+    columns = breakdowns(source)
+    breakdown = case(
+        *[(func.grouping(column) == 0, literal(name)) for name, column in columns.items()],
+        else_=literal("total")
+    )
+    return (
+        select(breakdown.label("breakdown"), *columns.values(), *source.counters)
+        .select_from(source.from_clause)
+        .where(*filters)
+        .group_by(func.grouping_sets(*[tuple_(column) for column in columns.values()], tuple_()))
+    )
+
+
+def union_statement(source: Source, filters: list):
+    """Те же разрезы через UNION ALL из GROUP BY по каждой колонке и итога"""
+    columns = breakdowns(source)
+    parts = []
+    for name in list(columns) + ["total"]:
+        keys = [
+            column if key == name else cast(null(), column.type).label(column.key)
+            for key, column in columns.items()
+        ]
+        part = select(literal(name).label("breakdown"), *keys, *source.counters) \
+            .select_from(source.from_clause).where(*filters)
+        if name in columns:
+            part = part.group_by(columns[name])
+        parts.append(part)
+    return union_all(*parts)
+
+
+def statistics_statement(dialect_name: str, source: Source, filters: list):
+    if dialect_name == "postgresql":
+        return grouping_sets_statement(source, filters)
+    return union_statement(source, filters)
+
+
+def attendance_statistics(
+    session: Session,
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    dance_type: Optional[str] = None,
+    teacher_id: Optional[int] = None,
+    source: Source = ROLLUP
+) -> Dict[str, Any]:
+    """Статистика посещаемости с фильтрами — в том же формате, что и раньше"""
+    if date_from and date_to and date_to < date_from:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="End date cannot be before start date"
+        )
+
+    filters = _filters(source, date_from, date_to, dance_type, teacher_id)
+    rows = session.exec(statistics_statement(session.get_bind().dialect.name, source, filters)).all()
+    columns = breakdowns(source)
+
+    statistics = {
+        "total_attendance": 0,
+        "by_dance_type": {},
+        "by_teacher": {},
+        "by_date": {},
+        "attendance_rate": 0.0
+    }
+    total_registered = 0
+    total_present = 0
+    for row in rows:
+        if row.breakdown == "total":
+            statistics["total_attendance"] = row.total or 0
+            total_present = row.present or 0
+            total_registered = row.registered or 0
+        else:
+            key = row._mapping[columns[row.breakdown].key]
+            if isinstance(key, date):
+                key = key.strftime("%Y-%m-%d")
+            statistics[row.breakdown][key] = row.total
+
+    if total_registered > 0:
+        statistics["attendance_rate"] = (total_present / total_registered) * 100
+
+    return statistics
+
+
+if __name__ == "__main__":
+    # Бенчмарк: статистика по 1 млн записей attendance — сводная таблица attendance_daily,
+    # агрегация самой attendance и загрузка строк в Python (прежняя реализация).
+    # Создает свои данные — запускать на отдельной БД:
+    #   DATABASE_URL=sqlite:////tmp/attendance_stats.db python backend/attendance_stats.py
+    # Число записей: ATTENDANCE_STATS_BENCH_ROWS (по умолчанию 1000000).
+    import os
+    import resource
+    from datetime import datetime, time, timedelta
+    from time import perf_counter
+
+    from sqlalchemy import insert
+    from sqlmodel import SQLModel
+
+    from ll1 import Gender, Halls, Students, Teachers, UserRole, Users, engine
+
+    ROWS = int(os.environ.get("ATTENDANCE_STATS_BENCH_ROWS", "1000000"))
+    CLASSES = 500
+    STUDENTS = -(-ROWS // CLASSES)
+    TEACHERS = 10
+
+    def python_statistics(session, date_from=None, date_to=None, dance_type=None, teacher_id=None):
+        # Прежняя реализация requests.get_attendance_statistics (для сравнения); в ней было
+        # record.class_, которого у модели нет, — здесь связь называется как в модели
+        from sqlmodel import select as orm_select
+
+        statement = orm_select(Attendance).join(Classes)
+        for condition in _filters(LIVE, date_from, date_to, dance_type, teacher_id):
+            statement = statement.where(condition)
+        attendance_records = session.exec(statement).all()
+        statistics = {"total_attendance": len(attendance_records), "by_dance_type": {}, "by_teacher": {},
+                      "by_date": {}, "attendance_rate": 0.0}
+        total_registered = total_present = 0
+        for record in attendance_records:
+            dance_type_ = record.class_attendance.type
+            teacher_id_ = record.class_attendance.teacher_id
+            date_str = record.class_attendance.date.strftime("%Y-%m-%d")
+            statistics["by_dance_type"][dance_type_] = statistics["by_dance_type"].get(dance_type_, 0) + 1
+            statistics["by_teacher"][teacher_id_] = statistics["by_teacher"].get(teacher_id_, 0) + 1
+            statistics["by_date"][date_str] = statistics["by_date"].get(date_str, 0) + 1
+            if record.presence == "Записан":
+                total_registered += 1
+            if record.presence == "Присутствовал":
+                total_present += 1
+        if total_registered > 0:
+            statistics["attendance_rate"] = (total_present / total_registered) * 100
+        return statistics
+
+    def max_rss_mb():
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+    SQLModel.metadata.create_all(engine)
+    tag = datetime.now().strftime("%Y%m%d%H%M%S%f")
+    started = perf_counter()
+    with Session(engine) as session:
+        teacher_ids = []
+        for n in range(TEACHERS):
+            user = Users(email=f"stats-teacher-{tag}-{n}@example.local", password_hash="-", role=UserRole.TEACHER)
+            session.add(user)
+            session.flush()
+            teacher = Teachers(user_id=user.id, full_name=f"Преподаватель {n}", experience=1,
+                               specialization="bench", phone="+70000000000")
+            session.add(teacher)
+            session.flush()
+            teacher_ids.append(teacher.id)
+        hall = Halls(hall_number=int(tag[-9:]), capacity=100, description="Бенчмарк статистики")
+        session.add(hall)
+        session.flush()
+
+        user_ids = session.exec(
+            insert(Users.__table__).values([
+                {"email": f"stats-{tag}-{n}@example.local", "password_hash": "-", "role": UserRole.STUDENT}
+                for n in range(STUDENTS)
+            ]).returning(Users.__table__.c.id)
+        ).scalars().all()
+        student_ids = session.exec(
+            insert(Students.__table__).values([
+                {"user_id": user_id, "full_name": "Студент", "date_of_birth": date(2000, 1, 1),
+                 "gender": Gender.FEMALE, "phone": "+70000000000"}
+                for user_id in user_ids
+            ]).returning(Students.__table__.c.id)
+        ).scalars().all()
+        start_day = date.today() - timedelta(days=365)
+        class_ids = session.exec(
+            insert(classes_table).values([
+                {"time": time(8 + n % 12, 0), "type": f"Type {n % 8}", "hall_id": hall.id,
+                 "teacher_id": teacher_ids[n % TEACHERS], "date": start_day + timedelta(days=n * 365 // CLASSES),
+                 "current_capacity": 0, "duration_minutes": 60}
+                for n in range(CLASSES)
+            ]).returning(classes_table.c.id)
+        ).scalars().all()
+
+        now = datetime.now()
+        batch = []
+        for n in range(ROWS):
+            class_n, student_n = n % CLASSES, n // CLASSES
+            batch.append({
+                "student_id": student_ids[student_n], "class_id": class_ids[class_n],
+                "teacher_id": teacher_ids[class_n % TEACHERS],
+                "presence": AttendanceStatus.PRESENT if n % 3 else AttendanceStatus.REGISTERED,
+                "created_at": now, "updated_at": now
+            })
+            if len(batch) == 10000:
+                session.exec(insert(attendance_table), params=batch)
+                batch = []
+        if batch:
+            session.exec(insert(attendance_table), params=batch)
+        session.commit()
+    print(f"Данные: {ROWS} записей attendance, {CLASSES} занятий, {STUDENTS} студентов "
+          f"за {perf_counter() - started:.1f} с")
+
+    # Статистика за весь период данных бенчмарка
+    period = dict(date_from=start_day, date_to=date.today())
+    approaches = (
+        ("сводная таблица", lambda session: attendance_statistics(session, **period)),
+        ("агрегация attendance", lambda session: attendance_statistics(session, **period, source=LIVE)),
+        ("строки в Python", lambda session: python_statistics(session, **period)),
+    )
+    results = {}
+    for title, fn in approaches:
+        rss_before = max_rss_mb()
+        with Session(engine) as session:
+            started = perf_counter()
+            results[title] = fn(session)
+            elapsed = perf_counter() - started
+        print(f"{title}: {elapsed * 1000:.0f} мс, рост пикового RSS {max_rss_mb() - rss_before:.0f} МБ")
+
+    expected = results["строки в Python"]
+    assert all(result == expected for result in results.values()), "результаты расходятся"
+    print("OK: результаты совпадают")
@@ -0,0 +1,57 @@
+# Бенчмарк: пропускная способность async-эндпоинтов при росте числа одновременных запросов.
+# Сравнивает блокирующий Session(engine) внутри async def (как было) и AsyncSession.
+# Запуск: DB_PROFILE=bench python backend/bench_db.py
+# Показательные цифры получаются на PostgreSQL: aiosqlite выполняет запросы
+# в одном фоновом потоке, поэтому на SQLite рост будет скромнее.
+import asyncio
+import os
+from time import perf_counter
+
+os.environ.setdefault("DB_PROFILE", "bench")
+
+from ll1 import *
+
+IN_FLIGHT = [1, 2, 4, 8, 16, 32, 64]
+REQUESTS = 500
+
+def schedule_query(teacher_id: int):
+    return (
+        select(Classes)
+        .where(Classes.teacher_id == teacher_id)
+        .order_by(Classes.date, Classes.time)
+    )
+
+async def blocking_handler(teacher_id: int):
+    """Как раньше: синхронная сессия внутри async def блокирует event loop"""
+    with Session(engine) as session:
+        return session.exec(schedule_query(teacher_id)).all()
+
+async def async_handler(teacher_id: int):
+    """Через AsyncSession: event loop свободен, пока запрос выполняется в БД"""
+    async with async_session() as session:
+        return (await session.exec(schedule_query(teacher_id))).all()
+
+async def measure(handler, in_flight: int) -> float:
+    semaphore = asyncio.Semaphore(in_flight)
+
+    async def one_request(i: int):
+        async with semaphore:
+            await handler(i % 2 + 1)
+
+    started = perf_counter()
+    await asyncio.gather(*(one_request(i) for i in range(REQUESTS)))
+    return REQUESTS / (perf_counter() - started)
+
+async def main():
+    # Прогрев пулов соединений
+    await measure(blocking_handler, 8)
+    await measure(async_handler, 8)
+
+    print(f"{'in-flight':>10} {'Session, req/s':>16} {'AsyncSession, req/s':>20}")
+    for in_flight in IN_FLIGHT:
+        blocking_rps = await measure(blocking_handler, in_flight)
+        async_rps = await measure(async_handler, in_flight)
+        print(f"{in_flight:>10} {blocking_rps:>16.0f} {async_rps:>20.0f}")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,173 @@
+# Импорт необходимых модулей
+import hashlib
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Any, Dict, Optional
+
+from fastapi import Response
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import func
+
+from serializers import json_response
+
+
+def version_aggregates(column, dialect_name: str) -> list:
+    """
+    Агрегаты версии таблицы по колонке updated_at: максимум и сумма в секундах.
+    Сумма меняется при любом изменении updated_at, даже если новое значение
+    (время начала транзакции в триггере) меньше уже виденного максимума.
+    """
+    if dialect_name == "postgresql":
+        return [func.max(column), func.sum(func.extract("epoch", column))]
+    if dialect_name == "sqlite":
+        return [func.max(column), func.sum((func.julianday(column) - 2440587.5) * 86400.0)]
+    return [func.max(column)]
+
+
+def make_etag(*parts: Any) -> str:
+    """Сильный ETag по версии данных и параметрам запроса"""
+    return '"' + hashlib.sha1(repr(parts).encode()).hexdigest()[:24] + '"'
+
+
+def latest(*values: Any) -> Optional[datetime]:
+    """Последнее изменение среди значений max(updated_at) (прочие агрегаты пропускаются)"""
+    dates = [value for value in values if isinstance(value, datetime)]
+    return max(dates) if dates else None
+
+
+def http_date(value: Optional[datetime]) -> Optional[str]:
+    """Дата для заголовка Last-Modified (наивное время считается локальным)"""
+    if value is None:
+        return None
+    return formatdate(value.timestamp(), usegmt=True)
+
+
+def is_not_modified(etag: str, last_modified: Optional[datetime],
+                    if_none_match: Optional[str], if_modified_since: Optional[str]) -> bool:
+    """Проверка условного запроса: If-None-Match важнее If-Modified-Since"""
+    if if_none_match is not None:
+        tags = [tag.strip() for tag in if_none_match.split(",")]
+        return "*" in tags or etag in tags or f"W/{etag}" in tags
+    if if_modified_since and last_modified is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        modified = last_modified.astimezone(timezone.utc).replace(microsecond=0)
+        return modified <= since
+    return False
+
+
+class ConditionalStats:
+    """
+    Счетчики условных GET по эндпоинтам: сколько ответов 304, сколько байт
+    и процессорного времени они сэкономили по сравнению с полным ответом
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._endpoints: Dict[str, Dict[str, float]] = {}
+
+    def _counters(self, endpoint: str) -> Dict[str, float]:
+        return self._endpoints.setdefault(endpoint, {
+            "full": 0, "not_modified": 0, "bytes_sent": 0, "bytes_saved": 0,
+            "build_cpu": 0.0, "probe_cpu": 0.0, "cpu_saved": 0.0, "last_bytes": 0
+        })
+
+    def record_probe(self, endpoint: str, cpu_seconds: float) -> None:
+        with self._lock:
+            self._counters(endpoint)["probe_cpu"] += cpu_seconds
+
+    def record_full(self, endpoint: str, body_bytes: int, cpu_seconds: float) -> None:
+        with self._lock:
+            counters = self._counters(endpoint)
+            counters["full"] += 1
+            counters["bytes_sent"] += body_bytes
+            counters["build_cpu"] += cpu_seconds
+            counters["last_bytes"] = body_bytes
+
+    def record_not_modified(self, endpoint: str, probe_cpu_seconds: float) -> None:
+        # Экономия оценивается по последнему полному ответу и средней стоимости его сборки
+        with self._lock:
+            counters = self._counters(endpoint)
+            counters["not_modified"] += 1
+            counters["bytes_saved"] += counters["last_bytes"]
+            if counters["full"]:
+                counters["cpu_saved"] += counters["build_cpu"] / counters["full"] - probe_cpu_seconds
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            result = {}
+            for endpoint, c in self._endpoints.items():
+                requests = c["full"] + c["not_modified"]
+                result[endpoint] = {
+                    "requests": requests,
+                    "not_modified": c["not_modified"],
+                    "bytes_sent": c["bytes_sent"],
+                    "bytes_saved": c["bytes_saved"],
+                    "avg_full_bytes": round(c["bytes_sent"] / c["full"]) if c["full"] else 0,
+                    "avg_build_cpu_ms": round(c["build_cpu"] / c["full"] * 1000, 3) if c["full"] else 0.0,
+                    "avg_probe_cpu_ms": round(c["probe_cpu"] / requests * 1000, 3) if requests else 0.0,
+                    "cpu_saved_ms": round(c["cpu_saved"] * 1000, 3)
+                }
+            return result
+
+
+def cpu_time() -> float:
+    """Процессорное время текущего потока (синхронные эндпоинты идут в пуле потоков)"""
+    return time.thread_time()
+
+
+class DataVersion:
+    """Версия данных ответа: ETag, Last-Modified и стоимость ее проверки"""
+
+    def __init__(self, endpoint: str, row: Any, params: Any, probe_cpu: float):
+        self.endpoint = endpoint
+        self.etag = make_etag(endpoint, params, tuple(row))
+        self.last_modified = latest(*row)
+        self.probe_cpu = probe_cpu
+
+    def headers(self) -> Dict[str, str]:
+        # no-cache: браузер хранит ответ, но перед использованием всегда перепроверяет его
+        headers = {"ETag": self.etag, "Cache-Control": "no-cache"}
+        if self.last_modified is not None:
+            headers["Last-Modified"] = http_date(self.last_modified)
+        return headers
+
+
+def probe_version(session, stats: ConditionalStats, endpoint: str, build_statement, params: Any = None) -> DataVersion:
+    """
+    Один агрегирующий запрос (count, max/sum updated_at) вместо полной выборки.
+    build_statement получает функцию агрегатов версии для диалекта текущей БД.
+    """
+    started = cpu_time()
+    dialect_name = session.get_bind().dialect.name
+    statement = build_statement(lambda column: version_aggregates(column, dialect_name))
+    row = session.exec(statement).one()
+    probe_cpu = cpu_time() - started
+    stats.record_probe(endpoint, probe_cpu)
+    return DataVersion(endpoint, row, params, probe_cpu)
+
+
+def not_modified_response(stats: ConditionalStats, version: DataVersion,
+                          if_none_match: Optional[str], if_modified_since: Optional[str]) -> Optional[Response]:
+    """Ответ 304, если у клиента актуальная версия, иначе None"""
+    if not is_not_modified(version.etag, version.last_modified, if_none_match, if_modified_since):
+        return None
+    stats.record_not_modified(version.endpoint, version.probe_cpu)
+    return Response(status_code=304, headers=version.headers())
+
+
+def full_response(stats: ConditionalStats, version: DataVersion, content: Any, started: float,
+                  headers: Optional[Dict[str, str]] = None) -> Response:
+    """
+    Полный ответ с ETag/Last-Modified; started — cpu_time() до сборки ответа.
+    content — готовые JSON-байты или данные для jsonable_encoder.
+    """
+    if not isinstance(content, bytes):
+        content = jsonable_encoder(content)
+    response = json_response(content, headers={**version.headers(), **(headers or {})})
+    stats.record_full(version.endpoint, len(response.body), cpu_time() - started)
+    return response
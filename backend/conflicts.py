@@ -0,0 +1,323 @@
+# Поиск пересечений занятий по залу и преподавателю. Быстрая проверка идет по
+# интервальному индексу в памяти, окончательная — в транзакции записи: строки зала и
+# преподавателя блокируются (lock_schedule), и пересечения ищутся уже в самой таблице
+# classes (check_conflicts_locked). Индекс мог не увидеть занятие, созданное другим
+# процессом или параллельным запросом, а блокировка не дает двум записям в одно
+# расписание проверить его одновременно.
+import os
+import threading
+import time as time_module
+from bisect import bisect_left, insort
+from datetime import date, time
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from fastapi import HTTPException, status
+from sqlalchemy import event, or_, update
+from sqlalchemy.orm import Session as OrmSession, object_session
+from sqlmodel import Session, select
+
+from ll1 import Classes, Halls, Teachers
+
+DEFAULT_DURATION_MINUTES = 60
+MINUTES_IN_DAY = 24 * 60
+SCHEDULE_INDEX_TTL_SECONDS = float(os.environ.get("SCHEDULE_INDEX_TTL_SECONDS", "300"))
+
+
+def to_minutes(value: time) -> int:
+    """Минуты от полуночи"""
+    return value.hour * 60 + value.minute
+
+
+def format_minutes(minutes: int) -> str:
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+
+class ScheduleIndex:
+    """
+    Интервальный индекс расписания: для каждого зала и каждого преподавателя по дням —
+    отсортированный список (начало, конец, id занятия) в минутах от полуночи.
+    Поиск пересечений — два bisect по началу интервала: кандидаты начинаются не раньше
+    чем (начало - самая длинная длительность в списке) и раньше конца проверяемого
+    интервала, поэтому проверка стоит O(log n + k) при любом размере расписания.
+
+    Индекс строится из БД целиком при первой проверке и раз в ttl секунд (чтобы
+    подхватывать изменения из других процессов), а между перестроениями обновляется
+    после commit каждой записи Classes через ORM.
+    """
+
+    def __init__(self, ttl: float = SCHEDULE_INDEX_TTL_SECONDS):
+        self.ttl = ttl
+        self._lock = threading.RLock()
+        self._buckets: Dict[Tuple[str, int, date], List[Tuple[int, int, int]]] = {}
+        self._max_duration: Dict[Tuple[str, int, date], int] = {}
+        self._classes: Dict[int, Tuple[Optional[int], int, date, int, int]] = {}
+        self._loaded_at: Optional[float] = None
+        self.rebuilds = 0
+        self.checks = 0
+        self.conflicts_found = 0
+
+    def fill(self, rows: Iterable[Tuple]) -> None:
+        """Замена содержимого индекса строками (id, hall_id, teacher_id, date, time, duration_minutes)"""
+        with self._lock:
+            self._buckets.clear()
+            self._max_duration.clear()
+            self._classes.clear()
+            for class_id, hall_id, teacher_id, day, start_time, duration in rows:
+                start = to_minutes(start_time)
+                self._add(class_id, hall_id, teacher_id, day, start, start + duration)
+
+    def rebuild(self, session: Session) -> None:
+        """Полное построение индекса одним запросом к classes"""
+        rows = session.exec(
+            select(Classes.id, Classes.hall_id, Classes.teacher_id, Classes.date,
+                   Classes.time, Classes.duration_minutes)
+        ).all()
+        with self._lock:
+            self.fill(rows)
+            self._loaded_at = time_module.monotonic()
+            self.rebuilds += 1
+        print(f"Индекс расписания перестроен: {len(rows)} занятий")
+
+    def ensure_loaded(self, session: Session) -> None:
+        with self._lock:
+            fresh = self._loaded_at is not None and time_module.monotonic() - self._loaded_at < self.ttl
+        if not fresh:
+            self.rebuild(session)
+
+    def invalidate(self) -> None:
+        """Пометка индекса устаревшим: следующая проверка перестроит его из БД"""
+        with self._lock:
+            self._loaded_at = None
+
+    def _resources(self, hall_id: Optional[int], teacher_id: Optional[int], day: date):
+        if hall_id is not None:
+            yield ("hall", hall_id, day)
+        if teacher_id is not None:
+            yield ("teacher", teacher_id, day)
+
+    def _add(self, class_id: int, hall_id: Optional[int], teacher_id: int, day: date, start: int, end: int) -> None:
+        self._classes[class_id] = (hall_id, teacher_id, day, start, end)
+        for key in self._resources(hall_id, teacher_id, day):
+            insort(self._buckets.setdefault(key, []), (start, end, class_id))
+            self._max_duration[key] = max(self._max_duration.get(key, 0), end - start)
+
+    def _remove(self, class_id: int) -> None:
+        entry = self._classes.pop(class_id, None)
+        if entry is None:
+            return
+        hall_id, teacher_id, day, start, end = entry
+        for key in self._resources(hall_id, teacher_id, day):
+            bucket = self._buckets.get(key, [])
+            position = bisect_left(bucket, (start, end, class_id))
+            if position < len(bucket) and bucket[position] == (start, end, class_id):
+                del bucket[position]
+
+    def put(self, class_id: int, hall_id: Optional[int], teacher_id: int, day: date, start: int, end: int) -> None:
+        """Добавление или перемещение занятия в индексе"""
+        with self._lock:
+            self._remove(class_id)
+            self._add(class_id, hall_id, teacher_id, day, start, end)
+
+    def discard(self, class_id: int) -> None:
+        with self._lock:
+            self._remove(class_id)
+
+    def find(self, day: date, start: int, end: int, hall_id: Optional[int], teacher_id: Optional[int],
+             exclude_ids: Iterable[int] = ()) -> List[Dict[str, Any]]:
+        """Все занятия, пересекающиеся с [start, end) в этом зале или у этого преподавателя"""
+        exclude_ids = set(exclude_ids)
+        conflicts = []
+        with self._lock:
+            for key in self._resources(hall_id, teacher_id, day):
+                bucket = self._buckets.get(key)
+                if not bucket:
+                    continue
+                lo = bisect_left(bucket, (start - self._max_duration[key] + 1,))
+                hi = bisect_left(bucket, (end,))
+                for other_start, other_end, class_id in bucket[lo:hi]:
+                    if other_end > start and class_id not in exclude_ids:
+                        conflicts.append({
+                            "type": key[0],
+                            "class_id": class_id,
+                            "date": day.isoformat(),
+                            "start": format_minutes(other_start),
+                            "end": format_minutes(other_end)
+                        })
+            self.checks += 1
+            self.conflicts_found += len(conflicts)
+        return conflicts
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "classes": len(self._classes),
+                "buckets": len(self._buckets),
+                "rebuilds": self.rebuilds,
+                "checks": self.checks,
+                "conflicts_found": self.conflicts_found,
+                "age_seconds": round(time_module.monotonic() - self._loaded_at, 1) if self._loaded_at else None
+            }
+
+
+schedule_index = ScheduleIndex()
+
+
+def class_interval(start_time: time, duration_minutes: int) -> Tuple[int, int]:
+    """Интервал занятия в минутах; занятие должно закончиться до полуночи"""
+    start = to_minutes(start_time)
+    end = start + duration_minutes
+    if duration_minutes <= 0 or end > MINUTES_IN_DAY:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Занятие должно иметь положительную длительность и закончиться до полуночи"
+        )
+    return start, end
+
+
+def find_conflicts(session: Session, day: date, start_time: time, duration_minutes: int,
+                   hall_id: Optional[int], teacher_id: Optional[int],
+                   exclude_ids: Iterable[int] = ()) -> List[Dict[str, Any]]:
+    """Все пересечения занятия с расписанием зала и преподавателя"""
+    start, end = class_interval(start_time, duration_minutes)
+    schedule_index.ensure_loaded(session)
+    return schedule_index.find(day, start, end, hall_id, teacher_id, exclude_ids)
+
+
+def find_conflicts_many(session: Session, occurrences: Iterable[Tuple[date, time]], duration_minutes: int,
+                        hall_id: Optional[int], teacher_id: Optional[int],
+                        exclude_ids: Iterable[int] = ()) -> List[Dict[str, Any]]:
+    """Пересечения для набора занятий (дата, время) с одинаковыми залом, преподавателем и длительностью"""
+    schedule_index.ensure_loaded(session)
+    exclude_ids = set(exclude_ids)
+    conflicts = []
+    for day, start_time in occurrences:
+        start, end = class_interval(start_time, duration_minutes)
+        conflicts.extend(schedule_index.find(day, start, end, hall_id, teacher_id, exclude_ids))
+    return conflicts
+
+
+def lock_schedule(session: Session, hall_id: Optional[int], teacher_id: Optional[int]) -> None:
+    """
+    Блокировка расписания зала и преподавателя до конца транзакции. В PostgreSQL —
+    SELECT ... FOR UPDATE строк зала и преподавателя (всегда в этом порядке, чтобы
+    записи не блокировали друг друга взаимно). SQLite блокирует строки только вместе
+    со всей БД: пустой UPDATE сразу берет блокировку записи, и параллельная запись
+    ждет commit этой транзакции.
+    """
+    if session.get_bind().dialect.name == "sqlite":
+        table, row_id = (Halls.__table__, hall_id) if hall_id is not None else (Teachers.__table__, teacher_id)
+        session.exec(update(table).where(table.c.id == row_id).values(id=table.c.id))
+        return
+    if hall_id is not None:
+        session.exec(select(Halls.id).where(Halls.id == hall_id).with_for_update()).first()
+    if teacher_id is not None:
+        session.exec(select(Teachers.id).where(Teachers.id == teacher_id).with_for_update()).first()
+
+
+def find_conflicts_in_db(session: Session, occurrences: Iterable[Tuple[date, time]], duration_minutes: int,
+                         hall_id: Optional[int], teacher_id: Optional[int],
+                         exclude_ids: Iterable[int] = ()) -> List[Dict[str, Any]]:
+    """Пересечения по самой таблице classes (занятия этих дней в зале или у преподавателя)"""
+    occurrences = list(occurrences)
+    resources = []
+    if hall_id is not None:
+        resources.append(Classes.hall_id == hall_id)
+    if teacher_id is not None:
+        resources.append(Classes.teacher_id == teacher_id)
+    if not occurrences or not resources:
+        return []
+    rows = session.exec(
+        select(Classes.id, Classes.hall_id, Classes.teacher_id, Classes.date,
+               Classes.time, Classes.duration_minutes)
+        .where(Classes.date.in_({day for day, _ in occurrences}), or_(*resources))
+    ).all()
+    index = ScheduleIndex()
+    index.fill(rows)
+    exclude_ids = set(exclude_ids)
+    conflicts = []
+    for day, start_time in occurrences:
+        start, end = class_interval(start_time, duration_minutes)
+        conflicts.extend(index.find(day, start, end, hall_id, teacher_id, exclude_ids))
+    return conflicts
+
+
+def check_conflicts_locked(session: Session, occurrences: Iterable[Tuple[date, time]], duration_minutes: int,
+                           hall_id: Optional[int], teacher_id: Optional[int],
+                           exclude_ids: Iterable[int] = ()) -> None:
+    """
+    Окончательная проверка перед записью занятий: блокировка расписания зала и
+    преподавателя и поиск пересечений в БД; 409, если они есть. Вызывается в той же
+    транзакции, что и запись, — блокировка держится до commit
+    """
+    lock_schedule(session, hall_id, teacher_id)
+    raise_on_conflicts(find_conflicts_in_db(
+        session, occurrences, duration_minutes, hall_id, teacher_id, exclude_ids
+    ))
+
+
+def raise_on_conflicts(conflicts: List[Dict[str, Any]]) -> None:
+    """409 со списком всех пересечений, если они есть"""
+    if not conflicts:
+        return
+    subjects = {"hall": "Зал занят", "teacher": "Преподаватель занят"}
+    raise HTTPException(
+        status_code=status.HTTP_409_CONFLICT,
+        detail={
+            "message": "Конфликт расписания",
+            "errors": [
+                f"{subjects[c['type']]} {c['date']} с {c['start']} до {c['end']} (занятие {c['class_id']})"
+                for c in conflicts
+            ],
+            "conflicts": conflicts
+        }
+    )
+
+
+# Изменения занятий попадают в индекс после commit; при откате индекс не меняется
+_CLASS_CHANGES = "schedule_index_changes"
+
+
+def record_class_changes(session: Session, changes: Dict[int, Optional[Tuple]]) -> None:
+    """
+    Изменения занятий, записанные мимо ORM (insert/update/delete через Core), для
+    индекса после commit: class_id -> (hall_id, teacher_id, date, начало, конец) или None
+    """
+    session.info.setdefault(_CLASS_CHANGES, {}).update(changes)
+
+
+def _remember_class_change(target, deleted: bool = False) -> None:
+    session = object_session(target)
+    if session is None:
+        return
+    changes = session.info.setdefault(_CLASS_CHANGES, {})
+    if deleted:
+        changes[target.id] = None
+    else:
+        start = to_minutes(target.time)
+        changes[target.id] = (target.hall_id, target.teacher_id, target.date,
+                              start, start + (target.duration_minutes or DEFAULT_DURATION_MINUTES))
+
+
+@event.listens_for(Classes, "after_insert")
+@event.listens_for(Classes, "after_update")
+def _class_saved(mapper, connection, target):
+    _remember_class_change(target)
+
+
+@event.listens_for(Classes, "after_delete")
+def _class_deleted(mapper, connection, target):
+    _remember_class_change(target, deleted=True)
+
+
+@event.listens_for(OrmSession, "after_commit")
+def _apply_class_changes(session):
+    for class_id, entry in session.info.pop(_CLASS_CHANGES, {}).items():
+        if entry is None:
+            schedule_index.discard(class_id)
+        else:
+            schedule_index.put(class_id, *entry)
+
+
+@event.listens_for(OrmSession, "after_soft_rollback")
+def _discard_class_changes(session, previous_transaction):
+    session.info.pop(_CLASS_CHANGES, None)
@@ -0,0 +1,397 @@
+# Атомарная запись студента на занятие.
+# Свободное место, абонемент на дату занятия и отсутствие повторной записи проверяются
+# в условии одного UPDATE classes ... RETURNING, который сразу занимает место.
+# Параллельные записи на одно занятие упираются в блокировку строки classes, и каждая
+# следующая видит уже увеличенный current_capacity, поэтому мест не бывает больше,
+# чем вмещает зал. Повторную запись одного студента отсекает уникальный индекс
+# uq_attendance_student_class. Оба запроса идут в одной транзакции.
+import os
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional
+
+from fastapi import HTTPException, status
+from sqlalchemy import exists, func, insert, select, update
+from sqlalchemy.exc import IntegrityError
+
+from ll1 import Attendance, AttendanceStatus, Classes, Halls, Subscriptions, SubscriptionStatus
+
+classes_table = Classes.__table__
+halls_table = Halls.__table__
+subscriptions_table = Subscriptions.__table__
+attendance_table = Attendance.__table__
+
+MAX_BULK_ENROLLMENTS = int(os.environ.get("MAX_BULK_ENROLLMENTS", "366"))
+ALL_OR_NOTHING = "all_or_nothing"
+BEST_EFFORT = "best_effort"
+
+
+def _hall_capacity():
+    return (
+        select(halls_table.c.capacity)
+        .where(halls_table.c.id == classes_table.c.hall_id)
+        .scalar_subquery()
+    )
+
+
+def usable_subscription_conditions(class_date=classes_table.c.date) -> list:
+    """Условия на строку subscriptions: активный абонемент с оставшимися занятиями,
+    действующий на дату занятия (столбец classes.date или конкретная дата)"""
+    return [
+        subscriptions_table.c.status == SubscriptionStatus.ACTIVE,
+        subscriptions_table.c.remaining_classes > 0,
+        subscriptions_table.c.start_date <= class_date,
+        subscriptions_table.c.end_date >= class_date
+    ]
+
+
+def _has_subscription(student_id: int):
+    """Активный абонемент с оставшимися занятиями, действующий на дату занятия"""
+    return exists().where(subscriptions_table.c.student_id == student_id, *usable_subscription_conditions())
+
+
+def _already_enrolled(student_id: int, class_id):
+    return exists().where(
+        attendance_table.c.student_id == student_id,
+        attendance_table.c.class_id == class_id
+    )
+
+
+def seat_conditions(student_id: int, class_id: int) -> list:
+    """Условия записи: есть место, есть абонемент на дату занятия, студент еще не записан"""
+    return [
+        classes_table.c.id == class_id,
+        classes_table.c.current_capacity < _hall_capacity(),
+        _has_subscription(student_id),
+        ~_already_enrolled(student_id, class_id)
+    ]
+
+
+def take_seat_statement(student_id: int, class_id: int, now: datetime):
+    """UPDATE, занимающий место только при выполнении всех условий записи"""
+    return (
+        update(classes_table)
+        .where(*seat_conditions(student_id, class_id))
+        .values(current_capacity=classes_table.c.current_capacity + 1, updated_at=now)
+        .returning(
+            classes_table.c.id, classes_table.c.date, classes_table.c.type, classes_table.c.teacher_id,
+            classes_table.c.hall_id, classes_table.c.current_capacity
+        )
+    )
+
+
+def attendance_statement(student_id: int, class_id: int, teacher_id: int, now: datetime):
+    return (
+        insert(attendance_table)
+        .values(
+            student_id=student_id, class_id=class_id, teacher_id=teacher_id,
+            presence=AttendanceStatus.REGISTERED, created_at=now, updated_at=now
+        )
+        .returning(attendance_table.c.id)
+    )
+
+
+def diagnose_statement(student_id: int, class_id: int):
+    """Причина отказа: читается только если UPDATE не занял место"""
+    return select(
+        classes_table.c.id,
+        classes_table.c.date,
+        classes_table.c.current_capacity,
+        _hall_capacity().label("capacity"),
+        _has_subscription(student_id).label("has_subscription"),
+        _already_enrolled(student_id, class_id).label("already_enrolled")
+    ).where(classes_table.c.id == class_id)
+
+
+def rejection(row: Optional[Any]) -> HTTPException:
+    if row is None:
+        return HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Занятие не найдено")
+    if row.already_enrolled:
+        return HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Студент уже записан на это занятие")
+    if row.capacity is None:
+        return HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Зал не найден")
+    if row.current_capacity >= row.capacity:
+        return HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Зал уже заполнен")
+    if not row.has_subscription:
+        return HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Нет активного абонемента с оставшимися занятиями на дату занятия"
+        )
+    # Условия изменились между UPDATE и проверкой (например, освободилось место)
+    return HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Не удалось записаться, попробуйте еще раз")
+
+
+def enrollment_result(seat: Any, attendance_id: int) -> Dict[str, Any]:
+    return {
+        "attendance_id": attendance_id,
+        "class_id": seat.id,
+        "date": seat.date,
+        "type": seat.type,
+        "teacher_id": seat.teacher_id,
+        "hall_id": seat.hall_id,
+        "current_capacity": seat.current_capacity
+    }
+
+
+DUPLICATE = HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Студент уже записан на это занятие")
+
+
+def take_seats_statement(student_id: int, class_ids: List[int], now: datetime):
+    """Один UPDATE, занимающий места сразу на всех занятиях, где выполнены условия записи.
+    Абонемент проверяется для даты каждого занятия отдельно, как и при одиночной записи"""
+    return (
+        update(classes_table)
+        .where(
+            classes_table.c.id.in_(class_ids),
+            classes_table.c.current_capacity < _hall_capacity(),
+            _has_subscription(student_id),
+            ~_already_enrolled(student_id, classes_table.c.id)
+        )
+        .values(current_capacity=classes_table.c.current_capacity + 1, updated_at=now)
+        .returning(
+            classes_table.c.id, classes_table.c.date, classes_table.c.type, classes_table.c.teacher_id,
+            classes_table.c.hall_id, classes_table.c.current_capacity
+        )
+    )
+
+
+def take_seats_each_statement(student_of_class, class_ids: List[int], now: datetime):
+    """
+    Один UPDATE, занимающий по месту на каждом занятии для своего студента (например, для
+    первого в очереди): student_of_class — скалярный подзапрос, связанный с classes.id
+    """
+    return (
+        update(classes_table)
+        .where(
+            classes_table.c.id.in_(class_ids),
+            classes_table.c.current_capacity < _hall_capacity(),
+            _has_subscription(student_of_class),
+            ~_already_enrolled(student_of_class, classes_table.c.id)
+        )
+        .values(current_capacity=classes_table.c.current_capacity + 1, updated_at=now)
+        .returning(
+            classes_table.c.id, classes_table.c.teacher_id, classes_table.c.current_capacity,
+            _hall_capacity().label("capacity")
+        )
+    )
+
+
+def diagnose_many_statement(student_id: int, class_ids: List[int]):
+    return select(
+        classes_table.c.id,
+        classes_table.c.date,
+        classes_table.c.current_capacity,
+        _hall_capacity().label("capacity"),
+        _has_subscription(student_id).label("has_subscription"),
+        _already_enrolled(student_id, classes_table.c.id).label("already_enrolled")
+    ).where(classes_table.c.id.in_(class_ids))
+
+
+def enroll_many(session, student_id: int, class_ids: Iterable[int], mode: str = ALL_OR_NOTHING) -> Dict[str, Any]:
+    """
+    Запись студента сразу на несколько занятий в одной транзакции (для синхронной Session,
+    из async-эндпоинтов — через run_sync). Строки занятий блокируются одним
+    SELECT ... FOR UPDATE в порядке id (без взаимных блокировок с параллельными массовыми
+    записями), места занимаются одним UPDATE с проверкой абонемента на дату каждого занятия,
+    записи в attendance вставляются одним INSERT.
+
+    all_or_nothing: если хотя бы на одно занятие записаться нельзя, не записывается ничего (409).
+    best_effort: записывается на все, на что можно, по остальным возвращается причина.
+    Возвращает {"enrolled", "rejected", "results"} с результатом по каждому занятию.
+    """
+    class_ids = list(dict.fromkeys(class_ids))
+    if not class_ids:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Не выбрано ни одного занятия")
+    if len(class_ids) > MAX_BULK_ENROLLMENTS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"За один раз можно записаться не больше чем на {MAX_BULK_ENROLLMENTS} занятий"
+        )
+
+    now = datetime.now()
+    try:
+        session.exec(
+            select(classes_table.c.id)
+            .where(classes_table.c.id.in_(class_ids))
+            .order_by(classes_table.c.id)
+            .with_for_update()
+        ).all()
+        seats = {
+            seat.id: seat
+            for seat in session.exec(take_seats_statement(student_id, class_ids, now)).all()
+        }
+
+        reasons = {}
+        missing = [class_id for class_id in class_ids if class_id not in seats]
+        if missing:
+            rows = {row.id: row for row in session.exec(diagnose_many_statement(student_id, missing)).all()}
+            reasons = {class_id: rejection(rows.get(class_id)).detail for class_id in missing}
+
+        if reasons and (mode == ALL_OR_NOTHING or not seats):
+            session.rollback()
+            results = [
+                {"class_id": class_id, "status": "rejected", "detail": reasons[class_id]} if class_id in reasons
+                else {"class_id": class_id, "status": "rolled_back"}
+                for class_id in class_ids
+            ]
+            if mode == ALL_OR_NOTHING:
+                raise HTTPException(
+                    status_code=status.HTTP_409_CONFLICT,
+                    detail={
+                        "message": "Запись не выполнена: на часть занятий записаться нельзя",
+                        "errors": [f"Занятие {class_id}: {detail}" for class_id, detail in reasons.items()],
+                        "results": results
+                    }
+                )
+            return {"enrolled": 0, "rejected": len(reasons), "results": results}
+
+        attendance_ids = {}
+        if seats:
+            attendance_ids = dict(session.exec(
+                insert(attendance_table)
+                .values([
+                    {
+                        "student_id": student_id, "class_id": seat.id, "teacher_id": seat.teacher_id,
+                        "presence": AttendanceStatus.REGISTERED, "created_at": now, "updated_at": now
+                    }
+                    for seat in seats.values()
+                ])
+                .returning(attendance_table.c.class_id, attendance_table.c.id)
+            ).all())
+        session.commit()
+    except IntegrityError:
+        session.rollback()
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Не удалось записаться, попробуйте еще раз")
+
+    results = []
+    for class_id in class_ids:
+        if class_id in seats:
+            results.append({"status": "enrolled", **enrollment_result(seats[class_id], attendance_ids[class_id])})
+        else:
+            results.append({"class_id": class_id, "status": "rejected", "detail": reasons[class_id]})
+    return {"enrolled": len(seats), "rejected": len(reasons), "results": results}
+
+
+async def enroll_student(session, student_id: int, class_id: int) -> Dict[str, Any]:
+    """Запись через AsyncSession: UPDATE с условиями и INSERT в attendance, одна транзакция"""
+    now = datetime.now()
+    try:
+        seat = (await session.exec(take_seat_statement(student_id, class_id, now))).first()
+        if seat is None:
+            reason = (await session.exec(diagnose_statement(student_id, class_id))).first()
+            await session.rollback()
+            raise rejection(reason)
+        attendance_id = (await session.exec(
+            attendance_statement(student_id, class_id, seat.teacher_id, now)
+        )).scalar_one()
+        await session.commit()
+    except IntegrityError:
+        await session.rollback()
+        raise DUPLICATE
+    return enrollment_result(seat, attendance_id)
+
+
+def enroll_student_sync(session, student_id: int, class_id: int) -> Dict[str, Any]:
+    """То же для синхронной Session"""
+    now = datetime.now()
+    try:
+        seat = session.exec(take_seat_statement(student_id, class_id, now)).first()
+        if seat is None:
+            reason = session.exec(diagnose_statement(student_id, class_id)).first()
+            session.rollback()
+            raise rejection(reason)
+        attendance_id = session.exec(
+            attendance_statement(student_id, class_id, seat.teacher_id, now)
+        ).scalar_one()
+        session.commit()
+    except IntegrityError:
+        session.rollback()
+        raise DUPLICATE
+    return enrollment_result(seat, attendance_id)
+
+
+if __name__ == "__main__":
+    # Проверка под нагрузкой: 200 одновременных записей разных студентов на занятие
+    # в зале на 20 мест, затем 20 одновременных попыток одного студента на другое занятие.
+    # Создает свои зал, занятие и студентов — запускать на отдельной БД:
+    #   DATABASE_URL=sqlite:////tmp/enrollment.db python backend/enrollment.py
+    #   DATABASE_URL=postgresql://.../enrollment_test python backend/enrollment.py
+    import asyncio
+    from collections import Counter
+    from datetime import date, time, timedelta
+    from time import perf_counter
+
+    from sqlmodel import Session, SQLModel
+
+    from ll1 import (
+        Gender, PaymentMethod, Payments, Students, Teachers, UserRole, Users,
+        async_session, engine
+    )
+
+    STUDENTS = 200
+    SEATS = 20
+
+    SQLModel.metadata.create_all(engine)
+    tag = datetime.now().strftime("%Y%m%d%H%M%S%f")
+    with Session(engine) as session:
+        teacher_user = Users(email=f"enroll-teacher-{tag}@example.local", password_hash="-", role=UserRole.TEACHER)
+        session.add(teacher_user)
+        session.flush()
+        teacher = Teachers(user_id=teacher_user.id, full_name="Нагрузочный тест", experience=1,
+                           specialization="test", phone="+70000000000")
+        hall = Halls(hall_number=int(tag[-9:]), capacity=SEATS, description="Нагрузочный тест")
+        session.add_all([teacher, hall])
+        session.flush()
+        class_ = Classes(time=time(12, 0), type="Test", hall_id=hall.id, teacher_id=teacher.id,
+                         date=date.today() + timedelta(days=1))
+        other_class = Classes(time=time(14, 0), type="Test", hall_id=hall.id, teacher_id=teacher.id,
+                              date=date.today() + timedelta(days=1))
+        session.add_all([class_, other_class])
+        student_ids = []
+        for n in range(STUDENTS):
+            user = Users(email=f"enroll-{tag}-{n}@example.local", password_hash="-", role=UserRole.STUDENT)
+            session.add(user)
+            session.flush()
+            student = Students(user_id=user.id, full_name=f"Студент {n}", date_of_birth=date(2000, 1, 1),
+                               gender=Gender.FEMALE, phone="+70000000000")
+            session.add(student)
+            session.flush()
+            payment = Payments(student_id=student.id, amount=1, payment_method=PaymentMethod.CARD)
+            session.add(payment)
+            session.flush()
+            session.add(Subscriptions(student_id=student.id, payment_id=payment.id, status=SubscriptionStatus.ACTIVE,
+                                      end_date=date.today() + timedelta(days=30)))
+            student_ids.append(student.id)
+        session.commit()
+        class_id, other_class_id = class_.id, other_class.id
+
+    async def attempt(student_id: int, class_id: int = class_id):
+        async with async_session() as session:
+            try:
+                await enroll_student(session, student_id, class_id)
+                return "записан"
+            except HTTPException as e:
+                return e.detail
+
+    async def burst(ids, class_id=class_id):
+        started = perf_counter()
+        outcomes = await asyncio.gather(*(attempt(student_id, class_id) for student_id in ids))
+        return Counter(outcomes), perf_counter() - started
+
+    async def scenario():
+        outcomes, elapsed = await burst(student_ids)
+        print(f"{STUDENTS} одновременных записей на {SEATS} мест за {elapsed * 1000:.0f} мс: {dict(outcomes)}")
+        duplicates, elapsed = await burst([student_ids[0]] * SEATS, other_class_id)
+        print(f"{SEATS} одновременных записей одного студента: {dict(duplicates)}")
+        return outcomes, duplicates
+
+    outcomes, duplicates = asyncio.run(scenario())
+
+    with Session(engine) as session:
+        capacity = session.get(Classes, class_id).current_capacity
+        enrolled = session.exec(
+            select(func.count()).select_from(attendance_table).where(attendance_table.c.class_id == class_id)
+        ).scalar_one()
+    print(f"current_capacity={capacity}, записей в attendance={enrolled}")
+    assert outcomes["записан"] == SEATS and capacity == SEATS and enrolled == SEATS
+    assert duplicates["записан"] == 1
+    print("OK: мест занято ровно столько, сколько вмещает зал")
@@ -0,0 +1,131 @@
+# Импорт необходимых модулей
+import asyncio
+import functools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict
+
+
+class ExecutorSaturated(Exception):
+    """Пул и очередь ожидания заполнены — задачу нужно отклонить"""
+
+
+class BoundedExecutor:
+    """
+    Пул потоков с ограниченной очередью для тяжелых синхронных задач
+    (проверка bcrypt, синхронные запросы к БД), чтобы не блокировать event loop.
+    Если в работе и в очереди уже max_workers + max_queue задач, новая задача
+    сразу отклоняется с ExecutorSaturated.
+    """
+
+    def __init__(self, max_workers: int = 4, max_queue: int = 32, name: str = "executor"):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.name = name
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        self._slots = threading.BoundedSemaphore(max_workers + max_queue)
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+        self.total_seconds = 0.0
+
+    async def run(self, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        """Выполнение fn в пуле; при переполнении — ExecutorSaturated без ожидания"""
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            raise ExecutorSaturated(f"{self.name}: пул и очередь заполнены")
+
+        with self._lock:
+            self.in_flight += 1
+        started = time.perf_counter()
+
+        def release(_future) -> None:
+            # Слот освобождается, когда задача действительно закончилась в потоке, а не когда
+            # ожидающая корутина отменена: отмена не останавливает уже начатый bcrypt
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                self.in_flight -= 1
+                self.completed += 1
+                self.total_seconds += elapsed
+            self._slots.release()
+
+        try:
+            future = self._executor.submit(functools.partial(fn, *args, **kwargs))
+        except BaseException:
+            release(None)
+            raise
+        future.add_done_callback(release)
+        return await asyncio.wrap_future(future)
+
+    def stats(self) -> Dict[str, Any]:
+        """Счетчики пула"""
+        with self._lock:
+            return {
+                "max_workers": self.max_workers,
+                "max_queue": self.max_queue,
+                "in_flight": self.in_flight,
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "avg_ms": round(self.total_seconds / self.completed * 1000, 2) if self.completed else 0.0
+            }
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False)
+
+
+if __name__ == "__main__":
+    # Бенчмарк: всплеск логинов и параллельные легкие запросы (/classes/) до и после
+    from passlib.context import CryptContext
+
+    pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+    password_hash = pwd_context.hash("benchmark-password")
+    LOGINS = 16
+    TICK = 0.005
+
+    def percentile(values, p):
+        values = sorted(values)
+        return values[min(len(values) - 1, int(len(values) * p))] * 1000
+
+    async def probe_classes(latencies, done):
+        # Имитация дешевого запроса к /classes/ каждые 5 мс: задержка = опоздание относительно плана
+        expected = time.perf_counter()
+        while not done.is_set():
+            expected += TICK
+            await asyncio.sleep(max(0.0, expected - time.perf_counter()))
+            latencies.append(max(0.0, time.perf_counter() - expected))
+
+    async def scenario(executor):
+        login_latencies, probe_latencies = [], []
+        done = asyncio.Event()
+
+        async def login(burst_started):
+            if executor is None:
+                pwd_context.verify("benchmark-password", password_hash)
+            else:
+                try:
+                    await executor.run(pwd_context.verify, "benchmark-password", password_hash)
+                except ExecutorSaturated:
+                    pass
+            login_latencies.append(time.perf_counter() - burst_started)
+
+        probe = asyncio.create_task(probe_classes(probe_latencies, done))
+        await asyncio.sleep(0.05)
+        burst_started = time.perf_counter()
+        await asyncio.gather(*(login(burst_started) for _ in range(LOGINS)))
+        done.set()
+        await probe
+        return login_latencies, probe_latencies
+
+    for title, executor in (
+        ("до (bcrypt в event loop)", None),
+        ("после (BoundedExecutor)", BoundedExecutor(max_workers=4, max_queue=LOGINS, name="auth")),
+    ):
+        logins, probes = asyncio.run(scenario(executor))
+        print(f"{title}: login p50={percentile(logins, 0.5):.1f} мс, p99={percentile(logins, 0.99):.1f} мс; "
+              f"/classes/ p99={percentile(probes, 0.99):.1f} мс, max={max(probes) * 1000:.1f} мс")
+        if executor is not None:
+            print(f"  {executor.stats()}")
+            executor.shutdown()
@@ -0,0 +1,290 @@
+# Выгрузка attendance, classes, payments и subscriptions в колоночные файлы для аналитики
+# (Parquet или Arrow IPC) с разбиением по месяцам:
+#   EXPORT_DIR/<таблица>/month=ГГГГ-ММ/part.parquet (или part.arrow)
+# Такой каталог читают pyarrow.dataset, pandas, DuckDB и Spark как одну таблицу с колонкой month.
+#
+# Таблица читается одним запросом с курсором на стороне сервера (stream_results) пачками
+# по EXPORT_BATCH_ROWS строк, каждая пачка сразу пишется в файл своего месяца — память
+# не зависит от размера таблицы.
+#
+# Повторный запуск дописывает только новое: месяцы до текущего считаются закрытыми и
+# после выгрузки больше не читаются (граница хранится в <таблица>/_manifest.json), а
+# текущий и будущие месяцы перезаписываются при каждом запуске. Изменения строк уже
+# закрытых месяцев (например, отметка посещаемости задним числом) попадут в файлы
+# только при полной выгрузке --full.
+#
+# Запуск:
+#   python backend/export.py                          — все таблицы в EXPORT_DIR
+#   python backend/export.py attendance payments      — только указанные таблицы
+#   python backend/export.py --full --format arrow    — перезаписать все месяцы, Arrow IPC
+#
+# Нужен pyarrow (pip install pyarrow); без него приложение работает, а выгрузка сообщает,
+# что его нужно установить.
+import argparse
+import json
+import os
+import resource
+import shutil
+import sys
+from datetime import date, datetime
+from enum import Enum
+from time import perf_counter
+from typing import Any, Dict, Iterable, List, Optional
+
+from sqlalchemy import Boolean, Date, DateTime, Float, Integer, Numeric, Time, select
+from sqlalchemy import Enum as EnumType
+from sqlalchemy.engine import Connection, Engine
+
+from ll1 import Attendance, Classes, Payments, Subscriptions, engine
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:  # pyarrow необязателен: нужен только для выгрузки
+    pyarrow = None
+
+EXPORT_DIR = os.environ.get("EXPORT_DIR", "exports")
+EXPORT_BATCH_ROWS = int(os.environ.get("EXPORT_BATCH_ROWS", "10000"))
+EXPORT_FORMAT = os.environ.get("EXPORT_FORMAT", "parquet")
+
+PARQUET = "parquet"
+ARROW = "arrow"
+FORMATS = (PARQUET, ARROW)
+
+# Таблица -> (модель, колонка, по месяцу которой строка попадает в раздел)
+EXPORT_TABLES = {
+    "attendance": (Attendance, "created_at"),
+    "classes": (Classes, "date"),
+    "payments": (Payments, "payment_date"),
+    "subscriptions": (Subscriptions, "start_date"),
+}
+
+MANIFEST = "_manifest.json"
+
+
+def month_key(value: date) -> str:
+    return f"{value.year:04d}-{value.month:02d}"
+
+
+def next_month_start(key: str) -> date:
+    year, month = (int(part) for part in key.split("-"))
+    return date(year + month // 12, month % 12 + 1, 1)
+
+
+def arrow_type(column) -> "pyarrow.DataType":
+    """Тип Arrow для колонки SQLAlchemy; перечисления выгружаются значениями (как в API)"""
+    column_type = column.type
+    if isinstance(column_type, EnumType):
+        return pyarrow.string()
+    if isinstance(column_type, Boolean):
+        return pyarrow.bool_()
+    if isinstance(column_type, Integer):
+        return pyarrow.int64()
+    if isinstance(column_type, (Float, Numeric)):
+        return pyarrow.float64()
+    if isinstance(column_type, DateTime):
+        return pyarrow.timestamp("us")
+    if isinstance(column_type, Date):
+        return pyarrow.date32()
+    if isinstance(column_type, Time):
+        return pyarrow.time64("us")
+    return pyarrow.string()
+
+
+def table_schema(table) -> "pyarrow.Schema":
+    return pyarrow.schema([
+        pyarrow.field(column.name, arrow_type(column), nullable=column.nullable)
+        for column in table.columns
+    ])
+
+
+def to_batch(rows: List[Any], schema: "pyarrow.Schema") -> "pyarrow.RecordBatch":
+    """Строки результата -> RecordBatch по схеме таблицы"""
+    arrays = []
+    for position, field in enumerate(schema):
+        values = [row[position] for row in rows]
+        if pyarrow.types.is_string(field.type):
+            values = [
+                value.value if isinstance(value, Enum) else (None if value is None else str(value))
+                for value in values
+            ]
+        arrays.append(pyarrow.array(values, type=field.type))
+    return pyarrow.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+class PartitionWriter:
+    """Файл одного месяца: пишется во временный файл и подменяет прежний только целиком"""
+
+    def __init__(self, directory: str, schema: "pyarrow.Schema", fmt: str):
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, f"part.{fmt}")
+        self.temporary_path = self.path + ".tmp"
+        if fmt == PARQUET:
+            self._writer = pyarrow.parquet.ParquetWriter(self.temporary_path, schema, compression="zstd")
+        else:
+            self._writer = pyarrow.ipc.new_file(self.temporary_path, schema)
+        self.rows = 0
+
+    def write(self, batch: "pyarrow.RecordBatch") -> None:
+        self._writer.write_batch(batch)
+        self.rows += batch.num_rows
+
+    def close(self) -> None:
+        self._writer.close()
+        os.replace(self.temporary_path, self.path)
+
+
+def read_manifest(directory: str) -> Dict[str, Any]:
+    try:
+        with open(os.path.join(directory, MANIFEST), encoding="utf-8") as manifest_file:
+            return json.load(manifest_file)
+    except FileNotFoundError:
+        return {}
+
+
+def write_manifest(directory: str, manifest: Dict[str, Any]) -> None:
+    path = os.path.join(directory, MANIFEST)
+    with open(path + ".tmp", "w", encoding="utf-8") as manifest_file:
+        json.dump(manifest, manifest_file, ensure_ascii=False, indent=2, sort_keys=True)
+    os.replace(path + ".tmp", path)
+
+
+def export_table(
+    connection: Connection,
+    name: str,
+    out_dir: str = EXPORT_DIR,
+    fmt: str = EXPORT_FORMAT,
+    full: bool = False,
+    batch_rows: int = EXPORT_BATCH_ROWS,
+    today: Optional[date] = None
+) -> Dict[str, Any]:
+    """
+    Выгрузка одной таблицы по месяцам. Возвращает сводку: сколько строк прочитано,
+    какие месяцы записаны и по какой месяц включительно выгрузка пропущена как закрытая
+    """
+    if pyarrow is None:
+        raise RuntimeError("Для выгрузки нужен pyarrow: pip install pyarrow")
+    if fmt not in FORMATS:
+        raise ValueError(f"Формат выгрузки: {', '.join(FORMATS)}")
+
+    model, partition_column = EXPORT_TABLES[name]
+    table = model.__table__
+    column = table.c[partition_column]
+    schema = table_schema(table)
+    directory = os.path.join(out_dir, name)
+    current_month = month_key(today or date.today())
+
+    manifest = read_manifest(directory)
+    if full or manifest.get("format") != fmt:
+        # Полная выгрузка: прежние файлы (в том числе другого формата) удаляются
+        if os.path.isdir(directory):
+            for entry in os.listdir(directory):
+                if entry.startswith("month="):
+                    shutil.rmtree(os.path.join(directory, entry))
+        manifest = {"format": fmt, "closed_through": None, "partitions": {}}
+    closed_through = manifest["closed_through"]
+
+    statement = select(table).order_by(column, table.c.id)
+    if closed_through:
+        # Закрытые месяцы уже выгружены: читаем со следующего
+        first_month = next_month_start(closed_through)
+        if isinstance(column.type, DateTime):
+            first_month = datetime.combine(first_month, datetime.min.time())
+        statement = statement.where(column >= first_month)
+
+    position = list(table.columns).index(column)
+    written: List[str] = []
+    rows_read = 0
+    writer: Optional[PartitionWriter] = None
+    writer_month = None
+
+    def finish_partition():
+        writer.close()
+        manifest["partitions"][writer_month] = {
+            "rows": writer.rows,
+            "closed": writer_month < current_month,
+            "exported_at": datetime.now().isoformat(timespec="seconds")
+        }
+        written.append(writer_month)
+
+    result = connection.execution_options(stream_results=True, max_row_buffer=batch_rows).execute(statement)
+    for rows in result.partitions(batch_rows):
+        rows_read += len(rows)
+        # Строки упорядочены по колонке раздела: пачка режется на куски по месяцам
+        start = 0
+        while start < len(rows):
+            month = month_key(rows[start][position])
+            end = start + 1
+            while end < len(rows) and month_key(rows[end][position]) == month:
+                end += 1
+            if month != writer_month:
+                if writer is not None:
+                    finish_partition()
+                writer = PartitionWriter(os.path.join(directory, f"month={month}"), schema, fmt)
+                writer_month = month
+            writer.write(to_batch(rows[start:end], schema))
+            start = end
+    if writer is not None:
+        finish_partition()
+
+    # Открытый месяц, в котором строк больше нет (например, отменены все будущие занятия)
+    for month, info in list(manifest["partitions"].items()):
+        if not info["closed"] and month not in written:
+            partition_path = os.path.join(directory, f"month={month}", f"part.{fmt}")
+            if os.path.exists(partition_path):
+                os.remove(partition_path)
+            del manifest["partitions"][month]
+
+    closed = [month for month, info in manifest["partitions"].items() if info["closed"]]
+    manifest["closed_through"] = max(closed) if closed else closed_through
+    os.makedirs(directory, exist_ok=True)
+    write_manifest(directory, manifest)
+    return {
+        "table": name,
+        "rows": rows_read,
+        "partitions": written,
+        "skipped_through": closed_through
+    }
+
+
+def export_all(
+    tables: Optional[Iterable[str]] = None,
+    out_dir: str = EXPORT_DIR,
+    fmt: str = EXPORT_FORMAT,
+    full: bool = False,
+    db_engine: Optional[Engine] = None
+) -> List[Dict[str, Any]]:
+    """Выгрузка таблиц, каждая — отдельным потоковым запросом"""
+    summaries = []
+    for name in tables or EXPORT_TABLES:
+        with (db_engine or engine).connect() as connection:
+            summaries.append(export_table(connection, name, out_dir, fmt, full))
+    return summaries
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Выгрузка таблиц в Parquet/Arrow по месяцам")
+    parser.add_argument("tables", nargs="*", help=f"таблицы: {', '.join(EXPORT_TABLES)} (по умолчанию все)")
+    parser.add_argument("--out", default=EXPORT_DIR, help="каталог выгрузки (EXPORT_DIR)")
+    parser.add_argument("--format", default=EXPORT_FORMAT, choices=FORMATS, help="формат файлов (EXPORT_FORMAT)")
+    parser.add_argument("--full", action="store_true", help="перезаписать все месяцы, включая закрытые")
+    args = parser.parse_args()
+    unknown = [name for name in args.tables if name not in EXPORT_TABLES]
+    if unknown:
+        parser.error(f"неизвестные таблицы: {', '.join(unknown)}")
+
+    if pyarrow is None:
+        print("Для выгрузки нужен pyarrow: pip install pyarrow")
+        sys.exit(2)
+    for name in args.tables or EXPORT_TABLES:
+        started = perf_counter()
+        summary = export_all([name], args.out, args.format, args.full)[0]
+        months = summary["partitions"]
+        print(
+            f"{name}: {summary['rows']} строк за {perf_counter() - started:.1f} с, "
+            f"месяцев записано {len(months)}"
+            + (f" ({months[0]} — {months[-1]})" if months else "")
+            + (f", закрытые по {summary['skipped_through']} пропущены" if summary["skipped_through"] else "")
+        )
+    print(f"Пиковый RSS: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} МБ")
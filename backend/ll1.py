@@ -10,8 +10,19 @@ from pydantic import EmailStr, constr, validator
 from enum import Enum
 from sqlmodel import Session, create_engine
 import os
+import random
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from time import perf_counter
 from dotenv import load_dotenv
-from sqlalchemy import text
+from sqlalchemy import text, event, DDL, Index, PrimaryKeyConstraint
+from sqlalchemy.orm import Session as OrmSession, object_session
+from sqlalchemy.engine import Engine, URL, make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
+from sqlmodel.ext.asyncio.session import AsyncSession
+from cache import TTLCache
 
 # Настройка подключения к базе данных
 load_dotenv()
@@ -19,10 +30,267 @@ database_url = os.environ.get('DATABASE_URL')
 if not database_url:
     raise RuntimeError('DATABASE_URL is not set in environment')
 
-engine = create_engine(
-    database_url,
-    echo=True  # Включаем логирование SQL-запросов для отладки
-)
+# Профили движка БД. Выбирается через DB_PROFILE, любое значение можно
+# переопределить переменной окружения DB_<ПАРАМЕТР> (например, DB_POOL_SIZE=30).
+# sql_log: all — все запросы, sample — доля sql_log_sample_rate, slow — только
+# запросы дольше slow_query_ms, off — без логов.
+ENGINE_PROFILES = {
+    "dev": {
+        "pool_size": 5,
+        "max_overflow": 5,
+        "pool_timeout": 30,
+        "pool_recycle": 1800,
+        "pool_pre_ping": True,
+        "statement_timeout_ms": 0,
+        "sql_log": "all",
+        "sql_log_sample_rate": 1.0,
+        "slow_query_ms": 200,
+    },
+    "prod": {
+        "pool_size": 20,
+        "max_overflow": 10,
+        "pool_timeout": 10,
+        "pool_recycle": 1800,
+        "pool_pre_ping": True,
+        "statement_timeout_ms": 5000,
+        "sql_log": "slow",
+        "sql_log_sample_rate": 0.01,
+        "slow_query_ms": 200,
+    },
+    "bench": {
+        "pool_size": 50,
+        "max_overflow": 0,
+        "pool_timeout": 30,
+        "pool_recycle": 3600,
+        "pool_pre_ping": False,
+        "statement_timeout_ms": 0,
+        "sql_log": "off",
+        "sql_log_sample_rate": 0.0,
+        "slow_query_ms": 1000,
+    },
+}
+
+def get_engine_settings(profile: Optional[str] = None) -> dict:
+    """Настройки движка: профиль + переопределения из переменных окружения"""
+    profile = profile or os.environ.get('DB_PROFILE', 'dev')
+    if profile not in ENGINE_PROFILES:
+        raise RuntimeError(f'Unknown DB_PROFILE: {profile}')
+    settings = dict(ENGINE_PROFILES[profile], profile=profile)
+    for name, default in ENGINE_PROFILES[profile].items():
+        value = os.environ.get(f'DB_{name.upper()}')
+        if value is None:
+            continue
+        if isinstance(default, bool):
+            settings[name] = value.lower() in ('1', 'true', 'yes', 'on')
+        else:
+            settings[name] = type(default)(value)
+    return settings
+
+class EngineStats:
+    """Счетчики пула соединений и SQL-запросов"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.checked_out = 0
+        self.max_checked_out = 0
+        self.saturated_checkouts = 0
+        self.checkout_wait_total = 0.0
+        self.checkout_wait_max = 0.0
+        self.queries = 0
+        self.slow_queries = 0
+
+    def record_checkout(self, wait: float, saturated: bool):
+        with self._lock:
+            self.checkouts += 1
+            self.checked_out += 1
+            self.max_checked_out = max(self.max_checked_out, self.checked_out)
+            self.checkout_wait_total += wait
+            self.checkout_wait_max = max(self.checkout_wait_max, wait)
+            if saturated:
+                self.saturated_checkouts += 1
+
+    def record_checkin(self):
+        with self._lock:
+            self.checked_out -= 1
+
+    def record_query(self, slow: bool):
+        with self._lock:
+            self.queries += 1
+            if slow:
+                self.slow_queries += 1
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            return {
+                "checkouts": self.checkouts,
+                "checked_out": self.checked_out,
+                "max_checked_out": self.max_checked_out,
+                "saturated_checkouts": self.saturated_checkouts,
+                "checkout_wait_avg_ms": round(self.checkout_wait_total / self.checkouts * 1000, 3) if self.checkouts else 0.0,
+                "checkout_wait_max_ms": round(self.checkout_wait_max * 1000, 3),
+                "queries": self.queries,
+                "slow_queries": self.slow_queries
+            }
+
+class CheckoutCounter:
+    """Число выдач соединений из пула в рамках одного HTTP-запроса"""
+
+    def __init__(self):
+        self.count = 0
+
+# Счетчик текущего запроса; устанавливается middleware в main.py (заголовок X-DB-Checkouts)
+checkout_counter: ContextVar[Optional[CheckoutCounter]] = ContextVar("checkout_counter", default=None)
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool, который замеряет ожидание свободного соединения"""
+
+    stats: EngineStats = None
+
+    def _do_get(self):
+        # Пул насыщен, если все соединения, включая overflow, уже выданы
+        saturated = self.checkedout() >= self.size() + max(self._max_overflow, 0)
+        started = perf_counter()
+        record = super()._do_get()
+        if self.stats is not None:
+            self.stats.record_checkout(perf_counter() - started, saturated)
+            record.info["stats_checked_out"] = True
+        return record
+
+class InstrumentedAsyncQueuePool(InstrumentedQueuePool, AsyncAdaptedQueuePool):
+    """То же для асинхронного движка"""
+
+def _engine_kwargs(url, settings: dict, stats: EngineStats, is_async: bool = False) -> dict:
+    """Параметры create_engine/create_async_engine по профилю"""
+    kwargs = {"echo": settings["sql_log"] == "all"}
+
+    # Для SQLite в памяти пул не настраивается (используется одно соединение)
+    if not (url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:")):
+        base_pool = InstrumentedAsyncQueuePool if is_async else InstrumentedQueuePool
+        kwargs.update(
+            poolclass=type(base_pool.__name__, (base_pool,), {"stats": stats}),
+            pool_size=settings["pool_size"],
+            max_overflow=settings["max_overflow"],
+            pool_timeout=settings["pool_timeout"],
+            pool_recycle=settings["pool_recycle"],
+            pool_pre_ping=settings["pool_pre_ping"],
+        )
+    if url.get_backend_name() == "postgresql" and settings["statement_timeout_ms"]:
+        if is_async:
+            kwargs["connect_args"] = {"server_settings": {"statement_timeout": str(settings["statement_timeout_ms"])}}
+        else:
+            kwargs["connect_args"] = {"options": f"-c statement_timeout={settings['statement_timeout_ms']}"}
+    return kwargs
+
+def _instrument_engine(db_engine: Engine, settings: dict, stats: EngineStats) -> None:
+    """Подключение счетчиков и выборочного логирования SQL к движку"""
+    db_engine.stats = stats
+    db_engine.settings = settings
+
+    @event.listens_for(db_engine, "checkout")
+    def on_checkout(dbapi_connection, connection_record, connection_proxy):
+        counter = checkout_counter.get()
+        if counter is not None:
+            counter.count += 1
+
+    @event.listens_for(db_engine, "checkin")
+    def on_checkin(dbapi_connection, connection_record):
+        if connection_record.info.pop("stats_checked_out", False):
+            stats.record_checkin()
+
+    @event.listens_for(db_engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(perf_counter())
+
+    @event.listens_for(db_engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed_ms = (perf_counter() - conn.info["query_start"].pop()) * 1000
+        slow = elapsed_ms >= settings["slow_query_ms"]
+        stats.record_query(slow)
+        if settings["sql_log"] == "slow" and slow:
+            print(f"[SQL slow {elapsed_ms:.1f} ms] {statement}")
+        elif settings["sql_log"] == "sample" and random.random() < settings["sql_log_sample_rate"]:
+            print(f"[SQL sample {elapsed_ms:.1f} ms] {statement}")
+
+def create_db_engine(url: Optional[str] = None, profile: Optional[str] = None) -> Engine:
+    """Создание движка БД по профилю (dev/prod/bench) с выборочным логированием SQL"""
+    url = make_url(url or database_url)
+    settings = get_engine_settings(profile)
+    stats = EngineStats()
+    db_engine = create_engine(url, **_engine_kwargs(url, settings, stats))
+    _instrument_engine(db_engine, settings, stats)
+    return db_engine
+
+def to_async_url(url) -> URL:
+    """Драйвер для асинхронного движка: asyncpg для PostgreSQL, aiosqlite для SQLite"""
+    url = make_url(url)
+    drivers = {"postgresql": "asyncpg", "sqlite": "aiosqlite"}
+    backend = url.get_backend_name()
+    if backend not in drivers:
+        raise RuntimeError(f'No async driver configured for {backend}')
+    return url.set(drivername=f"{backend}+{drivers[backend]}")
+
+def create_async_db_engine(url: Optional[str] = None, profile: Optional[str] = None) -> AsyncEngine:
+    """Асинхронный движок с теми же профилями и счетчиками, что и create_db_engine"""
+    url = to_async_url(url or database_url)
+    settings = get_engine_settings(profile)
+    stats = EngineStats()
+    db_engine = create_async_engine(url, **_engine_kwargs(url, settings, stats, is_async=True))
+    _instrument_engine(db_engine.sync_engine, settings, stats)
+    return db_engine
+
+def get_engine_stats(db_engine: Optional[Engine] = None) -> dict:
+    """Счетчики пула и запросов для мониторинга"""
+    db_engine = db_engine or engine
+    result = {"profile": db_engine.settings["profile"], **db_engine.stats.as_dict()}
+    if isinstance(db_engine.pool, QueuePool):
+        result.update(
+            pool_size=db_engine.pool.size(),
+            pool_overflow=db_engine.pool.overflow(),
+            pool_checked_in=db_engine.pool.checkedin()
+        )
+    return result
+
+engine = create_db_engine(database_url)
+
+# Асинхронный движок создается при первом обращении, чтобы драйвер
+# (asyncpg/aiosqlite) требовался только там, где он используется
+_async_engine: Optional[AsyncEngine] = None
+
+def get_async_engine() -> AsyncEngine:
+    global _async_engine
+    if _async_engine is None:
+        _async_engine = create_async_db_engine(database_url)
+    return _async_engine
+
+def async_session() -> AsyncSession:
+    """Асинхронная сессия для async-эндпоинтов (объекты не истекают после commit)"""
+    return AsyncSession(get_async_engine(), expire_on_commit=False)
+
+def get_session():
+    """
+    Сессия на время запроса (зависимость FastAPI). Ее получают и get_current_user,
+    и эндпоинт, а сама сессия привязана к одному соединению, поэтому запрос
+    берет из пула ровно одно соединение даже при нескольких commit.
+    """
+    with engine.connect() as connection:
+        with Session(bind=connection) as session:
+            yield session
+
+async def get_async_session():
+    """Асинхронная сессия на время запроса (зависимость FastAPI для async-эндпоинтов)"""
+    async with get_async_engine().connect() as connection:
+        async with AsyncSession(bind=connection, expire_on_commit=False) as session:
+            yield session
+
+@contextmanager
+def session_scope(session: Optional[Session] = None):
+    """Сессия запроса, если она передана, иначе новая (для вызовов вне запроса)"""
+    if session is not None:
+        yield session
+    else:
+        with Session(engine) as new_session:
+            yield new_session
 
 # Перечисления для полей с ограниченным набором значений
 class Gender(str, Enum):
@@ -61,6 +329,9 @@ class AttendanceStatus(str, Enum):
 # Модели таблиц базы данных
 class Users(SQLModel, table=True):
     __tablename__ = 'users'
+    __table_args__ = (
+        Index("idx_users_role", "role"),
+    )
     id: Optional[int] = Field(default=None, primary_key=True)
     email: str = Field(unique=True)
     password_hash: str
@@ -74,6 +345,9 @@ class Users(SQLModel, table=True):
 
 class Students(SQLModel, table=True):
     __tablename__ = 'students'
+    __table_args__ = (
+        Index("idx_students_user_id", "user_id"),
+    )
     id: Optional[int] = Field(default=None, primary_key=True)
     user_id: int = Field(foreign_key="users.id")
     full_name: str = Field(max_length=50)
@@ -98,6 +372,9 @@ class Students(SQLModel, table=True):
 
 class Payments(SQLModel, table=True):
     __tablename__ = 'payments'
+    __table_args__ = (
+        Index("idx_payments_students_id", "student_id"),
+    )
     id: Optional[int] = Field(default=None, primary_key=True)
     student_id: int = Field(foreign_key="students.id")
     amount: float = Field(gt=0)
@@ -117,6 +394,9 @@ class Payments(SQLModel, table=True):
 class Teachers(SQLModel, table=True):
     """Модель таблицы преподавателей"""
     __tablename__ = 'teachers'
+    __table_args__ = (
+        Index("idx_teachers_user_id", "user_id"),
+    )
     id: Optional[int] = Field(default=None, primary_key=True)
     user_id: int = Field(foreign_key="users.id")
     full_name: str = Field(max_length=50)
@@ -139,6 +419,11 @@ class Teachers(SQLModel, table=True):
 
 class Subscriptions(SQLModel, table=True):
     __tablename__ = 'subscriptions'
+    __table_args__ = (
+        Index("idx_subscriptions_status", "status"),
+        # Активные подписки студента (get_active_subscriptions, списание занятий)
+        Index("idx_subscriptions_student_status", "student_id", "status"),
+    )
     id: Optional[int] = Field(default=None, primary_key=True)
     start_date: date = Field(default_factory=date.today)
     end_date: date = Field(default_factory=lambda: date.today().replace(month=date.today().month + 1))
@@ -179,6 +464,16 @@ class Halls(SQLModel, table=True):
 class Classes(SQLModel, table=True):
     """Модель таблицы занятий"""
     __tablename__ = 'classes'
+    __table_args__ = (
+        # Расписание по датам и keyset-пагинация (date, time, id)
+        Index("idx_classes_date_time", "date", "time", "id"),
+        # Расписание преподавателя и конфликты по преподавателю
+        Index("idx_classes_teacher_date_time", "teacher_id", "date", "time"),
+        # Конфликты по залу
+        Index("idx_classes_hall_date_time", "hall_id", "date", "time"),
+        # Занятия серии (массовое изменение и отмена); в старых БД создается миграцией 0005 после series_id
+        Index("idx_classes_series_date", "series_id", "date"),
+    )
     id: Optional[int] = Field(default=None, primary_key=True)
     time: time
     type: str = Field(max_length=18)
@@ -186,6 +481,10 @@ class Classes(SQLModel, table=True):
     teacher_id: int = Field(foreign_key="teachers.id")
     date: date
     current_capacity: int = Field(default=0, ge=0)
+    # Длительность занятия в минутах: по ней ищутся пересечения в расписании (conflicts.py)
+    duration_minutes: int = Field(default=60, gt=0, le=720, sa_column_kwargs={"server_default": text("60")})
+    # Серия, из которой создано занятие (None — разовое занятие)
+    series_id: Optional[int] = Field(default=None, foreign_key="class_series.id", ondelete="SET NULL")
     created_at: datetime = Field(default_factory=datetime.now)
     updated_at: datetime = Field(default_factory=datetime.now)
 
@@ -200,16 +499,49 @@ class Classes(SQLModel, table=True):
 
     @validator('current_capacity')
     def validate_current_capacity(cls, v, values):
+        # Вместимость зала берется из кэша в памяти, без обращения к БД.
+        # Если зала в кэше нет, ограничение проверяет триггер check_class_capacity
         if 'hall_id' in values and values['hall_id'] is not None:
-            with Session(engine) as session:
-                hall = session.get(Halls, values['hall_id'])
-                if hall and v > hall.capacity:
-                    raise ValueError('Текущая вместимость не может превышать вместимость зала')
+            capacity = hall_capacities.get(values['hall_id'])
+            if capacity is not None and v > capacity:
+                raise ValueError('Текущая вместимость не может превышать вместимость зала')
+        return v
+
+class ClassSeries(SQLModel, table=True):
+    """Модель таблицы серий повторяющихся занятий"""
+    __tablename__ = 'class_series'
+    __table_args__ = (
+        Index("idx_class_series_teacher_id", "teacher_id"),
+    )
+    id: Optional[int] = Field(default=None, primary_key=True)
+    type: str = Field(max_length=18)
+    hall_id: Optional[int] = Field(foreign_key="halls.id", ondelete="SET NULL")
+    teacher_id: int = Field(foreign_key="teachers.id")
+    time: time
+    duration_minutes: int = Field(default=60, gt=0, le=720)
+    # Дни недели через запятую, 0 — понедельник (как date.weekday())
+    weekdays: str = Field(max_length=13)
+    start_date: date
+    end_date: date
+    created_at: datetime = Field(default_factory=datetime.now)
+    updated_at: datetime = Field(default_factory=datetime.now)
+
+    @validator('end_date')
+    def validate_end_date(cls, v, values):
+        if 'start_date' in values and v < values['start_date']:
+            raise ValueError('Дата окончания серии не может быть раньше даты начала')
         return v
 
 class Attendance(SQLModel, table=True):
     """Модель таблицы посещаемости"""
     __tablename__ = 'attendance'
+    __table_args__ = (
+        # Одна запись студента на занятие; индекс покрывает и поиск по student_id
+        Index("uq_attendance_student_class", "student_id", "class_id", unique=True),
+        Index("idx_attendance_class_id", "class_id"),
+        # История студента страницами по id: без сортировки всей истории на каждой странице
+        Index("idx_attendance_student_id_id", "student_id", "id"),
+    )
     id: Optional[int] = Field(default=None, primary_key=True)
     presence: AttendanceStatus = Field(default=AttendanceStatus.REGISTERED)
     student_id: Optional[int] = Field(foreign_key="students.id")
@@ -228,9 +560,46 @@ class Attendance(SQLModel, table=True):
             raise ValueError(f'Presence must be one of: {", ".join([status.value for status in AttendanceStatus])}')
         return v
 
+class AttendanceDaily(SQLModel, table=True):
+    """
+    Сводная посещаемость по дням: число записей в статусах «Записан» и «Присутствовал»
+    на занятия одного типа у преподавателя в зале. Ведется триггерами на attendance
+    и classes (ATTENDANCE_DAILY_TRIGGERS_*), пересобирается командой
+    python backend/attendance_rollup.py rebuild
+    """
+    __tablename__ = 'attendance_daily'
+    __table_args__ = (
+        # Ключ начинается с даты: статистика выбирает строки по диапазону дат
+        PrimaryKeyConstraint("date", "type", "teacher_id", "hall_id"),
+    )
+    date: date
+    type: str = Field(max_length=18)
+    teacher_id: int
+    # 0 — занятие без зала: колонка ключа не может быть NULL
+    hall_id: int = Field(default=0)
+    registered: int = Field(default=0)
+    present: int = Field(default=0)
+
+class Waitlist(SQLModel, table=True):
+    """Модель таблицы листа ожидания на занятия"""
+    __tablename__ = 'waitlist'
+    __table_args__ = (
+        # Очередь занятия в порядке записи: первый в очереди — минимальный id
+        Index("idx_waitlist_class_id", "class_id", "id"),
+        Index("uq_waitlist_class_student", "class_id", "student_id", unique=True),
+        Index("idx_waitlist_student_id", "student_id"),
+    )
+    id: Optional[int] = Field(default=None, primary_key=True)
+    class_id: int = Field(foreign_key="classes.id", ondelete="CASCADE")
+    student_id: int = Field(foreign_key="students.id", ondelete="CASCADE")
+    created_at: datetime = Field(default_factory=datetime.now)
+
 class Admins(SQLModel, table=True):
     """Модель таблицы администраторов"""
     __tablename__ = 'admins'
+    __table_args__ = (
+        Index("idx_admins_user_id", "user_id"),
+    )
  
     id: Optional[int] = Field(default=None, primary_key=True)
     user_id: int = Field(foreign_key="users.id")  # Обязательное поле
@@ -240,3 +609,335 @@ class Admins(SQLModel, table=True):
 
    
 
+# updated_at обновляется при каждом UPDATE через ORM. В PostgreSQL то же делают
+# триггеры update_*_updated_at, а для SQLite это единственный источник версии строки
+# (по ней считаются ETag списков)
+@event.listens_for(SQLModel, "before_update", propagate=True)
+def _touch_updated_at(mapper, connection, target):
+    if "updated_at" in mapper.columns:
+        target.updated_at = datetime.now()
+
+# Кэш вместимости залов (hall_id -> capacity) для валидатора Classes.current_capacity.
+# Заполняется при загрузке залов из БД и обновляется после commit изменений залов;
+# TTL ограничивает устаревание, если зал изменили в другом процессе
+HALL_CAPACITY_TTL_SECONDS = int(os.environ.get("HALL_CAPACITY_TTL_SECONDS", "300"))
+hall_capacities = TTLCache(maxsize=1024, ttl=HALL_CAPACITY_TTL_SECONDS)
+
+_HALL_CHANGES = "hall_capacity_changes"
+
+def warm_hall_capacities(session: Session) -> int:
+    """Загрузка вместимости всех залов в кэш (при старте приложения)"""
+    halls = session.exec(select(Halls.id, Halls.capacity)).all()
+    for hall_id, capacity in halls:
+        hall_capacities.set(hall_id, capacity)
+    return len(halls)
+
+@event.listens_for(Halls, "load")
+@event.listens_for(Halls, "refresh")
+def _cache_loaded_hall(target, context, attrs=None):
+    # Берем только уже загруженное значение, чтобы не вызвать ленивую загрузку
+    capacity = target.__dict__.get("capacity")
+    if capacity is not None:
+        hall_capacities.set(target.id, capacity)
+
+def _remember_hall_change(target, capacity):
+    # Изменение попадет в кэш только после commit, чтобы откат не оставил в нем чужое значение
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault(_HALL_CHANGES, {})[target.id] = capacity
+
+@event.listens_for(Halls, "after_insert")
+@event.listens_for(Halls, "after_update")
+def _hall_saved(mapper, connection, target):
+    _remember_hall_change(target, target.capacity)
+
+@event.listens_for(Halls, "after_delete")
+def _hall_deleted(mapper, connection, target):
+    _remember_hall_change(target, None)
+
+@event.listens_for(OrmSession, "after_commit")
+def _apply_hall_changes(session):
+    for hall_id, capacity in session.info.pop(_HALL_CHANGES, {}).items():
+        if capacity is None:
+            hall_capacities.invalidate(hall_id)
+        else:
+            hall_capacities.set(hall_id, capacity)
+
+@event.listens_for(OrmSession, "after_soft_rollback")
+def _discard_hall_changes(session, previous_transaction):
+    # Загруженные в откатываемой транзакции значения могли быть незафиксированными
+    for hall_id in session.info.pop(_HALL_CHANGES, {}):
+        hall_capacities.invalidate(hall_id)
+
+# Ограничение на уровне БД: current_capacity занятия не превышает вместимость зала.
+# Для PostgreSQL те же триггеры есть в Script_dance_studio.sql; здесь они
+# создаются вместе с таблицами через SQLModel.metadata.create_all
+CLASS_CAPACITY_TRIGGERS_POSTGRESQL = [
+    """
+    CREATE OR REPLACE FUNCTION check_class_capacity()
+    RETURNS TRIGGER AS $$
+    BEGIN
+        IF NEW.hall_id IS NOT NULL AND NEW.current_capacity >
+            (SELECT capacity FROM halls WHERE id = NEW.hall_id) THEN
+            RAISE EXCEPTION 'Текущая вместимость не может превышать вместимость зала';
+        END IF;
+        RETURN NEW;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE TRIGGER check_class_capacity
+        BEFORE INSERT OR UPDATE OF current_capacity, hall_id ON classes
+        FOR EACH ROW
+        EXECUTE FUNCTION check_class_capacity()
+    """,
+    """
+    CREATE OR REPLACE FUNCTION check_hall_capacity()
+    RETURNS TRIGGER AS $$
+    BEGIN
+        IF EXISTS (SELECT 1 FROM classes WHERE hall_id = NEW.id AND current_capacity > NEW.capacity) THEN
+            RAISE EXCEPTION 'Вместимость зала меньше числа записанных на занятия';
+        END IF;
+        RETURN NEW;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE TRIGGER check_hall_capacity
+        BEFORE UPDATE OF capacity ON halls
+        FOR EACH ROW
+        EXECUTE FUNCTION check_hall_capacity()
+    """,
+]
+
+CLASS_CAPACITY_TRIGGERS_SQLITE = [
+    """
+    CREATE TRIGGER check_class_capacity_insert BEFORE INSERT ON classes
+    WHEN NEW.hall_id IS NOT NULL AND NEW.current_capacity > (SELECT capacity FROM halls WHERE id = NEW.hall_id)
+    BEGIN
+        SELECT RAISE(ABORT, 'Текущая вместимость не может превышать вместимость зала');
+    END
+    """,
+    """
+    CREATE TRIGGER check_class_capacity_update BEFORE UPDATE OF current_capacity, hall_id ON classes
+    WHEN NEW.hall_id IS NOT NULL AND NEW.current_capacity > (SELECT capacity FROM halls WHERE id = NEW.hall_id)
+    BEGIN
+        SELECT RAISE(ABORT, 'Текущая вместимость не может превышать вместимость зала');
+    END
+    """,
+    """
+    CREATE TRIGGER check_hall_capacity_update BEFORE UPDATE OF capacity ON halls
+    WHEN EXISTS (SELECT 1 FROM classes WHERE hall_id = NEW.id AND current_capacity > NEW.capacity)
+    BEGIN
+        SELECT RAISE(ABORT, 'Вместимость зала меньше числа записанных на занятия');
+    END
+    """,
+]
+
+for _statement in CLASS_CAPACITY_TRIGGERS_POSTGRESQL:
+    event.listen(Classes.__table__, "after_create", DDL(_statement).execute_if(dialect="postgresql"))
+for _statement in CLASS_CAPACITY_TRIGGERS_SQLITE:
+    event.listen(Classes.__table__, "after_create", DDL(_statement).execute_if(dialect="sqlite"))
+
+# Сводная посещаемость attendance_daily меняется вместе с attendance в той же транзакции:
+# запись, отметка, отмена и удаление прибавляют или вычитают строку из счетчиков ее дня,
+# а перенос занятия (дата, тип, преподаватель, зал) переносит его счетчики на новый ключ.
+# Строки с нулевыми счетчиками удаляются. presence хранится как имя AttendanceStatus
+ATTENDANCE_DAILY_TRIGGERS_POSTGRESQL = [
+    """
+    CREATE OR REPLACE FUNCTION attendance_daily_add(
+        p_date DATE, p_type VARCHAR, p_teacher_id INTEGER, p_hall_id INTEGER,
+        p_registered INTEGER, p_present INTEGER
+    )
+    RETURNS VOID AS $$
+    BEGIN
+        IF p_date IS NULL OR (p_registered = 0 AND p_present = 0) THEN
+            RETURN;
+        END IF;
+        INSERT INTO attendance_daily (date, type, teacher_id, hall_id, registered, present)
+        VALUES (p_date, p_type, p_teacher_id, COALESCE(p_hall_id, 0), p_registered, p_present)
+        ON CONFLICT (date, type, teacher_id, hall_id) DO UPDATE
+            SET registered = attendance_daily.registered + EXCLUDED.registered,
+                present = attendance_daily.present + EXCLUDED.present;
+        DELETE FROM attendance_daily
+        WHERE date = p_date AND type = p_type AND teacher_id = p_teacher_id
+            AND hall_id = COALESCE(p_hall_id, 0) AND registered = 0 AND present = 0;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE OR REPLACE FUNCTION attendance_daily_on_attendance()
+    RETURNS TRIGGER AS $$
+    BEGIN
+        IF TG_OP IN ('UPDATE', 'DELETE') THEN
+            PERFORM attendance_daily_add(c.date, c.type, c.teacher_id, c.hall_id,
+                                         -(OLD.presence = 'REGISTERED')::int, -(OLD.presence = 'PRESENT')::int)
+            FROM classes c WHERE c.id = OLD.class_id;
+        END IF;
+        IF TG_OP IN ('INSERT', 'UPDATE') THEN
+            PERFORM attendance_daily_add(c.date, c.type, c.teacher_id, c.hall_id,
+                                         (NEW.presence = 'REGISTERED')::int, (NEW.presence = 'PRESENT')::int)
+            FROM classes c WHERE c.id = NEW.class_id;
+        END IF;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE TRIGGER attendance_daily_on_attendance
+        AFTER INSERT OR DELETE OR UPDATE OF presence, class_id ON attendance
+        FOR EACH ROW
+        EXECUTE FUNCTION attendance_daily_on_attendance()
+    """,
+    """
+    CREATE OR REPLACE FUNCTION attendance_daily_on_class()
+    RETURNS TRIGGER AS $$
+    DECLARE
+        v_registered INTEGER;
+        v_present INTEGER;
+    BEGIN
+        SELECT COUNT(*) FILTER (WHERE presence = 'REGISTERED'), COUNT(*) FILTER (WHERE presence = 'PRESENT')
+        INTO v_registered, v_present
+        FROM attendance WHERE class_id = NEW.id;
+        PERFORM attendance_daily_add(OLD.date, OLD.type, OLD.teacher_id, OLD.hall_id, -v_registered, -v_present);
+        PERFORM attendance_daily_add(NEW.date, NEW.type, NEW.teacher_id, NEW.hall_id, v_registered, v_present);
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE TRIGGER attendance_daily_on_class
+        AFTER UPDATE OF date, type, teacher_id, hall_id ON classes
+        FOR EACH ROW
+        WHEN (OLD.date IS DISTINCT FROM NEW.date OR OLD.type IS DISTINCT FROM NEW.type
+              OR OLD.teacher_id IS DISTINCT FROM NEW.teacher_id OR OLD.hall_id IS DISTINCT FROM NEW.hall_id)
+        EXECUTE FUNCTION attendance_daily_on_class()
+    """,
+]
+
+# В SQLite нет функций, поэтому изменение счетчиков повторяется в каждом триггере
+def _sqlite_daily_add(key: str, source: str, registered: str, present: str) -> str:
+    return f"""
+        INSERT INTO attendance_daily (date, type, teacher_id, hall_id, registered, present)
+        SELECT {key}, {registered}, {present} FROM {source}
+        ON CONFLICT (date, type, teacher_id, hall_id) DO UPDATE
+            SET registered = registered + excluded.registered, present = present + excluded.present;
+        DELETE FROM attendance_daily
+        WHERE registered = 0 AND present = 0
+            AND (date, type, teacher_id, hall_id) = (SELECT {key} FROM {source});"""
+
+def _sqlite_attendance_change(row: str, sign: str) -> str:
+    return _sqlite_daily_add(
+        "date, type, teacher_id, COALESCE(hall_id, 0)", f"classes WHERE id = {row}.class_id",
+        f"{sign}({row}.presence = 'REGISTERED')", f"{sign}({row}.presence = 'PRESENT')"
+    )
+
+def _sqlite_class_move(row: str, sign: str) -> str:
+    return _sqlite_daily_add(
+        f"{row}.date, {row}.type, {row}.teacher_id, COALESCE({row}.hall_id, 0)",
+        "attendance WHERE class_id = NEW.id GROUP BY class_id",
+        f"{sign}SUM(presence = 'REGISTERED')", f"{sign}SUM(presence = 'PRESENT')"
+    )
+
+ATTENDANCE_DAILY_TRIGGERS_SQLITE = [
+    f"""
+    CREATE TRIGGER attendance_daily_insert AFTER INSERT ON attendance
+    BEGIN{_sqlite_attendance_change("NEW", "")}
+    END
+    """,
+    f"""
+    CREATE TRIGGER attendance_daily_delete AFTER DELETE ON attendance
+    BEGIN{_sqlite_attendance_change("OLD", "-")}
+    END
+    """,
+    f"""
+    CREATE TRIGGER attendance_daily_update AFTER UPDATE OF presence, class_id ON attendance
+    BEGIN{_sqlite_attendance_change("OLD", "-")}{_sqlite_attendance_change("NEW", "")}
+    END
+    """,
+    f"""
+    CREATE TRIGGER attendance_daily_class_update AFTER UPDATE OF date, type, teacher_id, hall_id ON classes
+    WHEN OLD.date IS NOT NEW.date OR OLD.type IS NOT NEW.type
+        OR OLD.teacher_id IS NOT NEW.teacher_id OR OLD.hall_id IS NOT NEW.hall_id
+    BEGIN{_sqlite_class_move("OLD", "-")}{_sqlite_class_move("NEW", "")}
+    END
+    """,
+]
+
+for _statement in ATTENDANCE_DAILY_TRIGGERS_POSTGRESQL:
+    event.listen(Attendance.__table__, "after_create", DDL(_statement).execute_if(dialect="postgresql"))
+for _statement in ATTENDANCE_DAILY_TRIGGERS_SQLITE:
+    event.listen(Attendance.__table__, "after_create", DDL(_statement).execute_if(dialect="sqlite"))
+
+if __name__ == "__main__":
+    # Проверка кэша вместимости залов: сколько соединений берется из пула при валидации
+    # и создании 1000 занятий — с кэшем hall_capacities и прежним способом (отдельная
+    # сессия и загрузка зала на каждую проверку). Создает свои данные — запускать на отдельной БД:
+    #   DATABASE_URL=sqlite:////tmp/hall_capacity.db python backend/ll1.py
+    from datetime import timedelta
+    from sqlalchemy.exc import DatabaseError
+
+    CLASSES = 1000
+
+    def previous_validation(hall_id: int, current_capacity: int) -> None:
+        # Прежний validate_current_capacity
+        with Session(engine) as session:
+            hall = session.get(Halls, hall_id)
+            if hall and current_capacity > hall.capacity:
+                raise ValueError('Текущая вместимость не может превышать вместимость зала')
+
+    SQLModel.metadata.create_all(engine)
+    tag = datetime.now().strftime("%Y%m%d%H%M%S%f")
+    with Session(engine) as session:
+        user = Users(email=f"hall-cache-{tag}@example.local", password_hash="-", role=UserRole.TEACHER)
+        session.add(user)
+        session.commit()
+        teacher = Teachers(user_id=user.id, full_name="Преподаватель", experience=1,
+                           specialization="bench", phone="+70000000000")
+        hall = Halls(hall_number=int(tag[-9:]), capacity=20, description="Проверка кэша вместимости")
+        session.add(teacher)
+        session.add(hall)
+        session.commit()
+        hall_id, teacher_id = hall.id, teacher.id
+    assert hall_capacities.get(hall_id) == 20, "вместимость зала не попала в кэш после commit"
+
+    checkouts = [0]
+    event.listen(engine, "checkout", lambda *args: checkouts.__setitem__(0, checkouts[0] + 1))
+    rows = [
+        dict(time=time(10, 0), type="bench", hall_id=hall_id, teacher_id=teacher_id,
+             date=date.today() + timedelta(days=n % 365), current_capacity=n % 20)
+        for n in range(CLASSES)
+    ]
+
+    for row in rows:
+        previous_validation(row["hall_id"], row["current_capacity"])
+    previous_checkouts, checkouts[0] = checkouts[0], 0
+
+    classes = [Classes.model_validate(row) for row in rows]
+    validation_checkouts = checkouts[0]
+    with Session(engine) as session:
+        session.add_all(classes)
+        session.commit()
+    insert_checkouts = checkouts[0] - validation_checkouts
+
+    print(f"Валидация {CLASSES} занятий: прежний способ — {previous_checkouts} соединений, "
+          f"кэш hall_capacities — {validation_checkouts}; сохранение — {insert_checkouts}")
+    assert previous_checkouts == CLASSES
+    assert validation_checkouts == 0, "валидатор обращается к БД"
+    assert insert_checkouts == 1
+
+    # Переполнение отклоняет и валидатор (из кэша), и триггер check_class_capacity (мимо кэша)
+    overflow = dict(rows[0], current_capacity=21)
+    try:
+        Classes.model_validate(overflow)
+        raise AssertionError("валидатор пропустил занятие больше зала")
+    except ValueError:
+        pass
+    with Session(engine) as session:
+        session.add(Classes(**overflow))
+        try:
+            session.commit()
+            raise AssertionError("триггер check_class_capacity не сработал")
+        except DatabaseError:
+            session.rollback()
+    print("OK: переполнение отклоняют валидатор и триггер")
@@ -0,0 +1,76 @@
+# Пакетная загрузка связанных сущностей по id (в духе DataLoader).
+# Эндпоинт сначала собирает нужные id (want), затем load забирает каждую модель
+# одним запросом WHERE id IN (...) и запоминает результат до конца запроса.
+# Так число запросов не зависит от числа строк в ответе: вместо session.get на
+# каждую строку — по одному запросу на тип сущности.
+# load принимает синхронную Session; из async-эндпоинтов —
+# await session.run_sync(loader.load).
+from collections import defaultdict
+from typing import Any, Dict, Iterable, Optional, Set, Type
+
+from sqlmodel import Session, select
+
+from ll1 import Classes, Halls, Students, Teachers
+
+# Ограничение длины списка IN: у SQLite до 32766 параметров, у PostgreSQL — до 65535
+LOADER_CHUNK_SIZE = 10000
+
+
+class BatchLoader:
+    """Загрузчик сущностей по id на время одного запроса"""
+
+    def __init__(self):
+        self._pending: Dict[Type, Set[int]] = defaultdict(set)
+        self._loaded: Dict[Type, Dict[int, Any]] = defaultdict(dict)
+        self.queries = 0
+
+    def want(self, model: Type, ids: Iterable[Optional[int]]) -> "BatchLoader":
+        """Запомнить id, которые понадобятся (уже загруженные и None пропускаются)"""
+        loaded = self._loaded[model]
+        self._pending[model].update(key for key in ids if key is not None and key not in loaded)
+        return self
+
+    def load(self, session: Session) -> "BatchLoader":
+        """Загрузить все запомненные id: по одному запросу IN на модель"""
+        pending, self._pending = self._pending, defaultdict(set)
+        for model, ids in pending.items():
+            ids = sorted(ids)
+            loaded = self._loaded[model]
+            for start in range(0, len(ids), LOADER_CHUNK_SIZE):
+                chunk = ids[start:start + LOADER_CHUNK_SIZE]
+                for entity in session.exec(select(model).where(model.id.in_(chunk))).all():
+                    loaded[entity.id] = entity
+                self.queries += 1
+            # Отсутствующие в БД тоже запоминаются, чтобы не запрашивать их снова
+            for key in ids:
+                loaded.setdefault(key, None)
+        return self
+
+    def get(self, model: Type, key: Optional[int]) -> Optional[Any]:
+        return self._loaded[model].get(key)
+
+
+def load_class_relations(session: Session, classes: Iterable[Classes],
+                         loader: Optional[BatchLoader] = None) -> BatchLoader:
+    """Залы и преподаватели занятий"""
+    classes = list(classes)
+    loader = loader or BatchLoader()
+    return (
+        loader
+        .want(Halls, (class_.hall_id for class_ in classes))
+        .want(Teachers, (class_.teacher_id for class_ in classes))
+        .load(session)
+    )
+
+
+def load_attendance_relations(session: Session, records: Iterable[Any]) -> BatchLoader:
+    """Студенты и занятия записей посещаемости, затем залы и преподаватели занятий — четыре запроса"""
+    records = list(records)
+    loader = (
+        BatchLoader()
+        .want(Students, (record.student_id for record in records))
+        .want(Classes, (record.class_id for record in records))
+        .load(session)
+    )
+    classes = [loader.get(Classes, record.class_id) for record in records]
+    return load_class_relations(session, filter(None, classes), loader)
@@ -1,29 +1,52 @@
 # Импорт необходимых модулей
-from typing import Union, List, Optional, Dict, Any
+from typing import Union, List, Optional, Dict, Any, Tuple
 from fastapi.openapi.docs import get_swagger_ui_html
-from fastapi import FastAPI, HTTPException, Depends, status, Header, Body
+from fastapi import FastAPI, HTTPException, Depends, status, Header, Body, Response, Query
 from fastapi.middleware.cors import CORSMiddleware
 from datetime import date, datetime, timedelta
 from dateutil.relativedelta import relativedelta
+import hashlib
+import hmac
 import os
 from dotenv import load_dotenv
 import jwt
 from passlib.context import CryptContext
 from pydantic import BaseModel, EmailStr, validator, Field
 from sqlmodel import Session, select, and_
+from sqlalchemy import event, func
+from sqlalchemy.orm import Session as OrmSession, object_session
+from sqlalchemy.exc import IntegrityError, InternalError, OperationalError
 from ll1 import (
     Students, Teachers, Classes, Halls, Attendance, AttendanceStatus,Payments, Subscriptions,
-    Gender, SubscriptionStatus, engine, Admins, Users, UserRole,PaymentMethod, PaymentStatus
+    Gender, SubscriptionStatus, engine, Admins, Users, UserRole,PaymentMethod, PaymentStatus,
+    get_engine_stats, get_async_engine, async_session, get_session, get_async_session,
+    AsyncSession, CheckoutCounter, checkout_counter, hall_capacities, warm_hall_capacities, ClassSeries
 )
 from requests import (
-    get_student_by_email, get_active_subscriptions, get_class_schedule,
+    get_student_by_email, get_active_subscriptions, get_active_subscriptions_async, get_class_schedule,
     get_available_classes, enroll_student_in_class, mark_attendance,
-    get_teacher_schedule, get_attendance_statistics, get_student_attendance,
+    get_teacher_schedule, get_attendance_statistics, get_student_attendance as fetch_student_attendance,
     get_class_attendance, create_payment, create_subscription,
     get_all_teachers, get_all_halls, create_class
 )
 import bcrypt
 from pydantic import ValidationError
+from cache import TTLCache
+from executors import BoundedExecutor, ExecutorSaturated
+from conditional import ConditionalStats, cpu_time, probe_version, not_modified_response, full_response
+from serializers import class_row, attendance_row, dumps, json_response
+from pagination import Page
+from migrate import pending_migrations
+from conflicts import schedule_index, find_conflicts, raise_on_conflicts, check_conflicts_locked
+from enrollment import enroll_student, enroll_many, ALL_OR_NOTHING, BEST_EFFORT
+from admission import admission, ENROLLMENT_ADMISSION
+from cohorts import cohort_report
+from loaders import load_attendance_relations, load_class_relations
+from roll_call import apply_roll_call, charge_statement, class_teacher
+from waitlist import (
+    join_waitlist, leave_waitlist, cancel_enrollment, class_waitlist, promote, release_student_seats, drop_queues
+)
+from series import create_series, update_series, cancel_series, format_weekdays, parse_weekdays, series_classes
 
 
 # Создание экземпляра FastAPI приложения
@@ -40,6 +63,50 @@ app.add_middleware(
     max_age=3600,
 )
 
+@app.on_event("startup")
+def load_hall_capacities():
+    """Заполнение кэша вместимости залов, чтобы валидация занятий не обращалась к БД"""
+    try:
+        with Session(engine) as session:
+            print(f"Загружена вместимость залов: {warm_hall_capacities(session)}")
+    except Exception as e:
+        print(f"Не удалось загрузить вместимость залов: {e}")
+
+@app.on_event("startup")
+def load_schedule_index():
+    """Построение индекса пересечений расписания до первого создания занятия"""
+    try:
+        with Session(engine) as session:
+            schedule_index.rebuild(session)
+    except Exception as e:
+        print(f"Не удалось построить индекс расписания: {e}")
+
+@app.on_event("startup")
+def check_migrations():
+    """Предупреждение о непримененных миграциях схемы (python backend/migrate.py upgrade)"""
+    try:
+        pending = pending_migrations(engine)
+        if pending:
+            print(f"Не применены миграции БД: {', '.join(m.version for m in pending)}. "
+                  f"Запустите python backend/migrate.py upgrade")
+    except Exception as e:
+        print(f"Не удалось проверить миграции БД: {e}")
+
+# Отладочный заголовок X-DB-Checkouts: сколько раз запрос брал соединение из пула
+DB_DEBUG_HEADERS = os.environ.get("DB_DEBUG_HEADERS", "").lower() in ("1", "true", "yes", "on")
+
+if DB_DEBUG_HEADERS:
+    @app.middleware("http")
+    async def count_db_checkouts(request, call_next):
+        counter = CheckoutCounter()
+        token = checkout_counter.set(counter)
+        try:
+            response = await call_next(request)
+        finally:
+            checkout_counter.reset(token)
+        response.headers["X-DB-Checkouts"] = str(counter.count)
+        return response
+
 # Конфигурация JWT
 load_dotenv()
 SECRET_KEY = os.environ.get("SECRET_KEY")
@@ -47,9 +114,42 @@ if not SECRET_KEY:
     raise RuntimeError("SECRET_KEY is not set in environment")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
+REFRESH_TOKEN_EXPIRE_DAYS = 7
+
+# Кэш аутентифицированных пользователей (ключ — subject токена, т.е. email)
+USER_CACHE_SIZE = int(os.environ.get("USER_CACHE_SIZE", "1024"))
+USER_CACHE_TTL_SECONDS = float(os.environ.get("USER_CACHE_TTL_SECONDS", "60"))
+user_cache = TTLCache(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL_SECONDS)
+
+# Кэш ответов GET /classes/ (ключ — фильтры запроса: start_date, end_date, dance_type, teacher_id)
+SCHEDULE_CACHE_SIZE = int(os.environ.get("SCHEDULE_CACHE_SIZE", "256"))
+SCHEDULE_CACHE_TTL_SECONDS = float(os.environ.get("SCHEDULE_CACHE_TTL_SECONDS", "300"))
+schedule_cache = TTLCache(maxsize=SCHEDULE_CACHE_SIZE, ttl=SCHEDULE_CACHE_TTL_SECONDS)
+
+# Кэш когортного отчета /admin/analytics/cohorts (ключ — число месяцев и дата расчета)
+COHORT_CACHE_TTL_SECONDS = float(os.environ.get("COHORT_CACHE_TTL_SECONDS", "300"))
+COHORT_MAX_MONTHS = int(os.environ.get("COHORT_MAX_MONTHS", "60"))
+cohort_cache = TTLCache(maxsize=64, ttl=COHORT_CACHE_TTL_SECONDS)
+
+# Счетчики условных GET (ETag/If-None-Match) для /classes/, /teachers/, /halls/
+conditional_stats = ConditionalStats()
+
+# Минимальная допустимая версия профиля в access-токене по user_id. Записи живут не дольше
+# access-токена: более старые токены к этому моменту все равно истекут.
+# Кэш свой у каждого процесса и вытесняет старые записи при переполнении, поэтому
+# изменение или удаление пользователя сразу отзывает его access-токены только в том
+# процессе, который обработал запрос; в остальных они действуют до истечения
+# (не дольше ACCESS_TOKEN_EXPIRE_MINUTES). Refresh-токены проверяются по БД
+# (refresh_access_token) и отзываются сразу во всех процессах.
+revoked_profiles = TTLCache(maxsize=100000, ttl=ACCESS_TOKEN_EXPIRE_MINUTES * 60)
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
+# Пул для проверки паролей bcrypt вне event loop
+AUTH_WORKERS = int(os.environ.get("AUTH_WORKERS", "4"))
+AUTH_QUEUE_DEPTH = int(os.environ.get("AUTH_QUEUE_DEPTH", "32"))
+auth_executor = BoundedExecutor(max_workers=AUTH_WORKERS, max_queue=AUTH_QUEUE_DEPTH, name="auth")
+
 # Модели ответов
 class ClassResponse(BaseModel):
     id: int
@@ -64,6 +164,7 @@ class ClassResponse(BaseModel):
     formatted_time: str
     teacher_id: int
     hall_id: int
+    duration_minutes: int = 60
 
     class Config:
         orm_mode = True
@@ -99,6 +200,20 @@ class Token(BaseModel):
     access_token: str
     token_type: str
     role: str
+    refresh_token: Optional[str] = None
+
+class RefreshTokenRequest(BaseModel):
+    refresh_token: str
+
+class TokenIdentity(BaseModel):
+    """Пользователь, восстановленный из подписанных claims токена без запроса к БД"""
+    id: int
+    email: str
+    role: UserRole
+    name: Optional[str] = None
+    student_id: Optional[int] = None
+    teacher_id: Optional[int] = None
+    profile_version: int
 
 class LoginRequest(BaseModel):
     email: str
@@ -110,6 +225,7 @@ class CreateClassRequest(BaseModel):
     hall_id: int
     teacher_id: int
     date: date
+    duration_minutes: int = Field(60, gt=0, le=720)
 
 class SubscriptionResponse(BaseModel):
     id: int
@@ -130,6 +246,71 @@ class UpdateClassRequest(BaseModel):
     hall_id: int
     teacher_id: int
     date: date
+    # None — длительность не меняется
+    duration_minutes: Optional[int] = Field(None, gt=0, le=720)
+
+class CreateClassSeriesRequest(BaseModel):
+    time: str
+    type: str
+    hall_id: int
+    teacher_id: int
+    duration_minutes: int = Field(60, gt=0, le=720)
+    weekdays: List[int]
+    start_date: date
+    end_date: date
+    exceptions: List[date] = []
+
+class UpdateClassSeriesRequest(BaseModel):
+    time: Optional[str] = None
+    type: Optional[str] = None
+    hall_id: Optional[int] = None
+    teacher_id: Optional[int] = None
+    duration_minutes: Optional[int] = Field(None, gt=0, le=720)
+    from_date: Optional[date] = None
+
+class BulkEnrollRequest(BaseModel):
+    class_ids: List[int] = []
+    series_id: Optional[int] = None
+    from_date: Optional[date] = None
+    mode: str = Field(ALL_OR_NOTHING, pattern=f"^({ALL_OR_NOTHING}|{BEST_EFFORT})$")
+
+class ClassSeriesResponse(BaseModel):
+    id: int
+    time: str
+    type: str
+    hall_id: Optional[int]
+    teacher_id: int
+    duration_minutes: int
+    weekdays: List[int]
+    start_date: date
+    end_date: date
+    class_ids: List[int] = []
+
+def series_response(series: ClassSeries, class_ids: List[int]) -> Dict[str, Any]:
+    return {
+        "id": series.id,
+        "time": series.time.strftime('%H:%M:%S'),
+        "type": series.type,
+        "hall_id": series.hall_id,
+        "teacher_id": series.teacher_id,
+        "duration_minutes": series.duration_minutes,
+        "weekdays": parse_weekdays(series.weekdays),
+        "start_date": series.start_date,
+        "end_date": series.end_date,
+        "class_ids": class_ids
+    }
+
+def parse_class_time(value: str):
+    """Время занятия из строки чч:мм или чч:мм:сс"""
+    for time_format in ('%H:%M', '%H:%M:%S'):
+        try:
+            return datetime.strptime(value, time_format).time()
+        except ValueError:
+            continue
+    raise HTTPException(
+        status_code=status.HTTP_400_BAD_REQUEST,
+        detail="Некорректное время занятия, ожидается чч:мм"
+    )
 
 class CreateTeacherRequest(BaseModel):
     full_name: str
@@ -178,6 +359,13 @@ class AttendanceResponse(BaseModel):
 class UpdateAttendanceRequest(BaseModel):
     presence: str
 
+class RollCallMark(BaseModel):
+    student_id: int
+    presence: AttendanceStatus
+
+class RollCallRequest(BaseModel):
+    marks: List[RollCallMark]
+
 class CreatePaymentAndSubscriptionRequest(BaseModel):
     student_id: int
     amount: float
@@ -225,6 +413,57 @@ def authenticate_user(email: str, password: str):
         return False
     return user
 
+def profile_version(user: Users) -> int:
+    """Версия профиля для claims токена (updated_at пользователя в миллисекундах)"""
+    return int(user.updated_at.timestamp() * 1000)
+
+# Модель профиля и имя claim с его id для каждой роли
+PROFILE_MODELS = {
+    UserRole.STUDENT: (Students, "student_id"),
+    UserRole.TEACHER: (Teachers, "teacher_id"),
+    UserRole.ADMIN: (Admins, None)
+}
+
+def profile_statement(user: Users):
+    """Запрос профиля пользователя по его роли (None для неизвестной роли)"""
+    model, _ = PROFILE_MODELS.get(user.role, (None, None))
+    if model is None:
+        return None
+    return select(model).where(model.user_id == user.id)
+
+def build_profile_claims(user: Users, profile) -> Dict[str, Any]:
+    """Данные профиля, которые подписываются в токене: роль, id профиля, имя и версия"""
+    claims = {
+        "sub": user.email,
+        "role": user.role,
+        "user_id": user.id,
+        "pv": profile_version(user)
+    }
+    if profile is not None:
+        _, id_claim = PROFILE_MODELS[user.role]
+        if id_claim:
+            claims[id_claim] = profile.id
+        claims["name"] = profile.full_name
+    return claims
+
+def get_profile_claims(session: Session, user: Users) -> Dict[str, Any]:
+    statement = profile_statement(user)
+    profile = session.exec(statement).first() if statement is not None else None
+    return build_profile_claims(user, profile)
+
+async def authenticate_user_claims(email: str, password: str) -> Optional[Tuple[Dict[str, Any], Users]]:
+    """Проверка пароля и сборка claims профиля; bcrypt выполняется в пуле auth_executor"""
+    async with async_session() as session:
+        user = (await session.exec(select(Users).where(Users.email == email))).first()
+        if not user:
+            return None
+        statement = profile_statement(user)
+        profile = (await session.exec(statement)).first() if statement is not None else None
+    # Соединение уже возвращено в пул — не держим его на время проверки bcrypt
+    if not await auth_executor.run(verify_password, password, user.password_hash):
+        return None
+    return build_profile_claims(user, profile), user
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
     if expires_delta:
@@ -235,29 +474,150 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-def get_current_user(token: str = Header(...)):
+def password_fingerprint(user: Users) -> str:
+    """Отпечаток хэша пароля для refresh-токена: меняется при каждой смене пароля"""
+    return hmac.new(SECRET_KEY.encode(), user.password_hash.encode(), hashlib.sha256).hexdigest()[:16]
+
+def issue_tokens(claims: Dict[str, Any], user: Users) -> Dict[str, Any]:
+    """Выпуск пары access/refresh токенов по claims профиля"""
+    access_token = create_access_token(
+        data={**claims, "type": "access"},
+        expires_delta=timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+    )
+    refresh_token = create_access_token(
+        data={"sub": claims["sub"], "user_id": claims["user_id"], "pwd": password_fingerprint(user),
+              "type": "refresh"},
+        expires_delta=timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)
+    )
+    return {
+        "access_token": access_token,
+        "refresh_token": refresh_token,
+        "token_type": "bearer",
+        "role": claims["role"]
+    }
+
+def decode_token(token: str, token_type: str = "access") -> Dict[str, Any]:
+    """Проверка подписи и типа токена"""
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        email = payload.get("sub")
-        if email is None:
-            raise HTTPException(status_code=401, detail="Неверные учетные данные")
     except jwt.PyJWTError:
         raise HTTPException(status_code=401, detail="Неверные учетные данные")
-    
-    with Session(engine) as session:
-        user = session.exec(select(Users).where(Users.email == email)).first()
-        if user is None:
-            raise HTTPException(status_code=401, detail="Пользователь не найден")
+    # У токенов старого формата нет поля type — это access-токены
+    if payload.get("sub") is None or payload.get("type", "access") != token_type:
+        raise HTTPException(status_code=401, detail="Неверные учетные данные")
+    return payload
+
+def get_current_user(token: str = Header(...), session: Session = Depends(get_session)):
+    email = decode_token(token)["sub"]
+
+    user = user_cache.get(email)
+    if user is not None:
         return user
 
+    user = session.exec(select(Users).where(Users.email == email)).first()
+    if user is None:
+        raise HTTPException(status_code=401, detail="Пользователь не найден")
+    # Отсоединяем от сессии запроса: commit в эндпоинте не должен истекать объект в кэше
+    session.expunge(user)
+    user_cache.set(email, user)
+    return user
+
+async def get_current_identity(
+    token: str = Header(...),
+    session: AsyncSession = Depends(get_async_session)
+) -> TokenIdentity:
+    """Текущий пользователь из claims токена (без запроса к БД)"""
+    payload = decode_token(token)
+    if "user_id" not in payload:
+        # Токен выпущен до появления claims профиля — достраиваем их из БД через сессию
+        # запроса (та же зависимость, что у эндпоинта, поэтому соединение одно)
+        payload = await session.run_sync(
+            lambda sync_session: get_profile_claims(sync_session, get_current_user(token, sync_session))
+        )
+    else:
+        min_version = revoked_profiles.get(payload["user_id"])
+        if min_version is not None and payload.get("pv", 0) < min_version:
+            raise HTTPException(status_code=401, detail="Профиль изменен, обновите токен")
+
+    return TokenIdentity(
+        id=payload["user_id"],
+        email=payload["sub"],
+        role=payload["role"],
+        name=payload.get("name"),
+        student_id=payload.get("student_id"),
+        teacher_id=payload.get("teacher_id"),
+        profile_version=payload.get("pv", 0)
+    )
+
+def invalidate_user_cache(*emails: Optional[str]):
+    """Сброс закэшированных пользователей после изменения email, пароля или удаления"""
+    for email in emails:
+        if email:
+            user_cache.invalidate(email)
+
+def revoke_profile_claims(user_id: int, version: Optional[int] = None):
+    """
+    Пометка ранее выданных claims профиля устаревшими (None — пользователь удален).
+    Для удаленного пользователя граница — текущее время в масштабе profile_version:
+    все его токены выпущены раньше, а новый пользователь, получивший тот же id
+    (SQLite повторно использует id удаленных строк), свои токены не теряет
+    """
+    if version is None:
+        version = int(datetime.now().timestamp() * 1000) + 1
+    revoked_profiles.set(user_id, version)
+
+def schedule_key(class_: Classes):
+    """Поля занятия, по которым оно попадает в закэшированные расписания"""
+    return (class_.date, class_.type, class_.teacher_id)
+
+def invalidate_schedule_cache(*class_keys):
+    """Сброс закэшированных расписаний, в которые попадают занятия (date, type, teacher_id)"""
+    def affected(key):
+        start_date, end_date, dance_type, teacher_id = key[:4]
+        return any(
+            start_date <= class_date <= end_date
+            and dance_type in (None, class_type)
+            and teacher_id in (None, class_teacher_id)
+            for class_date, class_type, class_teacher_id in class_keys
+        )
+    schedule_cache.invalidate_where(affected)
+
+def invalidate_teacher_schedules(teacher_id: int):
+    """Сброс расписаний с занятиями преподавателя (имя и специализация входят в ответ)"""
+    schedule_cache.invalidate_where(lambda key: key[3] in (None, teacher_id))
+
+# Номер и вместимость зала входят в каждую строку расписания, поэтому изменение
+# зала сбрасывает весь кэш — после commit, чтобы не закэшировать старые данные
+@event.listens_for(Halls, "after_update")
+@event.listens_for(Halls, "after_delete")
+def _mark_hall_changed(mapper, connection, target):
+    session = object_session(target)
+    if session is not None:
+        session.info["schedule_halls_changed"] = True
+
+@event.listens_for(OrmSession, "after_commit")
+def _invalidate_schedules_on_hall_change(session):
+    if session.info.pop("schedule_halls_changed", False):
+        schedule_cache.clear()
+
 @app.post("/login", response_model=Token)
 async def login(login_data: LoginRequest):
     """Эндпоинт для входа в систему"""
     print(f"Attempting login for user: {login_data.email}")
     
     try:
-        user = authenticate_user(login_data.email, login_data.password)
-        if not user:
+        try:
+            authenticated = await authenticate_user_claims(login_data.email, login_data.password)
+        except ExecutorSaturated:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail={
+                    "message": "Сервер перегружен",
+                    "errors": ["Слишком много одновременных попыток входа, повторите через несколько секунд"]
+                },
+                headers={"Retry-After": "1"},
+            )
+        if not authenticated:
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail={
@@ -267,17 +627,8 @@ async def login(login_data: LoginRequest):
                 headers={"WWW-Authenticate": "Bearer"},
             )
         
-        access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-        access_token = create_access_token(
-            data={"sub": user.email, "role": user.role},
-            expires_delta=access_token_expires
-        )
-        
-        return {
-            "access_token": access_token,
-            "token_type": "bearer",
-            "role": user.role
-        }
+        claims, user = authenticated
+        return issue_tokens(claims, user)
     except HTTPException as e:
         raise e
     except Exception as e:
@@ -290,93 +641,70 @@ async def login(login_data: LoginRequest):
             }
         )
 
+@app.post("/token/refresh", response_model=Token)
+def refresh_access_token(refresh_data: RefreshTokenRequest, session: Session = Depends(get_session)):
+    """Выпуск нового access-токена с актуальными claims профиля по refresh-токену"""
+    payload = decode_token(refresh_data.refresh_token, token_type="refresh")
+    user = session.get(Users, payload.get("user_id"))
+    # Смена email или удаление пользователя отзывает refresh-токен
+    if user is None or user.email != payload["sub"]:
+        raise HTTPException(status_code=401, detail="Пользователь не найден")
+    # Смена пароля тоже: в токене отпечаток хэша пароля на момент входа
+    if not hmac.compare_digest(str(payload.get("pwd", "")), password_fingerprint(user)):
+        raise HTTPException(status_code=401, detail="Пароль изменен, войдите заново")
+    claims = get_profile_claims(session, user)
+    return issue_tokens(claims, user)
+
 @app.get("/users/me")
-async def read_users_me(current_user: Users = Depends(get_current_user)):
+async def read_users_me(identity: TokenIdentity = Depends(get_current_identity)):
     """Получение информации о текущем пользователе"""
-    try:
-        with Session(engine) as session:
-            if current_user.role == UserRole.STUDENT:
-                student = session.exec(select(Students).where(Students.user_id == current_user.id)).first()
-                if not student:
-                    raise HTTPException(
-                        status_code=status.HTTP_404_NOT_FOUND,
-                        detail={
-                            "message": "Профиль не найден",
-                            "errors": ["Профиль студента не найден в системе"]
-                        }
-                    )
-                return {
-                    "id": current_user.id,
-                    "email": current_user.email,
-                    "role": current_user.role,
-                    "name": student.full_name,
-                    "student_id": student.id
-                }
-            elif current_user.role == UserRole.TEACHER:
-                teacher = session.exec(select(Teachers).where(Teachers.user_id == current_user.id)).first()
-                if not teacher:
-                    raise HTTPException(
-                        status_code=status.HTTP_404_NOT_FOUND,
-                        detail={
-                            "message": "Профиль не найден",
-                            "errors": ["Профиль преподавателя не найден в системе"]
-                        }
-                    )
-                return {
-                    "id": current_user.id,
-                    "email": current_user.email,
-                    "role": current_user.role,
-                    "name": teacher.full_name,
-                    "teacher_id": teacher.id
-                }
-            elif current_user.role == UserRole.ADMIN:
-                admin = session.exec(select(Admins).where(Admins.user_id == current_user.id)).first()
-                if not admin:
-                    raise HTTPException(
-                        status_code=status.HTTP_404_NOT_FOUND,
-                        detail={
-                            "message": "Профиль не найден",
-                            "errors": ["Профиль администратора не найден в системе"]
-                        }
-                    )
-                return {
-                    "id": current_user.id,
-                    "email": current_user.email,
-                    "role": current_user.role,
-                    "name": admin.full_name
-                }
-            else:
-                raise HTTPException(
-                    status_code=status.HTTP_400_BAD_REQUEST,
-                    detail={
-                        "message": "Неизвестная роль",
-                        "errors": ["Роль пользователя не определена в системе"]
-                    }
-                )
-    except HTTPException as e:
-        raise e
-    except Exception as e:
-        print(f"Error in read_users_me: {str(e)}")
+    profile_errors = {
+        UserRole.STUDENT: "Профиль студента не найден в системе",
+        UserRole.TEACHER: "Профиль преподавателя не найден в системе",
+        UserRole.ADMIN: "Профиль администратора не найден в системе"
+    }
+    if identity.role not in profile_errors:
         raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            status_code=status.HTTP_400_BAD_REQUEST,
             detail={
-                "message": "Ошибка получения данных пользователя",
-                "errors": [
-                    "Произошла ошибка при получении данных профиля",
-                    "Пожалуйста, попробуйте позже или обратитесь в поддержку"
-                ]
+                "message": "Неизвестная роль",
+                "errors": ["Роль пользователя не определена в системе"]
+            }
+        )
+    if identity.name is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail={
+                "message": "Профиль не найден",
+                "errors": [profile_errors[identity.role]]
             }
         )
 
+    response = {
+        "id": identity.id,
+        "email": identity.email,
+        "role": identity.role,
+        "name": identity.name
+    }
+    if identity.role == UserRole.STUDENT:
+        response["student_id"] = identity.student_id
+    elif identity.role == UserRole.TEACHER:
+        response["teacher_id"] = identity.teacher_id
+    return response
+
 # Эндпоинты для работы с классами (расписанием)
 @app.get("/classes/", response_model=List[ClassResponse])
 def get_classes(
     start_date: Optional[date] = None,
     end_date: Optional[date] = None,
     dance_type: Optional[str] = None,
-    teacher_id: Optional[int] = None
+    teacher_id: Optional[int] = None,
+    page: Page = Depends(),
+    if_none_match: Optional[str] = Header(None),
+    if_modified_since: Optional[str] = Header(None),
+    session: Session = Depends(get_session)
 ):
-    """Получение расписания на текущую и следующую неделю с фильтрацией"""
+    """Получение расписания на текущую и следующую неделю с фильтрацией (страницами по limit/cursor)"""
     try:
         # Если даты не указаны, используем текущую дату и +14 дней
         if not start_date:
@@ -384,79 +712,72 @@ def get_classes(
         if not end_date:
             end_date = start_date + timedelta(days=14)
 
-        print(f"Получение занятий с {start_date} по {end_date}")
-        with Session(engine) as session:
-            query = (
-                select(
-                    Classes,
-                    Halls.hall_number,
-                    Halls.capacity.label("hall_capacity"),
-                    Teachers.full_name.label("teacher_name"),
-                    Teachers.specialization,
-                    Teachers.id.label("teacher_id"),
-                    Halls.id.label("hall_id")
-                )
+        filters = [Classes.date >= start_date, Classes.date <= end_date]
+        if dance_type:
+            filters.append(Classes.type == dance_type)
+        if teacher_id:
+            filters.append(Classes.teacher_id == teacher_id)
+
+        # Версия расписания: занятия в диапазоне, их залы и преподаватели
+        cache_key = (start_date, end_date, dance_type or None, teacher_id or None) + page.key
+        version = probe_version(
+            session, conditional_stats, "/classes/",
+            lambda versions: (
+                select(func.count(Classes.id), *versions(Classes.updated_at),
+                       *versions(Halls.updated_at), *versions(Teachers.updated_at))
+                .select_from(Classes)
                 .join(Halls, Classes.hall_id == Halls.id)
                 .join(Teachers, Classes.teacher_id == Teachers.id)
-                .where(
-                    Classes.date >= start_date,
-                    Classes.date <= end_date
-                )
-                .order_by(Classes.date, Classes.time)
+                .where(*filters)
+            ),
+            cache_key
+        )
+        not_modified = not_modified_response(conditional_stats, version, if_none_match, if_modified_since)
+        if not_modified is not None:
+            return not_modified
+
+        started = cpu_time()
+        # Тело в кэше годится только для той версии данных, из которой собрано: запись
+        # из другого процесса или мимо ORM не сбрасывает кэш, но меняет версию
+        cached = schedule_cache.get(cache_key)
+        if cached is not None and cached[0] == version.etag:
+            _, body, next_cursor = cached
+            return full_response(conditional_stats, version, body, started, page.headers(next_cursor))
+
+        print(f"Получение занятий с {start_date} по {end_date}")
+        query = (
+            select(
+                Classes,
+                Halls.hall_number,
+                Halls.capacity.label("hall_capacity"),
+                Teachers.full_name.label("teacher_name"),
+                Teachers.specialization,
+                Teachers.id.label("teacher_id"),
+                Halls.id.label("hall_id")
             )
-            
-            if dance_type:
-                query = query.where(Classes.type == dance_type)
-            if teacher_id:
-                query = query.where(Classes.teacher_id == teacher_id)
+            .join(Halls, Classes.hall_id == Halls.id)
+            .join(Teachers, Classes.teacher_id == Teachers.id)
+            .where(*filters)
+        )
                 
-            classes = session.exec(query).all()
-            print(f"Найдено занятий: {len(classes)}")
+        classes = session.exec(page.apply(query, Classes.date, Classes.time, Classes.id)).all()
+        classes, next_cursor = page.split(classes, lambda row: (row[0].date, row[0].time, row[0].id))
+        print(f"Найдено занятий: {len(classes)}")
             
-            result = []
-            for cls, hall_number, hall_capacity, teacher_name, specialization, teacher_id, hall_id in classes:
-                try:
-                    # Форматируем дату и время
-                    formatted_date = cls.date.strftime('%d.%m.%Y')
-                    formatted_time = cls.time.strftime('%H:%M')
-                    day_of_week = cls.date.strftime('%A')
-                    
-                    # Получаем русское название дня недели
-                    russian_days = {
-                        'Monday': 'Понедельник',
-                        'Tuesday': 'Вторник',
-                        'Wednesday': 'Среда',
-                        'Thursday': 'Четверг',
-                        'Friday': 'Пятница',
-                        'Saturday': 'Суббота',
-                        'Sunday': 'Воскресенье'
-                    }
-                    russian_day_of_week = russian_days.get(day_of_week, day_of_week)
-                    
-                    class_data = {
-                        "id": cls.id,
-                        "time": cls.time.strftime('%H:%M:%S'),
-                        "type": cls.type,
-                        "date": cls.date,
-                        "current_capacity": cls.current_capacity,
-                        "hall_number": hall_number,
-                        "hall_capacity": hall_capacity,
-                        "teacher_name": teacher_name,
-                        "specialization": specialization,
-                        "remaining_slots": hall_capacity - cls.current_capacity,
-                        "formatted_date": formatted_date,
-                        "formatted_time": formatted_time,
-                        "day_of_week": russian_day_of_week,
-                        "teacher_id": teacher_id,
-                        "hall_id": hall_id
-                    }
-                    result.append(ClassResponse(**class_data))
-                except Exception as e:
-                    print(f"Ошибка при форматировании занятия {cls.id}: {str(e)}")
-                    continue
+        result = []
+        for cls, hall_number, hall_capacity, teacher_name, specialization, teacher_id, hall_id in classes:
+            try:
+                result.append(class_row(cls, hall_number, hall_capacity, teacher_name))
+            except Exception as e:
+                print(f"Ошибка при форматировании занятия {cls.id}: {str(e)}")
+                continue
             
-            print(f"Возвращаем {len(result)} занятий")
-            return result
+        print(f"Возвращаем {len(result)} занятий")
+        body = dumps(result)
+        schedule_cache.set(cache_key, (version.etag, body, next_cursor))
+        return full_response(conditional_stats, version, body, started, page.headers(next_cursor))
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Ошибка при получении расписания: {str(e)}")
         raise HTTPException(
@@ -465,52 +786,21 @@ def get_classes(
         )
 
 @app.get("/students/", response_model=List[StudentResponse])
-def get_students():
-    """Получение списка всех студентов с email"""
-    with Session(engine) as session:
-        query = (
-            select(
-                Students,
-                Users.email
-            )
-            .join(Users, Students.user_id == Users.id)
-        )
-        students = session.exec(query).all()
-        
-        return [
-            StudentResponse(
-                id=student.id,
-                full_name=student.full_name,
-                email=email,
-                phone=student.phone,
-                date_of_birth=student.date_of_birth,
-                gender=student.gender
-            )
-            for student, email in students
-        ]
-
-@app.get("/students/{student_id}", response_model=StudentResponse)
-def get_student_by_id(student_id: int):
-    """Получение информации о студенте по его ID"""
-    with Session(engine) as session:
-        query = (
-            select(
-                Students,
-                Users.email
-            )
-            .join(Users, Students.user_id == Users.id)
-            .where(Students.id == student_id)
+def get_students(response: Response, page: Page = Depends(), session: Session = Depends(get_session)):
+    """Получение списка всех студентов с email (страницами по limit/cursor)"""
+    query = (
+        select(
+            Students,
+            Users.email
         )
-        result = session.exec(query).first()
+        .join(Users, Students.user_id == Users.id)
+    )
+    students = session.exec(page.apply(query, Students.id)).all()
+    students, next_cursor = page.split(students, lambda row: (row[0].id,))
+    response.headers.update(page.headers(next_cursor))
         
-        if not result:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="Студент не найден"
-            )
-            
-        student, email = result
-        return StudentResponse(
+    return [
+        StudentResponse(
             id=student.id,
             full_name=student.full_name,
             email=email,
@@ -518,56 +808,99 @@ def get_student_by_id(student_id: int):
             date_of_birth=student.date_of_birth,
             gender=student.gender
         )
+        for student, email in students
+    ]
 
 @app.get("/students/me", response_model=StudentResponse)
-async def get_current_student(current_user: Users = Depends(get_current_user)):
+async def get_current_student(
+    identity: TokenIdentity = Depends(get_current_identity),
+    session: AsyncSession = Depends(get_async_session)
+):
     """Получение информации о текущем студенте"""
-    if current_user.role != UserRole.STUDENT:
+    if identity.role != UserRole.STUDENT:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Только для студентов"
         )
     
-    with Session(engine) as session:
-        query = (
-            select(
-                Students,
-                Users.email
-            )
-            .join(Users, Students.user_id == Users.id)
-            .where(Users.id == current_user.id)
-        )
-        result = session.exec(query).first()
+    student = await session.get(Students, identity.student_id) if identity.student_id else None
         
-        if not result:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="Студент не найден"
-            )
+    if not student:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Студент не найден"
+        )
             
-        student, email = result
-        return StudentResponse(
-            id=student.id,
-            full_name=student.full_name,
-            email=email,
-            phone=student.phone,
-            date_of_birth=student.date_of_birth,
-            gender=student.gender
+    return StudentResponse(
+        id=student.id,
+        full_name=student.full_name,
+        email=identity.email,
+        phone=student.phone,
+        date_of_birth=student.date_of_birth,
+        gender=student.gender
+    )
+
+@app.get("/students/{student_id}", response_model=StudentResponse)
+def get_student_by_id(student_id: int, session: Session = Depends(get_session)):
+    """Получение информации о студенте по его ID"""
+    query = (
+        select(
+            Students,
+            Users.email
         )
+        .join(Users, Students.user_id == Users.id)
+        .where(Students.id == student_id)
+    )
+    result = session.exec(query).first()
+        
+    if not result:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Студент не найден"
+        )
+            
+    student, email = result
+    return StudentResponse(
+        id=student.id,
+        full_name=student.full_name,
+        email=email,
+        phone=student.phone,
+        date_of_birth=student.date_of_birth,
+        gender=student.gender
+    )
 
 # Эндпоинты для преподавателей
 @app.get("/teachers/", response_model=List[TeacherResponse])
-def get_teachers():
-    """Получение списка всех преподавателей с email"""
-    with Session(engine) as session:
-        query = select(
-            Teachers,
-            Users.email
-        ).join(Users, Teachers.user_id == Users.id)
+def get_teachers(
+    page: Page = Depends(),
+    if_none_match: Optional[str] = Header(None),
+    if_modified_since: Optional[str] = Header(None),
+    session: Session = Depends(get_session)
+):
+    """Получение списка всех преподавателей с email (страницами по limit/cursor)"""
+    version = probe_version(
+        session, conditional_stats, "/teachers/",
+        lambda versions: (
+            select(func.count(Teachers.id), *versions(Teachers.updated_at), *versions(Users.updated_at))
+            .select_from(Teachers)
+            .join(Users, Teachers.user_id == Users.id)
+        ),
+        page.key
+    )
+    not_modified = not_modified_response(conditional_stats, version, if_none_match, if_modified_since)
+    if not_modified is not None:
+        return not_modified
+
+    started = cpu_time()
+    query = select(
+        Teachers,
+        Users.email
+    ).join(Users, Teachers.user_id == Users.id)
         
-        teachers = session.exec(query).all()
+    teachers = session.exec(page.apply(query, Teachers.id)).all()
+    teachers, next_cursor = page.split(teachers, lambda row: (row[0].id,))
 
-    return [
+    return full_response(conditional_stats, version, [
             TeacherResponse(
                 id=teacher.id,
                 full_name=teacher.full_name,
@@ -577,39 +910,38 @@ def get_teachers():
                 specialization=teacher.specialization
             )
             for teacher, email in teachers
-        ]
+        ], started, page.headers(next_cursor))
 
 # Эндпоинты для посещаемости
 @app.get("/attendance/{class_id}", response_model=List[dict])
-def get_class_attendance(class_id: int):
+def get_class_attendance(class_id: int, session: Session = Depends(get_session)):
     """Получение посещаемости для конкретного класса"""
-    with Session(engine) as session:
-        query = (
-            select(
-                Attendance.id,
-                Students.full_name,
-                Users.email,
-                Attendance.presence
-            )
-            .join(Students, Attendance.student_id == Students.id)
-            .join(Users, Students.user_id == Users.id)
-            .where(Attendance.class_id == class_id)
+    query = (
+        select(
+            Attendance.id,
+            Students.full_name,
+            Users.email,
+            Attendance.presence
         )
+        .join(Students, Attendance.student_id == Students.id)
+        .join(Users, Students.user_id == Users.id)
+        .where(Attendance.class_id == class_id)
+    )
         
-        results = session.exec(query).all()
-        return [
-            {
-                "id": att_id,
-                "full_name": full_name,
-                "email": email,
-                "presence": presence
-            }
-            for att_id, full_name, email, presence in results
-        ]
+    results = session.exec(query).all()
+    return [
+        {
+            "id": att_id,
+            "full_name": full_name,
+            "email": email,
+            "presence": presence
+        }
+        for att_id, full_name, email, presence in results
+    ]
 
 # Эндпоинты для администратора
 @app.post("/classes/", response_model=ClassResponse)
-def create_class(class_data: CreateClassRequest, current_user: Users = Depends(get_current_user)):
+def create_class(class_data: CreateClassRequest, current_user: Users = Depends(get_current_user), session: Session = Depends(get_session)):
     """Создание нового занятия (только для администратора)"""
     if current_user.role != UserRole.ADMIN:
         raise HTTPException(
@@ -618,86 +950,52 @@ def create_class(class_data: CreateClassRequest, current_user: Users = Depends(g
         )
     
     try:
-        with Session(engine) as session:
-            # Проверка существования зала и преподавателя
-            hall = session.get(Halls, class_data.hall_id)
-            teacher = session.get(Teachers, class_data.teacher_id)
+        # Проверка существования зала и преподавателя
+        hall = session.get(Halls, class_data.hall_id)
+        teacher = session.get(Teachers, class_data.teacher_id)
             
-            if not hall:
-                raise HTTPException(
-                    status_code=status.HTTP_404_NOT_FOUND,
-                    detail="Зал не найден"
-                )
-            if not teacher:
-                raise HTTPException(
-                    status_code=status.HTTP_404_NOT_FOUND,
-                    detail="Преподаватель не найден"
-                )
-
-            # Проверка на конфликты расписания
-            existing_class = session.exec(
-                select(Classes).where(
-                    and_(
-                        Classes.hall_id == class_data.hall_id,
-                        Classes.date == class_data.date,
-                        Classes.time == datetime.strptime(class_data.time, '%H:%M').time()
-                    )
-                )
-            ).first()
+        if not hall:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Зал не найден"
+            )
+        if not teacher:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Преподаватель не найден"
+            )
 
-            if existing_class:
-                raise HTTPException(
-                    status_code=status.HTTP_400_BAD_REQUEST,
-                    detail="Зал уже занят в это время"
-                )
+        # Проверка на конфликты расписания: пересечения по залу и по преподавателю
+        class_time = parse_class_time(class_data.time)
+        raise_on_conflicts(find_conflicts(
+            session, class_data.date, class_time, class_data.duration_minutes,
+            class_data.hall_id, class_data.teacher_id
+        ))
+        # Перепроверка по БД под блокировкой зала и преподавателя до commit
+        check_conflicts_locked(
+            session, [(class_data.date, class_time)], class_data.duration_minutes,
+            class_data.hall_id, class_data.teacher_id
+        )
 
-            # Создание нового занятия
-            new_class = Classes(
-                time=datetime.strptime(class_data.time, '%H:%M').time(),
-                type=class_data.type,
-                hall_id=class_data.hall_id,
-                teacher_id=class_data.teacher_id,
-                date=class_data.date,
-                current_capacity=0
-            )
-            
-            session.add(new_class)
-            session.commit()
-            session.refresh(new_class)
-
-            # Форматируем данные для ответа
-            formatted_date = new_class.date.strftime('%d.%m.%Y')
-            formatted_time = new_class.time.strftime('%H:%M')
-            day_of_week = new_class.date.strftime('%A')
+        # Создание нового занятия
+        new_class = Classes(
+            time=class_time,
+            type=class_data.type,
+            hall_id=class_data.hall_id,
+            teacher_id=class_data.teacher_id,
+            date=class_data.date,
+            current_capacity=0,
+            duration_minutes=class_data.duration_minutes
+        )
             
-            russian_days = {
-                'Monday': 'Понедельник',
-                'Tuesday': 'Вторник',
-                'Wednesday': 'Среда',
-                'Thursday': 'Четверг',
-                'Friday': 'Пятница',
-                'Saturday': 'Суббота',
-                'Sunday': 'Воскресенье'
-            }
-            russian_day_of_week = russian_days.get(day_of_week, day_of_week)
-
-            return ClassResponse(
-                id=new_class.id,
-                time=new_class.time.strftime('%H:%M:%S'),
-                type=new_class.type,
-                date=new_class.date,
-                current_capacity=new_class.current_capacity,
-                hall_number=hall.hall_number,
-                hall_capacity=hall.capacity,
-                teacher_name=teacher.full_name,
-                specialization=teacher.specialization,
-                remaining_slots=hall.capacity - new_class.current_capacity,
-                formatted_date=formatted_date,
-                formatted_time=formatted_time,
-                day_of_week=russian_day_of_week,
-                teacher_id=teacher.id,
-                hall_id=hall.id
-            )
+        session.add(new_class)
+        session.commit()
+        session.refresh(new_class)
+        invalidate_schedule_cache(schedule_key(new_class))
+
+        return json_response(class_row(new_class, hall.hall_number, hall.capacity, teacher.full_name))
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Ошибка при создании занятия: {str(e)}")
         raise HTTPException(
@@ -706,64 +1004,53 @@ def create_class(class_data: CreateClassRequest, current_user: Users = Depends(g
         )
 
 @app.get("/attendance/student/{student_id}", response_model=List[AttendanceResponse])
-def get_student_attendance_endpoint(student_id: int):
-    """Получение посещаемости студента"""
+def get_student_attendance_endpoint(student_id: int, page: Page = Depends(), session: Session = Depends(get_session)):
+    """Получение посещаемости студента (страницами по limit/cursor)"""
     try:
-        with Session(engine) as session:
-            # Получаем все записи о посещаемости для студента
-            attendance_records = session.exec(
-                select(Attendance)
-                .where(Attendance.student_id == student_id)
-            ).all()
+        # Получаем записи о посещаемости для студента
+        attendance_records = session.exec(page.apply(
+            select(Attendance)
+            .where(Attendance.student_id == student_id),
+            Attendance.id
+        )).all()
+        attendance_records, next_cursor = page.split(attendance_records, lambda record: (record.id,))
             
-            if not attendance_records:
-                return []
+        if not attendance_records:
+            return []
             
-            # Создаем список ответов
-            response = []
-            for record in attendance_records:
-                # Получаем информацию о занятии
-                class_info = session.get(Classes, record.class_id)
-                if not class_info:
-                    continue
+        # Занятия, залы, преподаватели и студенты — по одному запросу на тип
+        loader = load_attendance_relations(session, attendance_records)
+
+        # Создаем список ответов
+        response = []
+        for record in attendance_records:
+            # Получаем информацию о занятии
+            class_info = loader.get(Classes, record.class_id)
+            if not class_info:
+                continue
                     
-                # Получаем информацию о преподавателе
-                teacher = session.get(Teachers, class_info.teacher_id)
-                if not teacher:
-                    continue
+            # Получаем информацию о преподавателе
+            teacher = loader.get(Teachers, class_info.teacher_id)
+            if not teacher:
+                continue
                     
-                # Получаем информацию о зале
-                hall = session.get(Halls, class_info.hall_id)
-                if not hall:
-                    continue
+            # Получаем информацию о зале
+            hall = loader.get(Halls, class_info.hall_id)
+            if not hall:
+                continue
                     
-                # Получаем информацию о студенте
-                student = session.get(Students, record.student_id)
+            # Получаем информацию о студенте
+            student = loader.get(Students, record.student_id)
                 
-                response.append(AttendanceResponse(
-                    id=record.id,
-                    presence=record.presence,
-                    student_id=record.student_id,
-                    class_id=record.class_id,
-                    teacher_id=record.teacher_id,
-                    student_name=student.full_name if student else "Unknown",
-                    class_=ClassResponse(
-                        id=class_info.id,
-                        time=class_info.time.strftime('%H:%M:%S'),
-                        type=class_info.type,
-                        date=class_info.date,
-                        current_capacity=class_info.current_capacity,
-                        hall_number=hall.hall_number,
-                        hall_capacity=hall.capacity,
-                        teacher_name=teacher.full_name,
-                        formatted_date=class_info.date.strftime('%d.%m.%Y'),
-                        formatted_time=class_info.time.strftime('%H:%M'),
-                        teacher_id=class_info.teacher_id,
-                        hall_id=class_info.hall_id
-                    )
-                ))
+            response.append(attendance_row(
+                record,
+                student.full_name if student else "Unknown",
+                class_row(class_info, hall.hall_number, hall.capacity, teacher.full_name)
+            ))
             
-            return response
+        return json_response(response, headers=page.headers(next_cursor))
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Error in get_student_attendance_endpoint: {str(e)}")
         raise HTTPException(
@@ -772,145 +1059,183 @@ def get_student_attendance_endpoint(student_id: int):
         )
 
 @app.get("/attendance/class/{class_id}", response_model=List[AttendanceResponse])
-async def get_class_attendance_endpoint(class_id: int):
+async def get_class_attendance_endpoint(class_id: int, session: AsyncSession = Depends(get_async_session)):
     """Получение списка записанных студентов на занятие"""
-    with Session(engine) as session:
-        # Получаем все записи о посещаемости для занятия
-        attendances = session.exec(
-            select(Attendance)
-            .join(Students, Attendance.student_id == Students.id)
-            .where(Attendance.class_id == class_id)
-        ).all()
-
-        result = []
-        for attendance in attendances:
-            student = session.get(Students, attendance.student_id)
-            class_ = session.get(Classes, attendance.class_id)
-            hall = session.get(Halls, class_.hall_id)
-            teacher = session.get(Teachers, class_.teacher_id)
-            if student and class_:
-                result.append(AttendanceResponse(
-                    id=attendance.id,
-                    presence=attendance.presence,
-                    student_id=attendance.student_id,
-                    class_id=attendance.class_id,
-                    teacher_id=attendance.teacher_id,
-                    student_name=student.full_name,
-                    class_=ClassResponse(
-                        id=class_.id,
-                        time=class_.time.strftime('%H:%M:%S'),
-                        type=class_.type,
-                        date=class_.date,
-                        current_capacity=class_.current_capacity,
-                        hall_number=hall.hall_number,
-                        hall_capacity=hall.capacity,
-                        teacher_name=teacher.full_name,
-                        specialization=teacher.specialization,
-                        remaining_slots=hall.capacity - class_.current_capacity,
-                        formatted_date=class_.date.strftime('%d.%m.%Y'),
-                        formatted_time=class_.time.strftime('%H:%M'),
-                        day_of_week=class_.date.strftime('%A'),
-                        teacher_id=class_.teacher_id,
-                        hall_id=class_.hall_id
-                    )
-                ))
-
-        return result
+    # Получаем все записи о посещаемости для занятия
+    attendances = (await session.exec(
+        select(Attendance)
+        .join(Students, Attendance.student_id == Students.id)
+        .where(Attendance.class_id == class_id)
+    )).all()
+
+    loader = await session.run_sync(load_attendance_relations, attendances)
+
+    result = []
+    for attendance in attendances:
+        student = loader.get(Students, attendance.student_id)
+        class_ = loader.get(Classes, attendance.class_id)
+        hall = loader.get(Halls, class_.hall_id) if class_ else None
+        teacher = loader.get(Teachers, class_.teacher_id) if class_ else None
+        if student and class_ and hall and teacher:
+            result.append(attendance_row(
+                attendance,
+                student.full_name,
+                class_row(class_, hall.hall_number, hall.capacity, teacher.full_name)
+            ))
+
+    return json_response(result)
 
 # Эндпоинты для залов
 @app.get("/halls/", response_model=List[Halls])
-def read_halls():
+def read_halls(
+    if_none_match: Optional[str] = Header(None),
+    if_modified_since: Optional[str] = Header(None),
+    session: Session = Depends(get_session)
+):
     """Получение списка всех залов"""
-    return get_all_halls()
+    version = probe_version(
+        session, conditional_stats, "/halls/",
+        lambda versions: select(func.count(Halls.id), *versions(Halls.updated_at))
+    )
+    not_modified = not_modified_response(conditional_stats, version, if_none_match, if_modified_since)
+    if not_modified is not None:
+        return not_modified
+
+    started = cpu_time()
+    return full_response(conditional_stats, version, get_all_halls(session), started)
 
 @app.post("/classes/{class_id}/enroll", response_model=Dict[str, Any])
 async def enroll_in_class(
     class_id: int,
-    current_user: Users = Depends(get_current_user)
+    identity: TokenIdentity = Depends(get_current_identity),
+    session: AsyncSession = Depends(get_async_session)
 ):
     """Запись студента на занятие"""
-    with Session(engine) as session:
-        # Проверяем, что пользователь является студентом
-        if current_user.role != UserRole.STUDENT:
-            raise HTTPException(
-                status_code=status.HTTP_403_FORBIDDEN,
-                detail="Только студенты могут записываться на занятия"
-            )
-
-        # Получаем студента
-        student = session.exec(
-            select(Students).where(Students.user_id == current_user.id)
-        ).first()
-        if not student:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="Студент не найден"
-            )
+    # Проверяем, что пользователь является студентом
+    if identity.role != UserRole.STUDENT:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Только студенты могут записываться на занятия"
+        )
 
-        # Получаем занятие
-        class_ = session.get(Classes, class_id)
-        if not class_:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="Занятие не найдено"
-            )
+    # id студента берем из claims токена
+    if not identity.student_id:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Студент не найден"
+        )
 
-        # Получаем информацию о зале
-        hall = session.get(Halls, class_.hall_id)
-        if not hall:
+    # Место, абонемент и повторная запись проверяются одним условным UPDATE;
+    # при всплеске записи на одно занятие идут пачками через очередь занятия
+    if ENROLLMENT_ADMISSION:
+        enrollment = await admission.enroll(identity.student_id, class_id)
+    else:
+        enrollment = await enroll_student(session, identity.student_id, class_id)
+    invalidate_schedule_cache((enrollment["date"], enrollment["type"], enrollment["teacher_id"]))
+
+    hall_capacity = hall_capacities.get(enrollment["hall_id"])
+    if hall_capacity is None:
+        hall_capacity = (await session.get(Halls, enrollment["hall_id"])).capacity
+
+    return {
+        "message": "Студент успешно записан на занятие",
+        "attendance_id": enrollment["attendance_id"],
+        "current_capacity": enrollment["current_capacity"],
+        "hall_capacity": hall_capacity
+    }
+
+@app.post("/classes/enroll", response_model=Dict[str, Any])
+async def enroll_in_classes(
+    request: BulkEnrollRequest,
+    identity: TokenIdentity = Depends(get_current_identity),
+    session: AsyncSession = Depends(get_async_session)
+):
+    """
+    Запись студента сразу на несколько занятий (список class_ids или занятия серии
+    series_id начиная с from_date) в одной транзакции, с результатом по каждому занятию
+    """
+    student_id = current_student_id(identity)
+    class_ids = list(request.class_ids)
+    if request.series_id is not None:
+        rows = await session.run_sync(series_classes, request.series_id, request.from_date or date.today())
+        class_ids.extend(row.id for row in rows)
+        if not rows:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
-                detail="Зал не найден"
-            )
-
-        # Проверяем, не заполнен ли зал
-        if class_.current_capacity >= hall.capacity:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Зал уже заполнен"
+                detail="В серии нет занятий начиная с этой даты"
             )
 
-        # Проверяем, не записан ли уже студент
-        existing_attendance = session.exec(
-            select(Attendance).where(
-                and_(
-                    Attendance.student_id == student.id,
-                    Attendance.class_id == class_id
-                )
-            )
-        ).first()
-        if existing_attendance:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Студент уже записан на это занятие"
-            )
+    result = await session.run_sync(enroll_many, student_id, class_ids, request.mode)
+    invalidate_schedule_cache(*[
+        (row["date"], row["type"], row["teacher_id"]) for row in result["results"] if row["status"] == "enrolled"
+    ])
+    return result
 
-        # Создаем запись о посещаемости
-        attendance = Attendance(
-            student_id=student.id,
-            class_id=class_id,
-            teacher_id=class_.teacher_id,
-            presence=AttendanceStatus.REGISTERED
+def current_student_id(identity: TokenIdentity) -> int:
+    """id студента из claims токена (403 для других ролей)"""
+    if identity.role != UserRole.STUDENT:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Только для студентов"
         )
-        session.add(attendance)
-
-        # Увеличиваем количество записанных студентов
-        class_.current_capacity += 1
-        session.add(class_)
+    if not identity.student_id:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Студент не найден"
+        )
+    return identity.student_id
 
-        session.commit()
+@app.delete("/classes/{class_id}/enroll")
+async def cancel_class_enrollment(
+    class_id: int,
+    identity: TokenIdentity = Depends(get_current_identity),
+    session: AsyncSession = Depends(get_async_session)
+):
+    """Отмена записи на занятие; место сразу получает первый из листа ожидания"""
+    result = await session.run_sync(cancel_enrollment, current_student_id(identity), class_id)
+    admission.forget(class_id)
+    invalidate_schedule_cache((result["date"], result["type"], result["teacher_id"]))
+    return {"message": "Запись на занятие отменена", "promoted_from_waitlist": result["promoted"]}
+
+@app.post("/classes/{class_id}/waitlist")
+async def join_class_waitlist(
+    class_id: int,
+    identity: TokenIdentity = Depends(get_current_identity),
+    session: AsyncSession = Depends(get_async_session)
+):
+    """Постановка в лист ожидания на заполненное занятие"""
+    entry = await session.run_sync(join_waitlist, current_student_id(identity), class_id)
+    return {"message": "Вы в листе ожидания", **entry}
 
-        return {
-            "message": "Студент успешно записан на занятие",
-            "attendance_id": attendance.id,
-            "current_capacity": class_.current_capacity,
-            "hall_capacity": hall.capacity
-        }
+@app.delete("/classes/{class_id}/waitlist")
+async def leave_class_waitlist(
+    class_id: int,
+    identity: TokenIdentity = Depends(get_current_identity),
+    session: AsyncSession = Depends(get_async_session)
+):
+    """Выход из листа ожидания"""
+    await session.run_sync(leave_waitlist, current_student_id(identity), class_id)
+    return {"message": "Вы вышли из листа ожидания"}
+
+@app.get("/classes/{class_id}/waitlist")
+def get_class_waitlist(
+    class_id: int,
+    current_user: Users = Depends(get_current_user),
+    session: Session = Depends(get_session)
+):
+    """Лист ожидания занятия по порядку (для администратора)"""
+    if current_user.role != UserRole.ADMIN:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Только для администраторов"
+        )
+    return class_waitlist(session, class_id)
 
 @app.get("/subscriptions/{student_id}", response_model=List[SubscriptionResponse])
 async def get_student_subscription(
     student_id: int,
-    current_user: Users = Depends(get_current_user)
+    current_user: TokenIdentity = Depends(get_current_identity),
+    session: AsyncSession = Depends(get_async_session)
 ):
     """Получение активных подписок студента"""
     try:
@@ -929,14 +1254,13 @@ async def get_student_subscription(
             )
         
         # Получаем подписки
-        with Session(engine) as session:
-            subscriptions = get_active_subscriptions(session, student_id)
-            if not subscriptions:
-                print(f"No active subscriptions found for student_id: {student_id}")
-                return []
+        subscriptions = await get_active_subscriptions_async(session, student_id)
+        if not subscriptions:
+            print(f"No active subscriptions found for student_id: {student_id}")
+            return []
             
-            print(f"Found {len(subscriptions)} active subscriptions")
-            return subscriptions
+        print(f"Found {len(subscriptions)} active subscriptions")
+        return subscriptions
             
     except HTTPException as e:
         print(f"HTTP Exception: {str(e)}")
@@ -985,11 +1309,12 @@ async def get_student_subscription(
             }
         )
 
-@app.get("/attendance/{student_id}", response_model=Optional[Attendance])
-async def get_student_attendance(
-    student_id: int
+@app.get("/attendance/{student_id}", response_model=List[Attendance])
+def get_student_attendance(
+    student_id: int,
+    session: Session = Depends(get_session)
 ):
-    """Получение активной подписки студента"""
+    """Получение посещаемости студента"""
     try:
         print(f"Attempting to get subscription for student_id: {student_id}")
        
@@ -998,22 +1323,21 @@ async def get_student_attendance(
         
                
         # Получаем подписку
-        with Session(engine) as session:
-            attendance = get_student_attendance(session, student_id)
-            if attendance is None:
-                print(f"No active subscription found for student_id: {student_id}")
-                raise HTTPException(
-                    status_code=status.HTTP_404_NOT_FOUND,
-                    detail={
-                        "message": "Подписка не найдена",
-                        "errors": [
-                            "У студента нет активной подписки",
-                            "Возможно, подписка истекла или еще не была приобретена"
-                        ]
-                    }
-                )
-            print(f"Found subscription: {attendance}")
-            return attendance
+        attendance = fetch_student_attendance(student_id, session)
+        if not attendance:
+            print(f"No active subscription found for student_id: {student_id}")
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail={
+                    "message": "Подписка не найдена",
+                    "errors": [
+                        "У студента нет активной подписки",
+                        "Возможно, подписка истекла или еще не была приобретена"
+                    ]
+                }
+            )
+        print(f"Found subscription: {attendance}")
+        return attendance
             
     except HTTPException as e:
         print(f"HTTP Exception: {str(e)}")
@@ -1054,7 +1378,8 @@ async def get_student_attendance(
 def update_class(
     class_id: int,
     class_data: UpdateClassRequest,
-    current_user: Users = Depends(get_current_user)
+    current_user: Users = Depends(get_current_user),
+    session: Session = Depends(get_session)
 ):
     """Обновление информации о занятии"""
     if current_user.role != UserRole.ADMIN:
@@ -1063,47 +1388,88 @@ def update_class(
             detail="Только администраторы могут обновлять занятия"
         )
     
-    with Session(engine) as session:
-        class_ = session.exec(select(Classes).where(Classes.id == class_id)).first()
-        if not class_:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="Занятие не найдено"
-            )
+    class_ = session.exec(select(Classes).where(Classes.id == class_id)).first()
+    if not class_:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Занятие не найдено"
+        )
         
-        # Проверка доступности зала
-        hall = session.exec(select(Halls).where(Halls.id == class_data.hall_id)).first()
-        if not hall:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="Зал не найден"
-            )
+    # Проверка доступности зала
+    hall = session.exec(select(Halls).where(Halls.id == class_data.hall_id)).first()
+    if not hall:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Зал не найден"
+        )
         
-        # Проверка занятости преподавателя
-        teacher = session.exec(select(Teachers).where(Teachers.id == class_data.teacher_id)).first()
-        if not teacher:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="Преподаватель не найден"
-            )
+    # Проверка занятости преподавателя
+    teacher = session.exec(select(Teachers).where(Teachers.id == class_data.teacher_id)).first()
+    if not teacher:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Преподаватель не найден"
+        )
         
-        # Обновление данных занятия
-        class_.time = class_data.time
-        class_.type = class_data.type
-        class_.hall_id = class_data.hall_id
-        class_.teacher_id = class_data.teacher_id
-        class_.date = class_data.date
+    # Проверка на конфликты расписания (само занятие не считается)
+    class_time = parse_class_time(class_data.time)
+    # Длительность не передана — остается прежней
+    duration_minutes = class_data.duration_minutes if class_data.duration_minutes is not None \
+        else class_.duration_minutes
+    raise_on_conflicts(find_conflicts(
+        session, class_data.date, class_time, duration_minutes,
+        class_data.hall_id, class_data.teacher_id, exclude_ids=(class_id,)
+    ))
+    check_conflicts_locked(
+        session, [(class_data.date, class_time)], duration_minutes,
+        class_data.hall_id, class_data.teacher_id, exclude_ids=(class_id,)
+    )
+
+    hall_changed = class_.hall_id != class_data.hall_id
+    if hall_changed and class_.current_capacity > hall.capacity:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"На занятие уже записано {class_.current_capacity} человек, а вместимость зала {hall.capacity}"
+        )
+
+    # Обновление данных занятия
+    old_key = schedule_key(class_)
+    class_.time = class_time
+    class_.type = class_data.type
+    class_.hall_id = class_data.hall_id
+    class_.teacher_id = class_data.teacher_id
+    class_.date = class_data.date
+    class_.duration_minutes = duration_minutes
         
-        session.add(class_)
+    session.add(class_)
+    try:
+        if hall_changed:
+            # В новом зале может быть больше мест — их получает лист ожидания
+            session.flush()
+            promote(session, class_id)
         session.commit()
-        session.refresh(class_)
+    except (IntegrityError, InternalError, OperationalError) as e:
+        # Триггер check_class_capacity: между проверкой и записью на занятие успели записаться
+        session.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail={
+                "message": "Занятие не помещается в зал",
+                "errors": [str(getattr(e, "orig", e))]
+            }
+        )
+    session.refresh(class_)
+    if hall_changed:
+        admission.forget(class_id)
+    invalidate_schedule_cache(old_key, schedule_key(class_))
         
-        return class_
+    return json_response(class_row(class_, hall.hall_number, hall.capacity, teacher.full_name))
 
 @app.delete("/classes/{class_id}")
 def delete_class(
     class_id: int,
-    current_user: Users = Depends(get_current_user)
+    current_user: Users = Depends(get_current_user),
+    session: Session = Depends(get_session)
 ):
     """Удаление занятия"""
     if current_user.role != UserRole.ADMIN:
@@ -1112,30 +1478,159 @@ def delete_class(
             detail="Только администраторы могут удалять занятия"
         )
     
-    with Session(engine) as session:
-        class_ = session.exec(select(Classes).where(Classes.id == class_id)).first()
-        if not class_:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="Занятие не найдено"
-            )
+    class_ = session.exec(select(Classes).where(Classes.id == class_id)).first()
+    if not class_:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Занятие не найдено"
+        )
         
-        # Удаляем все записи о посещаемости для этого занятия
-        attendance_records = session.exec(
-            select(Attendance).where(Attendance.class_id == class_id)
-        ).all()
-        for record in attendance_records:
-            session.delete(record)
+    # Удаляем все записи о посещаемости для этого занятия
+    attendance_records = session.exec(
+        select(Attendance).where(Attendance.class_id == class_id)
+    ).all()
+    for record in attendance_records:
+        session.delete(record)
+    drop_queues(session, [class_id])
         
-        session.delete(class_)
-        session.commit()
+    deleted_key = schedule_key(class_)
+    session.delete(class_)
+    session.commit()
+    invalidate_schedule_cache(deleted_key)
+    admission.forget(class_id)
         
-        return {"message": "Занятие успешно удалено"}
+    return {"message": "Занятие успешно удалено"}
+
+@app.post("/classes/series", response_model=ClassSeriesResponse)
+def create_class_series(
+    series_data: CreateClassSeriesRequest,
+    current_user: Users = Depends(get_current_user),
+    session: Session = Depends(get_session)
+):
+    """Создание серии повторяющихся занятий (все занятия серии — одним запросом)"""
+    if current_user.role != UserRole.ADMIN:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Только администраторы могут создавать занятия"
+        )
+
+    hall = session.get(Halls, series_data.hall_id)
+    if not hall:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Зал не найден"
+        )
+    if not session.get(Teachers, series_data.teacher_id):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Преподаватель не найден"
+        )
+
+    try:
+        series = ClassSeries.model_validate({
+            "time": parse_class_time(series_data.time),
+            "type": series_data.type,
+            "hall_id": series_data.hall_id,
+            "teacher_id": series_data.teacher_id,
+            "duration_minutes": series_data.duration_minutes,
+            "weekdays": format_weekdays(series_data.weekdays),
+            "start_date": series_data.start_date,
+            "end_date": series_data.end_date
+        })
+    except ValidationError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail={"message": "Некорректные данные серии", "errors": [error["msg"] for error in e.errors()]}
+        )
+
+    created = create_series(session, series, series_data.exceptions)
+    invalidate_schedule_cache(*[(day, series.type, series.teacher_id) for class_id, day in created])
+
+    return series_response(series, [class_id for class_id, day in created])
+
+@app.put("/classes/series/{series_id}", response_model=ClassSeriesResponse)
+def update_class_series(
+    series_id: int,
+    series_data: UpdateClassSeriesRequest,
+    current_user: Users = Depends(get_current_user),
+    session: Session = Depends(get_session)
+):
+    """Изменение всех занятий серии начиная с from_date (по умолчанию с сегодняшнего дня)"""
+    if current_user.role != UserRole.ADMIN:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Только администраторы могут обновлять занятия"
+        )
+
+    series = session.get(ClassSeries, series_id)
+    if not series:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Серия занятий не найдена"
+        )
+
+    changes = {}
+    if series_data.hall_id is not None:
+        if not session.get(Halls, series_data.hall_id):
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Зал не найден"
+            )
+        changes["hall_id"] = series_data.hall_id
+    if series_data.teacher_id is not None:
+        if not session.get(Teachers, series_data.teacher_id):
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Преподаватель не найден"
+            )
+        changes["teacher_id"] = series_data.teacher_id
+    if series_data.time is not None:
+        changes["time"] = parse_class_time(series_data.time)
+    if series_data.type is not None:
+        changes["type"] = series_data.type
+    if series_data.duration_minutes is not None:
+        changes["duration_minutes"] = series_data.duration_minutes
+
+    from_date = series_data.from_date or date.today()
+    old_keys, new_keys = update_series(session, series, changes, from_date)
+    invalidate_schedule_cache(*old_keys, *new_keys)
+    if "hall_id" in changes:
+        admission.forget()
+    print(f"Серия {series_id}: изменено занятий {len(new_keys)} начиная с {from_date}")
+
+    return series_response(series, [])
+
+@app.delete("/classes/series/{series_id}")
+def cancel_class_series(
+    series_id: int,
+    from_date: Optional[date] = None,
+    current_user: Users = Depends(get_current_user),
+    session: Session = Depends(get_session)
+):
+    """Отмена занятий серии начиная с from_date (по умолчанию с сегодняшнего дня)"""
+    if current_user.role != UserRole.ADMIN:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Только администраторы могут удалять занятия"
+        )
+
+    series = session.get(ClassSeries, series_id)
+    if not series:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Серия занятий не найдена"
+        )
+
+    deleted_keys = cancel_series(session, series, from_date or date.today())
+    invalidate_schedule_cache(*deleted_keys)
+
+    return {"message": f"Отменено занятий серии: {len(deleted_keys)}"}
 
 @app.post("/admin/teachers/", response_model=TeacherResponse)
 def create_teacher(
     teacher_data: CreateTeacherRequest,
-    current_user: Users = Depends(get_current_user)
+    current_user: Users = Depends(get_current_user),
+    session: Session = Depends(get_session)
 ):
     """Создание нового преподавателя (только для администратора)"""
     if current_user.role != UserRole.ADMIN:
@@ -1144,51 +1639,51 @@ def create_teacher(
             detail="Только администраторы могут создавать преподавателей"
         )
     
-    with Session(engine) as session:
-        # Проверяем, не существует ли уже пользователь с таким email
-        existing_user = session.exec(select(Users).where(Users.email == teacher_data.email)).first()
-        if existing_user:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Пользователь с таким email уже существует"
-            )
-        
-        # Создаем пользователя
-        user = Users(
-            email=teacher_data.email,
-            password_hash=get_password_hash(teacher_data.password),
-            role=UserRole.TEACHER
+    # Проверяем, не существует ли уже пользователь с таким email
+    existing_user = session.exec(select(Users).where(Users.email == teacher_data.email)).first()
+    if existing_user:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Пользователь с таким email уже существует"
         )
-        session.add(user)
-        session.commit()
-        session.refresh(user)
         
-        # Создаем преподавателя
-        teacher = Teachers(
-            full_name=teacher_data.full_name,
-            phone=teacher_data.phone,
-            experience=teacher_data.experience,
-            specialization=teacher_data.specialization,
-            user_id=user.id
-        )
-        session.add(teacher)
-        session.commit()
-        session.refresh(teacher)
+    # Создаем пользователя
+    user = Users(
+        email=teacher_data.email,
+        password_hash=get_password_hash(teacher_data.password),
+        role=UserRole.TEACHER
+    )
+    session.add(user)
+    session.commit()
+    session.refresh(user)
         
-        return TeacherResponse(
-            id=teacher.id,
-            full_name=teacher.full_name,
-            email=user.email,
-            phone=teacher.phone,
-            experience=teacher.experience,
-            specialization=teacher.specialization
-        )
+    # Создаем преподавателя
+    teacher = Teachers(
+        full_name=teacher_data.full_name,
+        phone=teacher_data.phone,
+        experience=teacher_data.experience,
+        specialization=teacher_data.specialization,
+        user_id=user.id
+    )
+    session.add(teacher)
+    session.commit()
+    session.refresh(teacher)
+        
+    return TeacherResponse(
+        id=teacher.id,
+        full_name=teacher.full_name,
+        email=user.email,
+        phone=teacher.phone,
+        experience=teacher.experience,
+        specialization=teacher.specialization
+    )
 
 @app.put("/admin/teachers/{teacher_id}", response_model=TeacherResponse)
 def update_teacher(
     teacher_id: int,
     teacher_data: UpdateTeacherRequest,
-    current_user: Users = Depends(get_current_user)
+    current_user: Users = Depends(get_current_user),
+    session: Session = Depends(get_session)
 ):
     """Обновление информации о преподавателе (только для администратора)"""
     if current_user.role != UserRole.ADMIN:
@@ -1197,62 +1692,69 @@ def update_teacher(
             detail="Только администраторы могут обновлять информацию о преподавателях"
         )
     
-    with Session(engine) as session:
-        teacher = session.exec(select(Teachers).where(Teachers.id == teacher_id)).first()
-        if not teacher:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="Преподаватель не найден"
-            )
+    teacher = session.exec(select(Teachers).where(Teachers.id == teacher_id)).first()
+    if not teacher:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Преподаватель не найден"
+        )
         
-        user = session.exec(select(Users).where(Users.id == teacher.user_id)).first()
+    user = session.exec(select(Users).where(Users.id == teacher.user_id)).first()
+    old_email = user.email
         
-        # Обновляем данные преподавателя
-        if teacher_data.full_name is not None:
-            teacher.full_name = teacher_data.full_name
-        if teacher_data.phone is not None:
-            teacher.phone = teacher_data.phone
-        if teacher_data.experience is not None:
-            teacher.experience = teacher_data.experience
-        if teacher_data.specialization is not None:
-            teacher.specialization = teacher_data.specialization
+    # Обновляем данные преподавателя
+    if teacher_data.full_name is not None:
+        teacher.full_name = teacher_data.full_name
+    if teacher_data.phone is not None:
+        teacher.phone = teacher_data.phone
+    if teacher_data.experience is not None:
+        teacher.experience = teacher_data.experience
+    if teacher_data.specialization is not None:
+        teacher.specialization = teacher_data.specialization
         
-        # Обновляем данные пользователя
-        if teacher_data.email is not None:
-            # Проверяем, не занят ли email другим пользователем
-            existing_user = session.exec(
-                select(Users)
-                .where(Users.email == teacher_data.email)
-                .where(Users.id != user.id)
-            ).first()
-            if existing_user:
-                raise HTTPException(
-                    status_code=status.HTTP_400_BAD_REQUEST,
-                    detail="Email уже используется другим пользователем"
-                )
-            user.email = teacher_data.email
+    # Обновляем данные пользователя
+    if teacher_data.email is not None:
+        # Проверяем, не занят ли email другим пользователем
+        existing_user = session.exec(
+            select(Users)
+            .where(Users.email == teacher_data.email)
+            .where(Users.id != user.id)
+        ).first()
+        if existing_user:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Email уже используется другим пользователем"
+            )
+        user.email = teacher_data.email
         
-        if teacher_data.password is not None:
-            user.password_hash = get_password_hash(teacher_data.password)
+    if teacher_data.password is not None:
+        user.password_hash = get_password_hash(teacher_data.password)
         
-        session.add(teacher)
-        session.add(user)
-        session.commit()
-        session.refresh(teacher)
+    # Новая версия профиля: ранее выданные claims становятся устаревшими
+    user.updated_at = datetime.now()
         
-        return TeacherResponse(
-            id=teacher.id,
-            full_name=teacher.full_name,
-            email=user.email,
-            phone=teacher.phone,
-            experience=teacher.experience,
-            specialization=teacher.specialization
-        )
+    session.add(teacher)
+    session.add(user)
+    session.commit()
+    session.refresh(teacher)
+    invalidate_user_cache(old_email, user.email)
+    revoke_profile_claims(user.id, profile_version(user))
+    invalidate_teacher_schedules(teacher.id)
+        
+    return TeacherResponse(
+        id=teacher.id,
+        full_name=teacher.full_name,
+        email=user.email,
+        phone=teacher.phone,
+        experience=teacher.experience,
+        specialization=teacher.specialization
+    )
 
 @app.delete("/admin/teachers/{teacher_id}")
 def delete_teacher(
     teacher_id: int,
-    current_user: Users = Depends(get_current_user)
+    current_user: Users = Depends(get_current_user),
+    session: Session = Depends(get_session)
 ):
     """Удаление преподавателя (только для администратора)"""
     if current_user.role != UserRole.ADMIN:
@@ -1261,57 +1763,67 @@ def delete_teacher(
             detail="Только администраторы могут удалять преподавателей"
         )
     
-    with Session(engine) as session:
-        teacher = session.exec(select(Teachers).where(Teachers.id == teacher_id)).first()
-        if not teacher:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="Преподаватель не найден"
-            )
+    teacher = session.exec(select(Teachers).where(Teachers.id == teacher_id)).first()
+    if not teacher:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Преподаватель не найден"
+        )
         
-        # Проверяем, нет ли у преподавателя будущих занятий
-        future_classes = session.exec(
-            select(Classes)
-            .where(Classes.teacher_id == teacher_id)
-            .where(Classes.date >= date.today())
-        ).all()
+    # Проверяем, нет ли у преподавателя будущих занятий
+    future_classes = session.exec(
+        select(Classes)
+        .where(Classes.teacher_id == teacher_id)
+        .where(Classes.date >= date.today())
+    ).all()
         
-        if future_classes:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Невозможно удалить преподавателя, у которого есть будущие занятия"
-            )
+    if future_classes:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Невозможно удалить преподавателя, у которого есть будущие занятия"
+        )
         
-        # Удаляем записи о посещаемости занятий преподавателя
-        attendance_records = session.exec(
-            select(Attendance)
-            .join(Classes, Attendance.class_id == Classes.id)
-            .where(Classes.teacher_id == teacher_id)
-        ).all()
+    # Удаляем записи о посещаемости занятий преподавателя
+    attendance_records = session.exec(
+        select(Attendance)
+        .join(Classes, Attendance.class_id == Classes.id)
+        .where(Classes.teacher_id == teacher_id)
+    ).all()
         
-        for record in attendance_records:
-            session.delete(record)
+    for record in attendance_records:
+        session.delete(record)
         
-        # Удаляем занятия преподавателя
-        classes = session.exec(
-            select(Classes).where(Classes.teacher_id == teacher_id)
-        ).all()
+    # Удаляем занятия преподавателя
+    classes = session.exec(
+        select(Classes).where(Classes.teacher_id == teacher_id)
+    ).all()
         
-        for class_ in classes:
-            session.delete(class_)
+    drop_queues(session, [class_.id for class_ in classes])
+    for class_ in classes:
+        session.delete(class_)
+    session.flush()
+
+    # Удаляем серии занятий преподавателя (будущих занятий у них уже нет)
+    for series in session.exec(select(ClassSeries).where(ClassSeries.teacher_id == teacher_id)).all():
+        session.delete(series)
         
-        # Удаляем пользователя и преподавателя
-        user = session.exec(select(Users).where(Users.id == teacher.user_id)).first()
-        session.delete(teacher)
-        session.delete(user)
-        session.commit()
+    # Удаляем пользователя и преподавателя
+    user = session.exec(select(Users).where(Users.id == teacher.user_id)).first()
+    user_email = user.email if user else None
+    session.delete(teacher)
+    session.delete(user)
+    session.commit()
+    invalidate_user_cache(user_email)
+    revoke_profile_claims(teacher.user_id)
+    invalidate_teacher_schedules(teacher_id)
         
-        return {"message": "Преподаватель успешно удален"}
+    return {"message": "Преподаватель успешно удален"}
 
 @app.post("/students/", response_model=StudentResponse)
 def create_student(
     student_data: CreateStudentRequest,
-    current_user: Users = Depends(get_current_user)
+    current_user: Users = Depends(get_current_user),
+    session: Session = Depends(get_session)
 ):
     """Создание нового студента"""
     try:
@@ -1321,45 +1833,44 @@ def create_student(
                 detail="Только администратор может создавать студентов"
             )
         
-        with Session(engine) as session:
-            # Проверяем, не существует ли уже пользователь с таким email
-            existing_user = session.exec(select(Users).where(Users.email == student_data.email)).first()
-            if existing_user:
-                raise HTTPException(
-                    status_code=status.HTTP_400_BAD_REQUEST,
-                    detail="Пользователь с таким email уже существует"
-                )
-            
-            # Создаем пользователя
-            user = Users(
-                email=student_data.email,
-                password_hash=get_password_hash(student_data.password),
-                role=UserRole.STUDENT
+        # Проверяем, не существует ли уже пользователь с таким email
+        existing_user = session.exec(select(Users).where(Users.email == student_data.email)).first()
+        if existing_user:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Пользователь с таким email уже существует"
             )
-            session.add(user)
-            session.commit()
-            session.refresh(user)
             
-            # Создаем студента
-            student = Students(
-                user_id=user.id,
-                full_name=student_data.full_name,
-                phone=student_data.phone,
-                date_of_birth=student_data.date_of_birth,
-                gender=student_data.gender
-            )
-            session.add(student)
-            session.commit()
-            session.refresh(student)
+        # Создаем пользователя
+        user = Users(
+            email=student_data.email,
+            password_hash=get_password_hash(student_data.password),
+            role=UserRole.STUDENT
+        )
+        session.add(user)
+        session.commit()
+        session.refresh(user)
             
-            return StudentResponse(
-                id=student.id,
-                full_name=student.full_name,
-                email=user.email,
-                phone=student.phone,
-                date_of_birth=student.date_of_birth,
-                gender=student.gender
-            )
+        # Создаем студента
+        student = Students(
+            user_id=user.id,
+            full_name=student_data.full_name,
+            phone=student_data.phone,
+            date_of_birth=student_data.date_of_birth,
+            gender=student_data.gender
+        )
+        session.add(student)
+        session.commit()
+        session.refresh(student)
+            
+        return StudentResponse(
+            id=student.id,
+            full_name=student.full_name,
+            email=user.email,
+            phone=student.phone,
+            date_of_birth=student.date_of_birth,
+            gender=student.gender
+        )
     except HTTPException as e:
         raise e
     except Exception as e:
@@ -1373,7 +1884,8 @@ def create_student(
 def update_student(
     student_id: int,
     student_data: UpdateStudentRequest,
-    current_user: Users = Depends(get_current_user)
+    current_user: Users = Depends(get_current_user),
+    session: Session = Depends(get_session)
 ):
     """Обновление информации о студенте"""
     try:
@@ -1383,65 +1895,70 @@ def update_student(
                 detail="Только администратор может обновлять информацию о студентах"
             )
         
-        with Session(engine) as session:
-            student = session.exec(select(Students).where(Students.id == student_id)).first()
-            if not student:
-                raise HTTPException(
-                    status_code=status.HTTP_404_NOT_FOUND,
-                    detail="Студент не найден"
-                )
+        student = session.exec(select(Students).where(Students.id == student_id)).first()
+        if not student:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Студент не найден"
+            )
             
-            user = session.exec(select(Users).where(Users.id == student.user_id)).first()
-            if not user:
+        user = session.exec(select(Users).where(Users.id == student.user_id)).first()
+        if not user:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Пользователь не найден"
+            )
+        old_email = user.email
+            
+        # Обновляем данные пользователя
+        if student_data.email:
+            # Проверяем, не занят ли email другим пользователем
+            existing_user = session.exec(
+                select(Users).where(
+                    and_(
+                        Users.email == student_data.email,
+                        Users.id != user.id
+                    )
+                )
+            ).first()
+            if existing_user:
                 raise HTTPException(
-                    status_code=status.HTTP_404_NOT_FOUND,
-                    detail="Пользователь не найден"
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail="Пользователь с таким email уже существует"
                 )
+            user.email = student_data.email
             
-            # Обновляем данные пользователя
-            if student_data.email:
-                # Проверяем, не занят ли email другим пользователем
-                existing_user = session.exec(
-                    select(Users).where(
-                        and_(
-                            Users.email == student_data.email,
-                            Users.id != user.id
-                        )
-                    )
-                ).first()
-                if existing_user:
-                    raise HTTPException(
-                        status_code=status.HTTP_400_BAD_REQUEST,
-                        detail="Пользователь с таким email уже существует"
-                    )
-                user.email = student_data.email
+        if student_data.password:
+            user.password_hash = get_password_hash(student_data.password)
             
-            if student_data.password:
-                user.password_hash = get_password_hash(student_data.password)
+        # Обновляем данные студента
+        if student_data.full_name:
+            student.full_name = student_data.full_name
+        if student_data.phone:
+            student.phone = student_data.phone
+        if student_data.date_of_birth:
+            student.date_of_birth = student_data.date_of_birth
+        if student_data.gender:
+            student.gender = student_data.gender
             
-            # Обновляем данные студента
-            if student_data.full_name:
-                student.full_name = student_data.full_name
-            if student_data.phone:
-                student.phone = student_data.phone
-            if student_data.date_of_birth:
-                student.date_of_birth = student_data.date_of_birth
-            if student_data.gender:
-                student.gender = student_data.gender
+        # Новая версия профиля: ранее выданные claims становятся устаревшими
+        user.updated_at = datetime.now()
             
-            session.add(user)
-            session.add(student)
-            session.commit()
-            session.refresh(student)
+        session.add(user)
+        session.add(student)
+        session.commit()
+        session.refresh(student)
+        invalidate_user_cache(old_email, user.email)
+        revoke_profile_claims(user.id, profile_version(user))
             
-            return StudentResponse(
-                id=student.id,
-                full_name=student.full_name,
-                email=user.email,
-                phone=student.phone,
-                date_of_birth=student.date_of_birth,
-                gender=student.gender
-            )
+        return StudentResponse(
+            id=student.id,
+            full_name=student.full_name,
+            email=user.email,
+            phone=student.phone,
+            date_of_birth=student.date_of_birth,
+            gender=student.gender
+        )
     except HTTPException as e:
         raise e
     except Exception as e:
@@ -1454,7 +1971,8 @@ def update_student(
 @app.delete("/students/{student_id}")
 def delete_student(
     student_id: int,
-    current_user: Users = Depends(get_current_user)
+    current_user: Users = Depends(get_current_user),
+    session: Session = Depends(get_session)
 ):
     """Удаление студента"""
     if current_user.role != UserRole.ADMIN:
@@ -1463,131 +1981,146 @@ def delete_student(
             detail="Только администратор может удалять студентов"
         )
     
-    with Session(engine) as session:
-        student = session.exec(select(Students).where(Students.id == student_id)).first()
-        if not student:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="Студент не найден"
-            )
+    student = session.exec(select(Students).where(Students.id == student_id)).first()
+    if not student:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Студент не найден"
+        )
         
-        # Получаем связанного пользователя
-        user = session.exec(select(Users).where(Users.id == student.user_id)).first()
+    # Получаем связанного пользователя
+    user = session.exec(select(Users).where(Users.id == student.user_id)).first()
+    user_email = user.email if user else None
         
-        # Удаляем все связанные записи посещаемости
-        attendance_records = session.exec(
-            select(Attendance).where(Attendance.student_id == student_id)
-        ).all()
-        for record in attendance_records:
-            session.delete(record)
+    # Освобождаем места на будущих занятиях (их получает лист ожидания)
+    released_keys = release_student_seats(session, student_id)
+
+    # Удаляем все связанные записи посещаемости
+    attendance_records = session.exec(
+        select(Attendance).where(Attendance.student_id == student_id)
+    ).all()
+    for record in attendance_records:
+        session.delete(record)
         
-        # Удаляем все связанные подписки
-        subscriptions = session.exec(
-            select(Subscriptions).where(Subscriptions.student_id == student_id)
-        ).all()
-        for subscription in subscriptions:
-            session.delete(subscription)
+    # Удаляем все связанные подписки
+    subscriptions = session.exec(
+        select(Subscriptions).where(Subscriptions.student_id == student_id)
+    ).all()
+    for subscription in subscriptions:
+        session.delete(subscription)
         
-        # Удаляем студента
-        session.delete(student)
+    # Удаляем студента
+    session.delete(student)
         
-        # Удаляем пользователя
-        if user:
-            session.delete(user)
+    # Удаляем пользователя
+    if user:
+        session.delete(user)
         
-        session.commit()
+    session.commit()
+    invalidate_user_cache(user_email)
+    revoke_profile_claims(student.user_id)
+    invalidate_schedule_cache(*released_keys)
+    admission.forget()
         
-        return {"message": "Студент успешно удален"}
+    return {"message": "Студент успешно удален"}
 
 @app.put("/attendance/{attendance_id}", response_model=AttendanceResponse)
 async def update_attendance(
     attendance_id: int,
     attendance_data: UpdateAttendanceRequest,
-    current_user: Users = Depends(get_current_user)
+    current_user: TokenIdentity = Depends(get_current_identity),
+    session: AsyncSession = Depends(get_async_session)
 ):
     """Обновление статуса посещаемости"""
-    with Session(engine) as session:
-        # Проверяем, что пользователь является администратором
-        if current_user.role != UserRole.ADMIN:
-            raise HTTPException(
-                status_code=status.HTTP_403_FORBIDDEN,
-                detail="Только администраторы могут обновлять статус посещаемости"
-            )
+    # Проверяем, что пользователь является администратором
+    if current_user.role != UserRole.ADMIN:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Только администраторы могут обновлять статус посещаемости"
+        )
 
-        # Получаем запись о посещаемости
-        attendance = session.get(Attendance, attendance_id)
-        if not attendance:
+    # Получаем запись о посещаемости вместе с датой занятия
+    row = (await session.exec(
+        select(Attendance, Classes.date)
+        .join(Classes, Classes.id == Attendance.class_id)
+        .where(Attendance.id == attendance_id)
+    )).first()
+    if not row:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Запись о посещаемости не найдена"
+        )
+    attendance, class_date = row
+
+    # Если статус меняется на "Присутствовал", списываем занятие с того же абонемента,
+    # что и перекличка: самого старого, действующего на дату занятия
+    if attendance_data.presence == "Присутствовал" and attendance.presence != "Присутствовал":
+        charged = (await session.exec(charge_statement([attendance.student_id], class_date))).all()
+        if not charged:
             raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="Запись о посещаемости не найдена"
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="У студента нет активной подписки на дату занятия или закончились занятия"
             )
 
-        # Если статус меняется на "Присутствовал", списываем занятие
-        if attendance_data.presence == "Присутствовал" and attendance.presence != "Присутствовал":
-            # Получаем активную подписку студента
-            subscription = session.exec(
-                select(Subscriptions)
-                .where(
-                    and_(
-                        Subscriptions.student_id == attendance.student_id,
-                        Subscriptions.status == SubscriptionStatus.ACTIVE,
-                        Subscriptions.remaining_classes > 0
-                    )
-                )
-            ).first()
-
-            if not subscription:
-                raise HTTPException(
-                    status_code=status.HTTP_400_BAD_REQUEST,
-                    detail="У студента нет активной подписки или закончились занятия"
-                )
-
-            # Уменьшаем количество оставшихся занятий
-            subscription.remaining_classes -= 1
-            if subscription.remaining_classes == 0:
-                subscription.status = SubscriptionStatus.EXPIRED
-
-            session.add(subscription)
-
-        # Обновляем статус
-        attendance.presence = attendance_data.presence
-        session.commit()
+    # Обновляем статус
+    attendance.presence = attendance_data.presence
+    await session.commit()
+
+    # Получаем информацию о студенте и занятии
+    loader = await session.run_sync(load_attendance_relations, [attendance])
+    student = loader.get(Students, attendance.student_id)
+    class_ = loader.get(Classes, attendance.class_id)
+    hall = loader.get(Halls, class_.hall_id)
+    teacher = loader.get(Teachers, class_.teacher_id)
+    return json_response(attendance_row(
+        attendance,
+        student.full_name,
+        class_row(class_, hall.hall_number, hall.capacity, teacher.full_name)
+    ))
+
+@app.put("/attendance/class/{class_id}")
+async def roll_call(
+    class_id: int,
+    request: RollCallRequest,
+    identity: TokenIdentity = Depends(get_current_identity),
+    session: AsyncSession = Depends(get_async_session)
+):
+    """
+    Перекличка: статусы посещаемости всех перечисленных студентов занятия в одной
+    транзакции, со списанием занятий с абонементов. Доступна администратору и
+    преподавателю этого занятия.
+    """
+    if identity.role not in (UserRole.ADMIN, UserRole.TEACHER):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Отмечать посещаемость могут только преподаватели и администраторы"
+        )
+    teacher_id = await session.run_sync(class_teacher, class_id)
+    if identity.role == UserRole.TEACHER and identity.teacher_id != teacher_id:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Можно отмечать посещаемость только на своих занятиях"
+        )
 
-        # Получаем информацию о студенте и занятии
-        student = session.get(Students, attendance.student_id)
-        class_ = session.get(Classes, attendance.class_id)
-        hall = session.get(Halls, class_.hall_id)
-        teacher = session.get(Teachers, class_.teacher_id)
-        return AttendanceResponse(
-            id=attendance.id,
-            presence=attendance.presence,
-            student_id=attendance.student_id,
-            class_id=attendance.class_id,
-            teacher_id=attendance.teacher_id,
-            student_name=student.full_name,
-            class_=ClassResponse(
-                id=class_.id,
-                time=class_.time.strftime('%H:%M:%S'),
-                type=class_.type,
-                date=class_.date,
-                current_capacity=class_.current_capacity,
-                hall_number=hall.hall_number,
-                hall_capacity=hall.capacity,
-                teacher_name=teacher.full_name,
-                specialization=teacher.specialization,
-                remaining_slots=hall.capacity - class_.current_capacity,
-                formatted_date=class_.date.strftime('%d.%m.%Y'),
-                formatted_time=class_.time.strftime('%H:%M'),
-                day_of_week=class_.date.strftime('%A'),
-                teacher_id=class_.teacher_id,
-                hall_id=class_.hall_id
-            )
+    marks = {mark.student_id: mark.presence for mark in request.marks}
+    if len(marks) != len(request.marks):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Студент указан в перекличке несколько раз"
         )
+    if not marks:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Перекличка пуста"
+        )
+
+    return await session.run_sync(apply_roll_call, class_id, marks)
 
 @app.post("/payments/create-with-subscription", response_model=PaymentAndSubscriptionResponse)
 async def create_payment_and_subscription(
     request: CreatePaymentAndSubscriptionRequest,
-    current_user: Users = Depends(get_current_user)
+    current_user: TokenIdentity = Depends(get_current_identity),
+    session: AsyncSession = Depends(get_async_session)
 ):
     """
     Создание платежа и подписки в рамках одной транзакции.
@@ -1608,108 +2141,107 @@ async def create_payment_and_subscription(
             )
 
         # Получаем информацию о студенте
-        with Session(engine) as session:
-            print(f"Поиск студента с ID {request.student_id}")
-            student = session.get(Students, request.student_id)
-            if not student:
-                print(f"Студент с ID {request.student_id} не найден")
-                raise HTTPException(
-                    status_code=status.HTTP_404_NOT_FOUND,
-                    detail={
-                        "message": "Студент не найден",
-                        "errors": ["Указанный студент не существует в системе"]
-                    }
-                )
+        print(f"Поиск студента с ID {request.student_id}")
+        student = await session.get(Students, request.student_id)
+        if not student:
+            print(f"Студент с ID {request.student_id} не найден")
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail={
+                    "message": "Студент не найден",
+                    "errors": ["Указанный студент не существует в системе"]
+                }
+            )
 
-            # Проверяем, что студент создает платеж для себя
-            if student.user_id != current_user.id:
-                print(f"Ошибка: студент {student.id} пытается создать платеж для другого студента")
-                raise HTTPException(
-                    status_code=status.HTTP_403_FORBIDDEN,
-                    detail={
-                        "message": "Доступ запрещен",
-                        "errors": ["Вы можете создавать платежи и подписки только для себя"]
-                    }
-                )
+        # Проверяем, что студент создает платеж для себя
+        if student.user_id != current_user.id:
+            print(f"Ошибка: студент {student.id} пытается создать платеж для другого студента")
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail={
+                    "message": "Доступ запрещен",
+                    "errors": ["Вы можете создавать платежи и подписки только для себя"]
+                }
+            )
 
-            try:
-                # Начинаем транзакцию
-                print("Начало транзакции...")
+        try:
+            # Начинаем транзакцию
+            print("Начало транзакции...")
                 
-                # Создаем платеж
-                print("Создание платежа...")
-                payment = Payments(
-                    student_id=request.student_id,
-                    amount=request.amount,
-                    payment_method=request.payment_method,
-                    status=PaymentStatus.COMPLETED,
-                    payment_date=datetime.now()
-                )
-                print(f"Платеж создан: {payment}")
-                session.add(payment)
-                session.flush()  # Получаем ID платежа без коммита транзакции
-                print(f"Платеж сохранен с ID: {payment.id}")
-
-                # Создаем подписку
-                print("Создание подписки...")
-                subscription = Subscriptions(
-                    student_id=request.student_id,
-                    payment_id=payment.id,
-                    status=SubscriptionStatus.ACTIVE,
-                    start_date=request.start_date,
-                    end_date=request.start_date + relativedelta(months=1),
-                    number_of_classes=request.number_of_classes,
-                    remaining_classes=request.number_of_classes,
-                    created_at=datetime.now(),
-                    updated_at=datetime.now()
-                )
-                print(f"Подписка создана с number_of_classes={request.number_of_classes}")
-                session.add(subscription)
-                session.flush()  # Получаем ID подписки без коммита транзакции
-                session.refresh(subscription)  # Обновляем объект, чтобы получить все поля
-                print(f"Подписка сохранена с ID: {subscription.id}, number_of_classes: {subscription.number_of_classes}")
-
-                # Подтверждаем транзакцию
-                session.commit()
-                print("Транзакция успешно завершена")
-
-                # Обновляем объекты после коммита
-                session.refresh(payment)
-                session.refresh(subscription)
-
-                return PaymentAndSubscriptionResponse(
-                    payment=Payments(
-                        id=payment.id,
-                        student_id=payment.student_id,
-                        amount=payment.amount,
-                        payment_date=payment.payment_date,
-                        payment_method=payment.payment_method,
-                        status=payment.status
-                    ),
-                    subscription=Subscriptions(
-                        id=subscription.id,
-                        start_date=subscription.start_date,
-                        end_date=subscription.end_date,
-                        number_of_classes=subscription.number_of_classes,
-                        remaining_classes=subscription.remaining_classes,
-                        status=subscription.status,
-                        student_id=subscription.student_id,
-                        payment_id=subscription.payment_id,
-                        created_at=subscription.created_at,
-                        updated_at=subscription.updated_at
-                    )
+            # Создаем платеж
+            print("Создание платежа...")
+            payment = Payments(
+                student_id=request.student_id,
+                amount=request.amount,
+                payment_method=request.payment_method,
+                status=PaymentStatus.COMPLETED,
+                payment_date=datetime.now()
+            )
+            print(f"Платеж создан: {payment}")
+            session.add(payment)
+            await session.flush()  # Получаем ID платежа без коммита транзакции
+            print(f"Платеж сохранен с ID: {payment.id}")
+
+            # Создаем подписку
+            print("Создание подписки...")
+            subscription = Subscriptions(
+                student_id=request.student_id,
+                payment_id=payment.id,
+                status=SubscriptionStatus.ACTIVE,
+                start_date=request.start_date,
+                end_date=request.start_date + relativedelta(months=1),
+                number_of_classes=request.number_of_classes,
+                remaining_classes=request.number_of_classes,
+                created_at=datetime.now(),
+                updated_at=datetime.now()
+            )
+            print(f"Подписка создана с number_of_classes={request.number_of_classes}")
+            session.add(subscription)
+            await session.flush()  # Получаем ID подписки без коммита транзакции
+            await session.refresh(subscription)  # Обновляем объект, чтобы получить все поля
+            print(f"Подписка сохранена с ID: {subscription.id}, number_of_classes: {subscription.number_of_classes}")
+
+            # Подтверждаем транзакцию
+            await session.commit()
+            print("Транзакция успешно завершена")
+
+            # Обновляем объекты после коммита
+            await session.refresh(payment)
+            await session.refresh(subscription)
+
+            return PaymentAndSubscriptionResponse(
+                payment=Payments(
+                    id=payment.id,
+                    student_id=payment.student_id,
+                    amount=payment.amount,
+                    payment_date=payment.payment_date,
+                    payment_method=payment.payment_method,
+                    status=payment.status
+                ),
+                subscription=Subscriptions(
+                    id=subscription.id,
+                    start_date=subscription.start_date,
+                    end_date=subscription.end_date,
+                    number_of_classes=subscription.number_of_classes,
+                    remaining_classes=subscription.remaining_classes,
+                    status=subscription.status,
+                    student_id=subscription.student_id,
+                    payment_id=subscription.payment_id,
+                    created_at=subscription.created_at,
+                    updated_at=subscription.updated_at
                 )
+            )
 
-            except Exception as e:
-                print(f"Ошибка при создании платежа и подписки: {str(e)}")
-                session.rollback()
-                raise HTTPException(
-                    status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                    detail={
-                        "message": "Ошибка при создании платежа и подписки",
-                        "errors": [f"Произошла ошибка: {str(e)}"]
-                    }
-                )
+        except Exception as e:
+            print(f"Ошибка при создании платежа и подписки: {str(e)}")
+            await session.rollback()
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail={
+                    "message": "Ошибка при создании платежа и подписки",
+                    "errors": [f"Произошла ошибка: {str(e)}"]
+                }
+            )
 
     except ValidationError as e:
         print(f"Ошибка валидации: {str(e)}")
@@ -1736,55 +2268,117 @@ async def create_payment_and_subscription(
 @app.get("/teachers/{teacher_id}/schedule", response_model=List[ClassResponse])
 async def get_teacher_schedule_endpoint(
     teacher_id: int,
-    current_user: Users = Depends(get_current_user)
+    identity: TokenIdentity = Depends(get_current_identity),
+    session: AsyncSession = Depends(get_async_session)
 ):
     """Получение расписания конкретного преподавателя"""
     try:
-        with Session(engine) as session:
-            # Проверяем, что пользователь имеет доступ к этому расписанию
-            if current_user.role != UserRole.ADMIN:
-                # Для преподавателей проверяем, что это их собственное расписание
-                teacher = session.exec(
-                    select(Teachers)
-                    .where(Teachers.user_id == current_user.id)
-                ).first()
-                if not teacher or teacher.id != teacher_id:
-                    raise HTTPException(
-                        status_code=status.HTTP_403_FORBIDDEN,
-                        detail="Нет доступа к этому расписанию"
-                    )
+        # Проверяем, что пользователь имеет доступ к этому расписанию
+        if identity.role != UserRole.ADMIN:
+            # Для преподавателей проверяем, что это их собственное расписание
+            if identity.teacher_id != teacher_id:
+                raise HTTPException(
+                    status_code=status.HTTP_403_FORBIDDEN,
+                    detail="Нет доступа к этому расписанию"
+                )
 
-            # Получаем все занятия преподавателя
-            classes = session.exec(
-                select(Classes)
-                .where(Classes.teacher_id == teacher_id)
-                .order_by(Classes.date, Classes.time)
-            ).all()
-
-            # Формируем ответ
-            schedule = []
-            for class_item in classes:
-                hall = session.get(Halls, class_item.hall_id)
-                teacher = session.get(Teachers, class_item.teacher_id)
+        # Получаем все занятия преподавателя
+        classes = (await session.exec(
+            select(Classes)
+            .where(Classes.teacher_id == teacher_id)
+            .order_by(Classes.date, Classes.time)
+        )).all()
+
+        # Залы и преподаватель — по одному запросу на тип
+        loader = await session.run_sync(load_class_relations, classes)
+
+        # Формируем ответ
+        schedule = []
+        for class_item in classes:
+            hall = loader.get(Halls, class_item.hall_id)
+            teacher = loader.get(Teachers, class_item.teacher_id)
                 
-                schedule.append({
-                    "id": class_item.id,
-                    "type": class_item.type,
-                    "time": class_item.time.strftime("%H:%M"),
-                    "date": class_item.date,
-                    "hall_number": hall.hall_number if hall else None,
-                    "hall_capacity": hall.capacity if hall else 0,
-                    "current_capacity": class_item.current_capacity,
-                    "teacher_name": teacher.full_name if teacher else None,
-                    "formatted_date": class_item.date.strftime("%d.%m.%Y"),
-                    "formatted_time": class_item.time.strftime("%H:%M"),
-                    "teacher_id": class_item.teacher_id,
-                    "hall_id": class_item.hall_id
-                })
-
-            return schedule
+            schedule.append({
+                "id": class_item.id,
+                "type": class_item.type,
+                "time": class_item.time.strftime("%H:%M"),
+                "date": class_item.date,
+                "hall_number": hall.hall_number if hall else None,
+                "hall_capacity": hall.capacity if hall else 0,
+                "current_capacity": class_item.current_capacity,
+                "teacher_name": teacher.full_name if teacher else None,
+                "formatted_date": class_item.date.strftime("%d.%m.%Y"),
+                "formatted_time": class_item.time.strftime("%H:%M"),
+                "teacher_id": class_item.teacher_id,
+                "hall_id": class_item.hall_id
+            })
+
+        return schedule
+    except HTTPException as e:
+        raise e
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Ошибка при получении расписания: {str(e)}"
-        )
\ No newline at end of file
+        )
+
+# Эндпоинты мониторинга
+@app.get("/admin/metrics")
+def get_metrics(current_user: Users = Depends(get_current_user)):
+    """Счетчики кэшей и пулов (только для администратора)"""
+    if current_user.role != UserRole.ADMIN:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Только для администраторов"
+        )
+
+    return {
+        "user_cache": user_cache.stats(),
+        "schedule_cache": schedule_cache.stats(),
+        "conditional_get": conditional_stats.stats(),
+        "auth_executor": auth_executor.stats(),
+        "hall_capacities": hall_capacities.stats(),
+        "schedule_index": schedule_index.stats(),
+        "enrollment_admission": admission.stats(),
+        "cohort_cache": cohort_cache.stats(),
+        "db": get_engine_stats(),
+        "db_async": get_engine_stats(get_async_engine().sync_engine)
+    }
+
+@app.get("/admin/attendance/statistics")
+def get_attendance_statistics_endpoint(
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    dance_type: Optional[str] = None,
+    teacher_id: Optional[int] = None,
+    current_user: Users = Depends(get_current_user),
+    session: Session = Depends(get_session)
+):
+    """Статистика посещаемости по типам занятий, преподавателям и датам (только для администратора)"""
+    if current_user.role != UserRole.ADMIN:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Только для администраторов"
+        )
+
+    return get_attendance_statistics(date_from, date_to, dance_type, teacher_id, session=session)
+
+@app.get("/admin/analytics/cohorts")
+def get_cohort_analytics(
+    months: int = Query(12, ge=1, le=COHORT_MAX_MONTHS),
+    current_user: Users = Depends(get_current_user),
+    session: Session = Depends(get_session)
+):
+    """Удержание когорт по месяцу первой покупки абонемента, отток, удержание по типу занятий
+    и использование абонементов за последние months месяцев (только для администратора)"""
+    if current_user.role != UserRole.ADMIN:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Только для администраторов"
+        )
+    cache_key = (months, date.today())
+    report = cohort_cache.get(cache_key)
+    if report is None:
+        report = cohort_report(session, months)
+        cohort_cache.set(cache_key, report)
+    return report
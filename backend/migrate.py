@@ -0,0 +1,570 @@
+# Версионированные миграции схемы БД и проверки индексов
+#
+# Запуск:
+#   python backend/migrate.py upgrade   — применить недостающие миграции
+#   python backend/migrate.py status    — список примененных и ожидающих миграций
+#   python backend/migrate.py check     — сверка таблиц, колонок и индексов моделей ll1.py с БД
+#   python backend/migrate.py check-upgrade — обновление БД с базовой схемой (во временной SQLite) до моделей
+#   python backend/migrate.py explain   — EXPLAIN горячих запросов main.py/requests.py: используется ли индекс
+#
+# Миграции не читают схему из текущих моделей ll1.py: 0001 создает базовую схему
+# (таблицы и индексы, какими они были до появления миграций, см. baseline_metadata),
+# 0003 — фиксированный набор индексов, а каждая следующая миграция добавляет только
+# свои колонки, таблицы (описаны здесь же как Table) и индексы. Триггеры (0002, 0007)
+# удаляются и создаются заново целиком, поэтому изменение триггера — это новая
+# миграция, которая снова выполняет этот шаг. Так БД любого возраста проходит одну и ту же цепочку,
+# а после upgrade совпадает с моделями (python backend/migrate.py check).
+# Миграции идемпотентны: объекты создаются с checkfirst / IF NOT EXISTS, поэтому
+# повторный прогон по БД, созданной из моделей или Script_dance_studio.sql, безопасен.
+# Изменяя модели, добавьте миграцию сюда и те же изменения в Script_dance_studio.sql.
+import sys
+from datetime import date, datetime, timedelta
+from typing import Callable, List, Tuple
+
+from sqlalchemy import (
+    Column, Date, DateTime, Enum, Float, ForeignKey, Integer, MetaData, String, Table, Time, and_,
+    inspect, select, text
+)
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import ClauseElement, Executable
+
+from ll1 import (
+    SQLModel, engine, Users, Students, Teachers, Subscriptions, Classes, Halls, Attendance, SubscriptionStatus,
+    CLASS_CAPACITY_TRIGGERS_POSTGRESQL, CLASS_CAPACITY_TRIGGERS_SQLITE,
+    ATTENDANCE_DAILY_TRIGGERS_POSTGRESQL, ATTENDANCE_DAILY_TRIGGERS_SQLITE
+)
+from attendance_rollup import rebuild as rebuild_attendance_daily
+from enrollment import seat_conditions
+from waitlist import queue_heads
+
+
+migrations_metadata = MetaData()
+schema_migrations = Table(
+    "schema_migrations", migrations_metadata,
+    Column("version", String(10), primary_key=True),
+    Column("name", String(200), nullable=False),
+    Column("applied_at", DateTime, nullable=False)
+)
+
+
+# Базовая схема (миграция 0001) — таблицы моделей ll1.py до появления миграций.
+# Не меняется вместе с моделями: новые колонки добавляют следующие миграции
+baseline_metadata = MetaData()
+
+
+def _timestamps() -> List[Column]:
+    return [Column("created_at", DateTime, nullable=False), Column("updated_at", DateTime, nullable=False)]
+
+
+Table(
+    "users", baseline_metadata,
+    Column("id", Integer, primary_key=True),
+    Column("email", String, nullable=False, unique=True),
+    Column("password_hash", String, nullable=False),
+    Column("role", Enum("STUDENT", "TEACHER", "ADMIN", name="userrole"), nullable=False),
+    *_timestamps()
+)
+Table(
+    "halls", baseline_metadata,
+    Column("id", Integer, primary_key=True),
+    Column("hall_number", Integer, nullable=False, unique=True),
+    Column("capacity", Integer, nullable=False),
+    Column("description", String(200), nullable=False),
+    *_timestamps()
+)
+Table(
+    "admins", baseline_metadata,
+    Column("id", Integer, primary_key=True),
+    Column("user_id", Integer, ForeignKey("users.id"), nullable=False),
+    Column("full_name", String(50), nullable=False),
+    *_timestamps()
+)
+Table(
+    "students", baseline_metadata,
+    Column("id", Integer, primary_key=True),
+    Column("user_id", Integer, ForeignKey("users.id"), nullable=False),
+    Column("full_name", String(50), nullable=False),
+    Column("date_of_birth", Date, nullable=False),
+    Column("gender", Enum("MALE", "FEMALE", name="gender"), nullable=False),
+    Column("phone", String(12), nullable=False),
+    *_timestamps()
+)
+Table(
+    "teachers", baseline_metadata,
+    Column("id", Integer, primary_key=True),
+    Column("user_id", Integer, ForeignKey("users.id"), nullable=False),
+    Column("full_name", String(50), nullable=False),
+    Column("experience", Integer, nullable=False),
+    Column("specialization", String(20), nullable=False),
+    Column("phone", String(12), nullable=False),
+    *_timestamps()
+)
+Table(
+    "classes", baseline_metadata,
+    Column("id", Integer, primary_key=True),
+    Column("time", Time, nullable=False),
+    Column("type", String(18), nullable=False),
+    Column("hall_id", Integer, ForeignKey("halls.id")),
+    Column("teacher_id", Integer, ForeignKey("teachers.id"), nullable=False),
+    Column("date", Date, nullable=False),
+    Column("current_capacity", Integer, nullable=False),
+    *_timestamps()
+)
+Table(
+    "payments", baseline_metadata,
+    Column("id", Integer, primary_key=True),
+    Column("student_id", Integer, ForeignKey("students.id"), nullable=False),
+    Column("amount", Float, nullable=False),
+    Column("payment_date", DateTime, nullable=False),
+    Column("payment_method", Enum("CARD", "CASH", "BANK_TRANSFER", name="paymentmethod"), nullable=False),
+    Column("status", Enum("COMPLETED", "PENDING", "FAILED", name="paymentstatus"), nullable=False)
+)
+Table(
+    "attendance", baseline_metadata,
+    Column("id", Integer, primary_key=True),
+    Column("presence", Enum("REGISTERED", "PRESENT", name="attendancestatus"), nullable=False),
+    Column("student_id", Integer, ForeignKey("students.id")),
+    Column("class_id", Integer, ForeignKey("classes.id")),
+    Column("teacher_id", Integer, ForeignKey("teachers.id")),
+    *_timestamps()
+)
+Table(
+    "subscriptions", baseline_metadata,
+    Column("id", Integer, primary_key=True),
+    Column("start_date", Date, nullable=False),
+    Column("end_date", Date, nullable=False),
+    Column("number_of_classes", Integer, nullable=False),
+    Column("remaining_classes", Integer, nullable=False),
+    Column("status", Enum("ACTIVE", "EXPIRED", name="subscriptionstatus"), nullable=False),
+    Column("student_id", Integer, ForeignKey("students.id"), nullable=False),
+    Column("payment_id", Integer, ForeignKey("payments.id"), nullable=False),
+    *_timestamps()
+)
+
+BASELINE_TABLES = list(baseline_metadata.sorted_tables)
+
+# Таблицы следующих миграций — в том виде, в каком их создает миграция. В той же
+# MetaData, чтобы внешние ключи ссылались на таблицы базовой схемы; create_all базовой
+# миграции их не создает (BASELINE_TABLES)
+class_series_table = Table(
+    "class_series", baseline_metadata,
+    Column("id", Integer, primary_key=True),
+    Column("type", String(18), nullable=False),
+    Column("hall_id", Integer, ForeignKey("halls.id", ondelete="SET NULL")),
+    Column("teacher_id", Integer, ForeignKey("teachers.id"), nullable=False),
+    Column("time", Time, nullable=False),
+    Column("duration_minutes", Integer, nullable=False),
+    Column("weekdays", String(13), nullable=False),
+    Column("start_date", Date, nullable=False),
+    Column("end_date", Date, nullable=False),
+    *_timestamps()
+)
+waitlist_table = Table(
+    "waitlist", baseline_metadata,
+    Column("id", Integer, primary_key=True),
+    Column("class_id", Integer, ForeignKey("classes.id", ondelete="CASCADE"), nullable=False),
+    Column("student_id", Integer, ForeignKey("students.id", ondelete="CASCADE"), nullable=False),
+    Column("created_at", DateTime, nullable=False)
+)
+attendance_daily_table = Table(
+    "attendance_daily", baseline_metadata,
+    Column("date", Date, primary_key=True),
+    Column("type", String(18), primary_key=True),
+    Column("teacher_id", Integer, primary_key=True, autoincrement=False),
+    Column("hall_id", Integer, primary_key=True, autoincrement=False),
+    Column("registered", Integer, nullable=False),
+    Column("present", Integer, nullable=False)
+)
+
+# Индексы базовой схемы (как в Script_dance_studio.sql до миграций): (имя, таблица, колонки)
+BASELINE_INDEXES = [
+    ("idx_users_email", "users", ("email",)),
+    ("idx_users_role", "users", ("role",)),
+    ("idx_students_user_id", "students", ("user_id",)),
+    ("idx_payments_students_id", "payments", ("student_id",)),
+    ("idx_teachers_user_id", "teachers", ("user_id",)),
+    ("idx_classes_date", "classes", ("date",)),
+    ("idx_subscriptions_status", "subscriptions", ("status",)),
+    ("idx_attendance_student_id", "attendance", ("student_id",)),
+    ("idx_attendance_class_id", "attendance", ("class_id",)),
+    ("idx_admins_user_id", "admins", ("user_id",)),
+]
+
+# Индексы миграции 0003: (имя, таблица, колонки, уникальный)
+HOT_PATH_INDEXES = [
+    ("idx_subscriptions_student_status", "subscriptions", ("student_id", "status"), False),
+    ("idx_classes_date_time", "classes", ("date", "time", "id"), False),
+    ("idx_classes_teacher_date_time", "classes", ("teacher_id", "date", "time"), False),
+    ("idx_classes_hall_date_time", "classes", ("hall_id", "date", "time"), False),
+    ("uq_attendance_student_class", "attendance", ("student_id", "class_id"), True),
+    ("idx_attendance_student_id_id", "attendance", ("student_id", "id"), False),
+]
+
+
+def create_index(connection, name: str, table: str, columns, unique: bool = False):
+    """CREATE INDEX IF NOT EXISTS по фиксированному описанию, а не по модели"""
+    unique_sql = "UNIQUE " if unique else ""
+    connection.execute(text(
+        f"CREATE {unique_sql}INDEX IF NOT EXISTS {name} ON {table} ({', '.join(columns)})"
+    ))
+
+
+class Migration:
+    """Шаг миграции: версия, описание и функция upgrade(connection)"""
+
+    def __init__(self, version: str, name: str, upgrade: Callable):
+        self.version = version
+        self.name = name
+        self.upgrade = upgrade
+
+
+def baseline(connection):
+    """Таблицы и индексы базовой схемы (существующие таблицы не трогаются)"""
+    baseline_metadata.create_all(connection, tables=BASELINE_TABLES)
+    for name, table, columns in BASELINE_INDEXES:
+        create_index(connection, name, table, columns)
+
+
+def capacity_triggers(connection):
+    """Триггеры check_class_capacity/check_hall_capacity для БД, созданных до их появления"""
+    dialect = connection.dialect.name
+    if dialect == "postgresql":
+        connection.execute(text("DROP TRIGGER IF EXISTS check_class_capacity ON classes"))
+        connection.execute(text("DROP TRIGGER IF EXISTS check_hall_capacity ON halls"))
+        statements = CLASS_CAPACITY_TRIGGERS_POSTGRESQL
+    elif dialect == "sqlite":
+        for name in ("check_class_capacity_insert", "check_class_capacity_update", "check_hall_capacity_update"):
+            connection.execute(text(f"DROP TRIGGER IF EXISTS {name}"))
+        statements = CLASS_CAPACITY_TRIGGERS_SQLITE
+    else:
+        print(f"Триггеры вместимости не поддерживаются для {dialect}, пропуск")
+        return
+    for statement in statements:
+        connection.execute(text(statement))
+
+
+def hot_path_indexes(connection):
+    """Составные индексы для расписания, конфликтов, записи на занятия и подписок"""
+    duplicates = connection.execute(text(
+        "SELECT student_id, class_id, COUNT(*) FROM attendance "
+        "WHERE student_id IS NOT NULL AND class_id IS NOT NULL "
+        "GROUP BY student_id, class_id HAVING COUNT(*) > 1"
+    )).all()
+    if duplicates:
+        raise RuntimeError(
+            "В attendance есть повторные записи студента на занятие (student_id, class_id, count): "
+            f"{[tuple(row) for row in duplicates[:20]]}. Удалите лишние записи и повторите миграцию"
+        )
+
+    for name, table, columns, unique in HOT_PATH_INDEXES:
+        create_index(connection, name, table, columns, unique)
+
+    # Индексы, которые покрываются новыми составными (и уникальностью users.email)
+    for name in ("idx_classes_date", "idx_attendance_student_id", "idx_users_email"):
+        connection.execute(text(f"DROP INDEX IF EXISTS {name}"))
+
+
+def class_duration(connection):
+    """Колонка classes.duration_minutes для поиска пересечений занятий (по умолчанию 60 минут)"""
+    columns = {column["name"] for column in inspect(connection).get_columns("classes")}
+    if "duration_minutes" in columns:
+        return
+    connection.execute(text(
+        "ALTER TABLE classes ADD COLUMN duration_minutes INTEGER NOT NULL DEFAULT 60 "
+        "CHECK (duration_minutes > 0 AND duration_minutes <= 720)"
+    ))
+
+
+def class_series(connection):
+    """Таблица class_series и ссылка classes.series_id на серию"""
+    class_series_table.create(connection, checkfirst=True)
+    create_index(connection, "idx_class_series_teacher_id", "class_series", ("teacher_id",))
+    columns = {column["name"] for column in inspect(connection).get_columns("classes")}
+    if "series_id" not in columns:
+        connection.execute(text(
+            "ALTER TABLE classes ADD COLUMN series_id INTEGER REFERENCES class_series(id) ON DELETE SET NULL"
+        ))
+    create_index(connection, "idx_classes_series_date", "classes", ("series_id", "date"))
+
+
+def waitlist(connection):
+    """Таблица листа ожидания на занятия"""
+    waitlist_table.create(connection, checkfirst=True)
+    create_index(connection, "idx_waitlist_class_id", "waitlist", ("class_id", "id"))
+    create_index(connection, "uq_waitlist_class_student", "waitlist", ("class_id", "student_id"), unique=True)
+    create_index(connection, "idx_waitlist_student_id", "waitlist", ("student_id",))
+
+
+def attendance_daily(connection):
+    """Сводная посещаемость по дням: таблица, триггеры на attendance и classes, заполнение"""
+    attendance_daily_table.create(connection, checkfirst=True)
+    dialect = connection.dialect.name
+    if dialect == "postgresql":
+        connection.execute(text("DROP TRIGGER IF EXISTS attendance_daily_on_attendance ON attendance"))
+        connection.execute(text("DROP TRIGGER IF EXISTS attendance_daily_on_class ON classes"))
+        statements = ATTENDANCE_DAILY_TRIGGERS_POSTGRESQL
+    elif dialect == "sqlite":
+        for name in ("attendance_daily_insert", "attendance_daily_delete", "attendance_daily_update",
+                     "attendance_daily_class_update"):
+            connection.execute(text(f"DROP TRIGGER IF EXISTS {name}"))
+        statements = ATTENDANCE_DAILY_TRIGGERS_SQLITE
+    else:
+        print(f"Триггеры attendance_daily не поддерживаются для {dialect}, пропуск")
+        statements = []
+    for statement in statements:
+        connection.execute(text(statement))
+    print(f"attendance_daily заполнена: {rebuild_attendance_daily(connection)} строк")
+
+
+def student_attendance_index(connection):
+    """
+    Индекс attendance(student_id, id) для страниц истории студента. Он же есть в 0003 для
+    новых БД; здесь — для БД, где 0003 уже применена без него
+    """
+    create_index(connection, "idx_attendance_student_id_id", "attendance", ("student_id", "id"))
+
+
+MIGRATIONS: List[Migration] = [
+    Migration("0001", "Базовая схема", baseline),
+    Migration("0002", "Триггеры вместимости занятий и залов", capacity_triggers),
+    Migration("0003", "Индексы горячих запросов", hot_path_indexes),
+    Migration("0004", "Длительность занятий", class_duration),
+    Migration("0005", "Серии повторяющихся занятий", class_series),
+    Migration("0006", "Лист ожидания", waitlist),
+    Migration("0007", "Сводная посещаемость по дням", attendance_daily),
+    Migration("0008", "Индекс истории посещаемости студента", student_attendance_index),
+]
+
+
+def applied_versions(connection) -> set:
+    """Версии примененных миграций (пусто, если таблицы schema_migrations еще нет)"""
+    if not inspect(connection).has_table(schema_migrations.name):
+        return set()
+    return set(connection.execute(select(schema_migrations.c.version)).scalars())
+
+
+def pending_migrations(db_engine=None) -> List[Migration]:
+    """Миграции, которые еще не применены к БД"""
+    with (db_engine or engine).connect() as connection:
+        applied = applied_versions(connection)
+    return [migration for migration in MIGRATIONS if migration.version not in applied]
+
+
+def upgrade(db_engine=None) -> List[str]:
+    """Применение недостающих миграций по порядку, каждая — в своей транзакции"""
+    db_engine = db_engine or engine
+    with db_engine.begin() as connection:
+        schema_migrations.create(connection, checkfirst=True)
+    applied_now = []
+    for migration in pending_migrations(db_engine):
+        print(f"Миграция {migration.version}: {migration.name}")
+        with db_engine.begin() as connection:
+            migration.upgrade(connection)
+            connection.execute(schema_migrations.insert().values(
+                version=migration.version, name=migration.name, applied_at=datetime.now()
+            ))
+        applied_now.append(migration.version)
+    if not applied_now:
+        print("Схема БД актуальна")
+    return applied_now
+
+
+def check_models(db_engine=None) -> List[str]:
+    """Расхождения моделей ll1.py и БД: отсутствующие таблицы, колонки и индексы"""
+    inspector = inspect(db_engine or engine)
+    tables = set(inspector.get_table_names())
+    problems = []
+    for table in SQLModel.metadata.sorted_tables:
+        if table.name not in tables:
+            problems.append(f"нет таблицы {table.name}")
+            continue
+        columns = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in columns:
+                problems.append(f"нет колонки {table.name}.{column.name}")
+        indexes = {index["name"]: index for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            existing = indexes.get(index.name)
+            if existing is None:
+                problems.append(f"нет индекса {index.name} на {table.name}")
+            elif list(existing["column_names"]) != [column.name for column in index.columns]:
+                problems.append(f"индекс {index.name} на {table.name}: колонки {existing['column_names']}")
+            elif bool(existing.get("unique")) != bool(index.unique):
+                problems.append(f"индекс {index.name} на {table.name}: уникальность отличается от модели")
+    return problems
+
+
+def check_upgrade_from_baseline() -> List[str]:
+    """
+    Обновление БД, созданной до миграций: базовая схема с данными во временной SQLite,
+    затем upgrade() и сверка с моделями. Возвращает расхождения (пусто — все в порядке)
+    """
+    import os
+    import tempfile
+
+    from sqlalchemy import create_engine
+
+    with tempfile.TemporaryDirectory() as directory:
+        db_engine = create_engine(f"sqlite:///{os.path.join(directory, 'baseline.db')}")
+        now = datetime.now()
+        stamps = {"created_at": now, "updated_at": now}
+        tables = baseline_metadata.tables
+        with db_engine.begin() as connection:
+            baseline_metadata.create_all(connection)
+            connection.execute(tables["users"].insert(), [
+                {"id": 1, "email": "teacher@example.local", "password_hash": "-", "role": "TEACHER", **stamps},
+                {"id": 2, "email": "student@example.local", "password_hash": "-", "role": "STUDENT", **stamps},
+            ])
+            connection.execute(tables["teachers"].insert().values(
+                id=1, user_id=1, full_name="Преподаватель", experience=1, specialization="Jazz",
+                phone="+70000000000", **stamps
+            ))
+            connection.execute(tables["students"].insert().values(
+                id=1, user_id=2, full_name="Студент", date_of_birth=date(2000, 1, 1), gender="FEMALE",
+                phone="+70000000000", **stamps
+            ))
+            connection.execute(tables["halls"].insert().values(
+                id=1, hall_number=1, capacity=10, description="", **stamps
+            ))
+            connection.execute(tables["classes"].insert().values(
+                id=1, time=datetime.min.time(), type="Jazz", hall_id=1, teacher_id=1, date=date.today(),
+                current_capacity=1, **stamps
+            ))
+            connection.execute(tables["attendance"].insert().values(
+                id=1, presence="REGISTERED", student_id=1, class_id=1, teacher_id=1, **stamps
+            ))
+        try:
+            upgrade(db_engine)
+            problems = check_models(db_engine)
+            with db_engine.connect() as connection:
+                registered = connection.execute(text("SELECT SUM(registered) FROM attendance_daily")).scalar()
+            if registered != 1:
+                problems.append(f"attendance_daily после миграции: registered={registered}, ожидалось 1")
+        finally:
+            db_engine.dispose()
+    return problems
+
+
+class Explain(Executable, ClauseElement):
+    """EXPLAIN для запроса SQLAlchemy (параметры передаются как обычно)"""
+    inherit_cache = False
+
+    def __init__(self, statement):
+        self.statement = statement
+
+
+@compiles(Explain)
+def _compile_explain(element, compiler, **kw):
+    prefix = "EXPLAIN QUERY PLAN " if compiler.dialect.name == "sqlite" else "EXPLAIN "
+    return prefix + compiler.process(element.statement, **kw)
+
+
+def hot_queries() -> List[Tuple[str, str, object]]:
+    """Горячие запросы main.py и requests.py: (где используется, таблица, запрос)"""
+    today = date.today()
+    schedule = (
+        select(Classes, Halls.hall_number, Halls.capacity, Teachers.full_name)
+        .join(Halls, Classes.hall_id == Halls.id)
+        .join(Teachers, Classes.teacher_id == Teachers.id)
+    )
+    return [
+        ("main.get_classes", "classes",
+         schedule.where(Classes.date >= today, Classes.date <= today + timedelta(days=14))
+         .order_by(Classes.date, Classes.time, Classes.id)),
+        ("main.get_classes (teacher_id)", "classes",
+         schedule.where(Classes.date >= today, Classes.date <= today + timedelta(days=14),
+                        Classes.teacher_id == 1)),
+        ("series.series_classes", "classes",
+         select(Classes.id, Classes.date).where(Classes.series_id == 1, Classes.date >= today).order_by(Classes.date)),
+        ("main.get_teacher_schedule_endpoint", "classes",
+         select(Classes).where(Classes.teacher_id == 1).order_by(Classes.date, Classes.time)),
+        ("main.delete_teacher: будущие занятия", "classes",
+         select(Classes).where(Classes.teacher_id == 1).where(Classes.date >= today)),
+        # Условия UPDATE из enrollment.take_seat_statement (EXPLAIN для того же WHERE в SELECT)
+        ("enrollment.seat_conditions: абонемент", "subscriptions",
+         select(Classes.id).where(*seat_conditions(1, 1))),
+        ("enrollment.seat_conditions: повторная запись", "attendance",
+         select(Classes.id).where(*seat_conditions(1, 1))),
+        ("waitlist.queue_heads", "waitlist", queue_heads([1, 2])),
+        ("main.get_class_attendance_endpoint", "attendance",
+         select(Attendance).join(Students, Attendance.student_id == Students.id).where(Attendance.class_id == 1)),
+        ("main.get_student_attendance_endpoint", "attendance",
+         select(Attendance).where(Attendance.student_id == 1).order_by(Attendance.id).limit(51)),
+        ("main.get_current_user", "users",
+         select(Users).where(Users.email == "student1@example.local")),
+        ("main.profile_statement (студент)", "students",
+         select(Students).where(Students.user_id == 1)),
+        ("main.profile_statement (преподаватель)", "teachers",
+         select(Teachers).where(Teachers.user_id == 1)),
+        ("main.get_students (страница)", "students",
+         select(Students, Users.email).join(Users, Students.user_id == Users.id)
+         .where(Students.id > 100).order_by(Students.id).limit(51)),
+        ("requests.get_active_subscriptions", "subscriptions",
+         select(Subscriptions).where(and_(
+             Subscriptions.student_id == 1,
+             Subscriptions.end_date >= today,
+             Subscriptions.status == SubscriptionStatus.ACTIVE,
+             Subscriptions.remaining_classes > 0
+         ))),
+    ]
+
+
+def uses_index(dialect: str, table: str, plan: List[str]) -> bool:
+    """Доступ к таблице идет по индексу, а не полным просмотром"""
+    if dialect == "sqlite":
+        # SEARCH <таблица> USING ... INDEX — поиск по индексу; SCAN <таблица> — полный просмотр
+        lines = [line for line in plan if line.split(" ")[1:2] == [table]]
+        return bool(lines) and all(line.startswith("SEARCH") for line in lines)
+    return f"Seq Scan on {table}" not in "\n".join(plan) and table in "\n".join(plan)
+
+
+def explain_hot_queries(db_engine=None) -> List[Tuple[str, bool, List[str]]]:
+    """Планы горячих запросов; для PostgreSQL seq scan отключается, чтобы на маленькой
+    БД план показывал, есть ли вообще подходящий индекс"""
+    db_engine = db_engine or engine
+    results = []
+    with db_engine.connect() as connection:
+        dialect = connection.dialect.name
+        if dialect == "postgresql":
+            connection.execute(text("SET enable_seqscan = off"))
+        for name, table, statement in hot_queries():
+            rows = connection.execute(Explain(statement)).all()
+            plan = [row[-1] for row in rows]
+            results.append((name, uses_index(dialect, table, plan), plan))
+        connection.rollback()
+    return results
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else "upgrade"
+    if command == "upgrade":
+        upgrade()
+    elif command == "status":
+        pending = {migration.version for migration in pending_migrations()}
+        for migration in MIGRATIONS:
+            mark = "ожидает" if migration.version in pending else "применена"
+            print(f"{migration.version} [{mark}] {migration.name}")
+    elif command == "check":
+        problems = check_models()
+        for problem in problems:
+            print(f"- {problem}")
+        print("Модели и БД совпадают" if not problems else f"Расхождений: {len(problems)}")
+        sys.exit(1 if problems else 0)
+    elif command == "check-upgrade":
+        problems = check_upgrade_from_baseline()
+        for problem in problems:
+            print(f"- {problem}")
+        print("БД с базовой схемой обновляется до моделей" if not problems else f"Расхождений: {len(problems)}")
+        sys.exit(1 if problems else 0)
+    elif command == "explain":
+        failed = 0
+        for name, ok, plan in explain_hot_queries():
+            print(f"[{'индекс' if ok else 'ПОЛНЫЙ ПРОСМОТР'}] {name}")
+            for line in plan:
+                print(f"    {line}")
+            failed += not ok
+        print("Все горячие запросы используют индексы" if not failed else f"Без индекса: {failed}")
+        sys.exit(1 if failed else 0)
+    else:
+        print(f"Неизвестная команда: {command}. Доступны: upgrade, status, check, check-upgrade, explain")
+        sys.exit(2)
@@ -0,0 +1,90 @@
+# Keyset-пагинация списков: стабильный порядок и непрозрачный курсор
+import base64
+import binascii
+import json
+from datetime import date, datetime, time
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from fastapi import HTTPException, Query, status
+from sqlalchemy import tuple_
+
+MAX_PAGE_SIZE = 500
+
+
+def encode_cursor(columns: Sequence, values: Sequence[Any]) -> str:
+    """Курсор: имена колонок порядка и значения последней строки страницы в base64"""
+    payload = {
+        "c": [column.key for column in columns],
+        "v": [value.isoformat() if isinstance(value, (date, time)) else value for value in values]
+    }
+    raw = json.dumps(payload, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, columns: Sequence) -> Tuple[Any, ...]:
+    """Значения из курсора с приведением к типам колонок; чужой или испорченный курсор — 400"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        payload = json.loads(raw)
+        if payload["c"] != [column.key for column in columns] or len(payload["v"]) != len(columns):
+            raise ValueError("курсор от другого списка")
+        values = []
+        for column, value in zip(columns, payload["v"]):
+            python_type = column.type.python_type
+            if python_type in (date, time, datetime):
+                value = python_type.fromisoformat(value)
+            elif not isinstance(value, python_type):
+                raise ValueError(f"неверный тип значения {column.key}")
+            values.append(value)
+        return tuple(values)
+    except (ValueError, KeyError, TypeError, binascii.Error, UnicodeDecodeError) as e:
+        print(f"Некорректный курсор: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Некорректный курсор страницы"
+        )
+
+
+class Page:
+    """
+    Параметры страницы (зависимость FastAPI): limit и cursor из строки запроса.
+    Без limit список отдается целиком, как раньше. С limit — не больше limit строк
+    после курсора; курсор следующей страницы возвращается в заголовке X-Next-Cursor.
+    Условие WHERE (колонки порядка) > курсор использует индекс, поэтому стоимость
+    страницы не зависит от того, насколько далеко клиент пролистал список.
+    """
+
+    def __init__(
+        self,
+        limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+        cursor: Optional[str] = Query(None)
+    ):
+        self.limit = limit
+        self.cursor = cursor
+        self.columns: Sequence = ()
+
+    @property
+    def key(self) -> Tuple[Optional[int], Optional[str]]:
+        """Параметры страницы для ключей кэша и ETag"""
+        return (self.limit, self.cursor)
+
+    def apply(self, statement, *columns):
+        """Сортировка по колонкам (последняя — уникальная, обычно id), условие курсора и LIMIT"""
+        self.columns = columns
+        statement = statement.order_by(*columns)
+        if self.cursor is not None:
+            statement = statement.where(tuple_(*columns) > tuple_(*decode_cursor(self.cursor, columns)))
+        if self.limit is not None:
+            statement = statement.limit(self.limit + 1)
+        return statement
+
+    def split(self, rows: List[Any], key: Callable[[Any], Sequence[Any]]) -> Tuple[List[Any], Optional[str]]:
+        """Строки страницы и курсор следующей (None, если страница последняя)"""
+        if self.limit is None or len(rows) <= self.limit:
+            return rows, None
+        rows = rows[:self.limit]
+        return rows, encode_cursor(self.columns, key(rows[-1]))
+
+    @staticmethod
+    def headers(next_cursor: Optional[str]) -> Dict[str, str]:
+        return {"X-Next-Cursor": next_cursor} if next_cursor else {}
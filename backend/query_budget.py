@@ -0,0 +1,438 @@
+# Бюджет запросов к БД для эндпоинтов.
+# Каждый маршрут из BUDGETS вызывается через TestClient на данных растущего размера
+# (по умолчанию 10, 100 и 1000 строк в каждом списке). Все SQL-запросы запроса
+# перехватываются через before/after_cursor_execute обоих движков (sync и async).
+# Проверяется, что:
+#   - число запросов не зависит от размера данных (нет N+1);
+#   - число запросов не больше max_queries, а суммарное время SQL — не больше max_sql_ms.
+# При нарушении печатается diff запросов относительно самого маленького размера.
+# Создает свои данные — запускать на отдельной БД:
+#   DATABASE_URL=sqlite:////tmp/query_budget.db python backend/query_budget.py
+#   DATABASE_URL=postgresql://.../budget_test python backend/query_budget.py --sizes 10,100,1000
+# Если у маршрута задан expect, поля ответа сверяются с ожидаемыми значениями — так
+# видно, что запрос действительно прошел путь записи, а не ничего не изменил.
+# Код возврата 1, если хотя бы один бюджет превышен (подходит для CI).
+import difflib
+import re
+import sys
+import threading
+from collections import namedtuple
+from datetime import date, datetime, time, timedelta
+from time import perf_counter
+from typing import Any, Dict, List, Tuple
+
+from fastapi.routing import APIRoute
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+from sqlmodel import Session
+
+import main
+import migrate
+from ll1 import (
+    Attendance, Classes, ClassSeries, Gender, Halls, PaymentMethod, Payments, Students, Subscriptions,
+    SubscriptionStatus, Teachers, UserRole, Users, Waitlist, engine, get_async_engine
+)
+from series import create_series, format_weekdays
+
+DEFAULT_SIZES = (10, 100, 1000)
+
+# Маршрут и его бюджет. path, json и expect подставляются из id тестовых данных (str.format)
+Budget = namedtuple("Budget", "method path role max_queries max_sql_ms json expect", defaults=(None, None))
+
+BUDGETS = [
+    Budget("POST", "/login", None, 2, 20, {"email": "{student_email}", "password": "{password}"}),
+    Budget("POST", "/token/refresh", None, 2, 20, {"refresh_token": "{refresh_token}"}),
+    Budget("GET", "/users/me", "student", 0, 0),
+    Budget("GET", "/classes/", None, 2, 100),
+    Budget("GET", "/students/", None, 1, 100),
+    Budget("GET", "/students/{student_id}", None, 2, 20),
+    Budget("GET", "/students/me", "student", 1, 20),
+    Budget("GET", "/teachers/", None, 2, 100),
+    Budget("GET", "/attendance/{class_id}", None, 1, 100),
+    Budget("GET", "/attendance/student/{student_id}", None, 5, 100),
+    Budget("GET", "/attendance/class/{class_id}", None, 5, 100),
+    Budget("GET", "/halls/", None, 2, 20),
+    Budget("GET", "/classes/{class_id}/waitlist", "admin", 2, 100),
+    Budget("GET", "/subscriptions/{student_id}", "student", 1, 20),
+    Budget("GET", "/teachers/{teacher_id}/schedule", "admin", 3, 100),
+    Budget("GET", "/admin/metrics", "admin", 1, 20),
+    Budget("GET", "/admin/attendance/statistics", "admin", 2, 100),
+    Budget("GET", "/admin/analytics/cohorts", "admin", 4, 200),
+    # Отметка и перекличка идут по свежим записям каждого размера: все переходят в
+    # «Присутствовал», поэтому каждый прогон списывает занятия с абонементов (+1 UPDATE списания)
+    Budget("PUT", "/attendance/{marked_attendance_id}", "admin", 7, 20, {"presence": "Присутствовал"},
+           {"presence": "Присутствовал"}),
+    Budget("PUT", "/attendance/class/{roll_call_class_id}", "admin", 4, 50, {"marks": "{class_marks}"},
+           {"present": "{roll_call_size}", "charged": "{roll_call_size}", "unchanged": 0}),
+    # +2: блокировка расписания зала и преподавателя и перепроверка пересечений по БД
+    Budget("PUT", "/classes/{free_class_id}", "admin", 10, 20, {
+        "time": "23:00", "type": "Budget", "hall_id": "{hall_id}", "teacher_id": "{teacher_id}",
+        "date": "{free_class_date}"
+    }),
+    Budget("POST", "/classes/{free_class_id}/enroll", "student", 6, 20),
+    Budget("DELETE", "/classes/{free_class_id}/enroll", "student", 6, 20),
+    Budget("POST", "/classes/enroll", "student", 6, 20, {"class_ids": ["{free_class_id}"]}),
+    Budget("DELETE", "/classes/{free_class_id}/enroll", "student", 6, 20),
+    Budget("POST", "/classes/{full_class_id}/waitlist", "student", 6, 20),
+    Budget("DELETE", "/classes/{full_class_id}/waitlist", "student", 6, 20),
+    Budget("POST", "/payments/create-with-subscription", "student", 6, 20, {
+        "student_id": "{student_id}", "amount": 1, "number_of_classes": 4
+    }),
+    # Записи, которые создаются и удаляются заново на каждом размере данных (Fixture.grow)
+    Budget("POST", "/classes/", "admin", 9, 20, {
+        "time": "12:00", "type": "Budget", "hall_id": "{hall_id}", "teacher_id": "{teacher_id}",
+        "date": "{new_class_date}"
+    }),
+    Budget("DELETE", "/classes/{doomed_class_id}", "admin", 7, 50),
+    Budget("POST", "/classes/series", "admin", 8, 50, {
+        "time": "13:00", "type": "Budget", "hall_id": "{hall_id}", "teacher_id": "{teacher_id}",
+        "weekdays": [0, 1, 2, 3, 4, 5, 6], "start_date": "{new_series_start}", "end_date": "{new_series_end}"
+    }),
+    Budget("PUT", "/classes/series/{series_id}", "admin", 8, 50, {"time": "14:00", "from_date": "{series_start}"}),
+    Budget("DELETE", "/classes/series/{series_id}?from_date={series_start}", "admin", 8, 50),
+    Budget("POST", "/admin/teachers/", "admin", 7, 20, {
+        "full_name": "Бюджет", "email": "{new_teacher_email}", "phone": "+70000000000", "experience": 1,
+        "specialization": "budget", "password": "{password}"
+    }),
+    Budget("PUT", "/admin/teachers/{teacher_id}", "admin", 7, 20, {"experience": 2}),
+    Budget("DELETE", "/admin/teachers/{doomed_teacher_id}", "admin", 17, 50),
+    Budget("POST", "/students/", "admin", 7, 20, {
+        "full_name": "Бюджет", "email": "{new_student_email}", "phone": "+70000000000",
+        "date_of_birth": "2000-01-01", "gender": "F", "password": "{password}"
+    }),
+    Budget("PUT", "/students/{doomed_student_id}", "admin", 7, 20, {"phone": "+70000000001"}),
+    Budget("DELETE", "/students/{doomed_student_id}", "admin", 16, 50),
+]
+
+PASSWORD = "budget-password"
+
+
+class QueryRecorder:
+    """Запросы к БД между start и stop: текст и время каждого"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.active = False
+        self.statements: List[Tuple[str, float]] = []
+
+    def attach(self, db_engine) -> None:
+        @event.listens_for(db_engine, "before_cursor_execute")
+        def before(conn, cursor, statement, parameters, context, executemany):
+            conn.info.setdefault("budget_start", []).append(perf_counter())
+
+        @event.listens_for(db_engine, "after_cursor_execute")
+        def after(conn, cursor, statement, parameters, context, executemany):
+            elapsed_ms = (perf_counter() - conn.info["budget_start"].pop()) * 1000
+            if self.active:
+                with self._lock:
+                    self.statements.append((statement, elapsed_ms))
+
+    def start(self) -> None:
+        with self._lock:
+            self.statements = []
+        self.active = True
+
+    def stop(self) -> List[Tuple[str, float]]:
+        self.active = False
+        with self._lock:
+            return list(self.statements)
+
+
+def normalize(statement: str) -> str:
+    """Текст запроса без пробелов-переносов и с одинаковой записью списков параметров IN"""
+    statement = " ".join(statement.split())
+    return re.sub(r"\((?:\?|\$\d+|%\(\w+\)s)(?:, (?:\?|\$\d+|%\(\w+\)s))*\)", "(...)", statement)
+
+
+def statement_diff(baseline: List[str], current: List[str], size: int, base_size: int) -> str:
+    return "\n".join(difflib.unified_diff(
+        [normalize(s) for s in baseline], [normalize(s) for s in current],
+        fromfile=f"{base_size} строк", tofile=f"{size} строк", lineterm=""
+    ))
+
+
+class Fixture:
+    """Тестовые данные, растущие до заданного размера (хранятся только id)"""
+
+    def __init__(self, session: Session):
+        self.tag = datetime.now().strftime("%Y%m%d%H%M%S%f")
+        self.password_hash = main.get_password_hash(PASSWORD)
+        self.size = 0
+        self.rounds = 0
+        self.counter = 0
+        self.attendees: List[int] = []
+
+        admin = self._user(session, UserRole.ADMIN, "admin")
+        teacher = self._teacher(session, "teacher")
+        student = self._student(session, "student")
+        hall = Halls(hall_number=int(self.tag[-9:]), capacity=100, description="Бюджет запросов")
+        # Зал на одно место: занятие в нем заполнено, и на него можно встать в лист ожидания
+        small_hall = Halls(hall_number=hall.hall_number + 1, capacity=1, description="Бюджет запросов")
+        session.add_all([hall, small_hall])
+        session.flush()
+
+        today = date.today()
+        main_class = Classes(time=time(5, 0), type="Budget", hall_id=hall.id, teacher_id=teacher.id,
+                             date=today + timedelta(days=1))
+        free_class = Classes(time=time(23, 0), type="Budget", hall_id=hall.id, teacher_id=teacher.id,
+                             date=today + timedelta(days=2))
+        full_class = Classes(time=time(5, 0), type="Budget", hall_id=small_hall.id, teacher_id=teacher.id,
+                             date=today + timedelta(days=3), current_capacity=1)
+        session.add_all([main_class, free_class, full_class])
+        session.flush()
+        attendance = Attendance(student_id=student.id, class_id=main_class.id, teacher_id=teacher.id)
+        seated = self._student(session, "seated")
+        session.add_all([
+            attendance,
+            Attendance(student_id=seated.id, class_id=full_class.id, teacher_id=teacher.id)
+        ])
+        session.flush()
+        self.attendees.append(student.id)
+
+        self.user_ids = {"admin": admin.id, "teacher": teacher.user_id, "student": student.user_id}
+        self.values = {
+            "student_email": session.get(Users, student.user_id).email,
+            "password": PASSWORD,
+            "student_id": student.id,
+            "teacher_id": teacher.id,
+            "hall_id": hall.id,
+            "class_id": main_class.id,
+            "free_class_id": free_class.id,
+            "free_class_date": free_class.date.isoformat(),
+            "full_class_id": full_class.id,
+            "attendance_id": attendance.id
+        }
+        session.commit()
+
+    def _user(self, session: Session, role: UserRole, name: str) -> Users:
+        self.counter += 1
+        user = Users(email=f"budget-{name}-{self.tag}-{self.counter}@example.local",
+                     password_hash=self.password_hash, role=role)
+        session.add(user)
+        session.flush()
+        return user
+
+    def _teacher(self, session: Session, name: str) -> Teachers:
+        user = self._user(session, UserRole.TEACHER, name)
+        teacher = Teachers(user_id=user.id, full_name=f"Преподаватель {self.counter}", experience=1,
+                           specialization="budget", phone="+70000000000")
+        session.add(teacher)
+        session.flush()
+        return teacher
+
+    def _student(self, session: Session, name: str) -> Students:
+        user = self._user(session, UserRole.STUDENT, name)
+        student = Students(user_id=user.id, full_name=f"Студент {self.counter}", date_of_birth=date(2000, 1, 1),
+                           gender=Gender.FEMALE, phone="+70000000000")
+        session.add(student)
+        session.flush()
+        payment = Payments(student_id=student.id, amount=1, payment_method=PaymentMethod.CARD)
+        session.add(payment)
+        session.flush()
+        session.add(Subscriptions(student_id=student.id, payment_id=payment.id, status=SubscriptionStatus.ACTIVE,
+                                  end_date=date.today() + timedelta(days=30), number_of_classes=16,
+                                  remaining_classes=16))
+        return student
+
+    def _class(self, session: Session, day: date, at: time, teacher_id: int, current_capacity: int = 0) -> Classes:
+        class_ = Classes(time=at, type="Budget", hall_id=self.values["hall_id"], teacher_id=teacher_id,
+                         date=day, current_capacity=current_capacity)
+        session.add(class_)
+        session.flush()
+        return class_
+
+    def grow(self, session: Session, size: int) -> None:
+        """
+        Довести каждый список до size строк: преподаватели и студенты, занятия преподавателя
+        в ближайшие две недели, записи студента на них, записи студентов и лист ожидания
+        на основное занятие и на заполненное занятие. Затем подготовить свежие цели для
+        маршрутов, которые создают и удаляют записи
+        """
+        today = date.today()
+        for n in range(self.size, size):
+            self._teacher(session, "more")
+            other = self._student(session, "more")
+            class_ = Classes(time=time(6 + n // 14 // 60, n // 14 % 60), type="Budget",
+                             hall_id=self.values["hall_id"], teacher_id=self.values["teacher_id"],
+                             date=today + timedelta(days=1 + n % 14))
+            session.add(class_)
+            session.flush()
+            session.add_all([
+                Attendance(student_id=self.values["student_id"], class_id=class_.id,
+                           teacher_id=self.values["teacher_id"]),
+                Attendance(student_id=other.id, class_id=self.values["class_id"],
+                           teacher_id=self.values["teacher_id"]),
+                Waitlist(class_id=self.values["class_id"], student_id=other.id),
+                Waitlist(class_id=self.values["full_class_id"], student_id=other.id)
+            ])
+            self.attendees.append(other.id)
+        self.size = size
+        self.rounds += 1
+        self._scratch(session)
+        session.commit()
+
+    def _scratch(self, session: Session) -> None:
+        """
+        Цели маршрутов записи на этот размер данных. У удаляемых занятия, серии и преподавателя
+        по size записей студентов, удаляемый студент записан на size будущих занятий. На
+        занятие переклички записаны все студенты, а на занятие отметки — основной студент;
+        оба в сроке их абонементов, чтобы отметка списывала занятия.
+        """
+        today = date.today()
+        teacher_id = self.values["teacher_id"]
+        # Свои даты на каждый размер, чтобы созданные занятия не пересекались с прошлыми
+        base = today + timedelta(days=100 + self.rounds * 40)
+
+        doomed_class = self._class(session, base, time(16, 0), teacher_id)
+        doomed_teacher = self._teacher(session, "doomed")
+        past_class = self._class(session, today - timedelta(days=1), time(4, 0), doomed_teacher.id)
+        doomed_student = self._student(session, "doomed")
+        seat_classes = [
+            Classes(time=time(n // 60, n % 60), type="Budget", hall_id=self.values["hall_id"],
+                    teacher_id=teacher_id, date=base + timedelta(days=2), current_capacity=1)
+            for n in range(self.size)
+        ]
+        session.add_all(seat_classes)
+        roll_call_class = self._class(session, today + timedelta(days=15), time(4, self.rounds), teacher_id)
+        marked_class = self._class(session, today + timedelta(days=16), time(4, self.rounds), teacher_id)
+        marked = Attendance(student_id=self.values["student_id"], class_id=marked_class.id, teacher_id=teacher_id)
+
+        series = ClassSeries(type="Budget", hall_id=self.values["hall_id"], teacher_id=teacher_id,
+                             time=time(15, 0), weekdays=format_weekdays(range(7)),
+                             start_date=base + timedelta(days=10), end_date=base + timedelta(days=16))
+        (first_class_id, _), *_ = create_series(session, series)
+
+        session.add_all(
+            [Attendance(student_id=student_id, class_id=class_id, teacher_id=teacher_id)
+             for student_id in self.attendees
+             for class_id in (doomed_class.id, first_class_id, roll_call_class.id)]
+            + [Attendance(student_id=student_id, class_id=past_class.id, teacher_id=doomed_teacher.id)
+               for student_id in self.attendees]
+            + [Attendance(student_id=doomed_student.id, class_id=class_.id, teacher_id=teacher_id)
+               for class_ in seat_classes]
+            + [marked]
+        )
+        session.flush()
+        self.values.update({
+            "roll_call_class_id": roll_call_class.id,
+            "class_marks": [
+                {"student_id": student_id, "presence": "Присутствовал"} for student_id in self.attendees
+            ],
+            "roll_call_size": len(self.attendees),
+            "marked_attendance_id": marked.id,
+            "new_class_date": (base + timedelta(days=1)).isoformat(),
+            "new_series_start": (base + timedelta(days=20)).isoformat(),
+            "new_series_end": (base + timedelta(days=26)).isoformat(),
+            "doomed_class_id": doomed_class.id,
+            "series_id": series.id,
+            "series_start": series.start_date.isoformat(),
+            "doomed_teacher_id": doomed_teacher.id,
+            "doomed_student_id": doomed_student.id,
+            "new_teacher_email": f"budget-new-teacher-{self.tag}-{self.rounds}@example.local",
+            "new_student_email": f"budget-new-student-{self.tag}-{self.rounds}@example.local"
+        })
+
+
+def fill(template: Any, values: Dict[str, Any]) -> Any:
+    """Подстановка id в путь и тело запроса; строка вида '{name}' заменяется значением с его типом"""
+    if isinstance(template, dict):
+        return {key: fill(value, values) for key, value in template.items()}
+    if isinstance(template, list):
+        return [fill(value, values) for value in template]
+    if isinstance(template, str):
+        match = re.fullmatch(r"\{(\w+)\}", template)
+        return values[match.group(1)] if match else template.format(**values)
+    return template
+
+
+def uncovered_routes(app) -> List[str]:
+    declared = {(budget.method, re.sub(r"\{\w+\}", "{}", budget.path.split("?")[0])) for budget in BUDGETS}
+    missing = []
+    for route in app.routes:
+        if isinstance(route, APIRoute):
+            for method in sorted(route.methods):
+                if (method, re.sub(r"\{\w+\}", "{}", route.path)) not in declared:
+                    missing.append(f"{method} {route.path}")
+    return missing
+
+
+def run(sizes=DEFAULT_SIZES) -> int:
+    """Прогон всех бюджетов; возвращает число нарушений"""
+    migrate.upgrade(engine)
+    recorder = QueryRecorder()
+    recorder.attach(engine)
+    recorder.attach(get_async_engine().sync_engine)
+
+    with Session(engine) as session:
+        fixture = Fixture(session)
+        tokens = {}
+        for role, user_id in fixture.user_ids.items():
+            user = session.get(Users, user_id)
+            tokens[role] = main.issue_tokens(main.get_profile_claims(session, user), user)
+    fixture.values["refresh_token"] = tokens["student"]["refresh_token"]
+
+    results: List[List[Tuple[int, List[Tuple[str, float]]]]] = [[] for _ in BUDGETS]
+    failures = 0
+    with TestClient(main.app) as client:
+        for size in sizes:
+            with Session(engine) as session:
+                fixture.grow(session, size)
+            values = fixture.values
+            for budget, runs in zip(BUDGETS, results):
+                # Кэши сбрасываются, чтобы мерить холодный путь
+                main.schedule_cache.clear()
+                main.user_cache.clear()
+                main.cohort_cache.clear()
+                headers = {"token": tokens[budget.role]["access_token"]} if budget.role else {}
+                recorder.start()
+                response = client.request(
+                    budget.method, fill(budget.path, values), headers=headers, json=fill(budget.json, values)
+                )
+                statements = recorder.stop()
+                if response.status_code >= 400:
+                    failures += 1
+                    print(f"ОШИБКА {budget.method} {budget.path} [{size}]: {response.status_code} {response.text[:200]}")
+                elif budget.expect:
+                    expected = fill(budget.expect, values)
+                    body = response.json()
+                    mismatched = {key: body.get(key) for key, value in expected.items() if body.get(key) != value}
+                    if mismatched:
+                        failures += 1
+                        print(f"ОШИБКА {budget.method} {budget.path} [{size}]: ожидалось {expected}, получено {mismatched}")
+                runs.append((size, statements))
+
+    for budget, runs in zip(BUDGETS, results):
+        base_size, baseline = runs[0]
+        problems = []
+        for size, statements in runs:
+            total_ms = sum(elapsed for _, elapsed in statements)
+            if len(statements) > budget.max_queries:
+                problems.append(f"{size} строк: {len(statements)} запросов при бюджете {budget.max_queries}")
+            if total_ms > budget.max_sql_ms:
+                problems.append(f"{size} строк: SQL {total_ms:.1f} мс при бюджете {budget.max_sql_ms} мс")
+            if len(statements) != len(baseline):
+                problems.append(f"{size} строк: {len(statements)} запросов, а при {base_size} строках — {len(baseline)}")
+        counts = ", ".join(
+            f"{size}: {len(statements)} / {sum(elapsed for _, elapsed in statements):.1f} мс" for size, statements in runs
+        )
+        print(f"[{'ok' if not problems else 'ПРЕВЫШЕН'}] {budget.method} {budget.path} — {counts}")
+        if problems:
+            failures += 1
+            for problem in problems:
+                print(f"    {problem}")
+            worst_size, worst = max(runs, key=lambda run_: len(run_[1]))
+            diff = statement_diff([s for s, _ in baseline], [s for s, _ in worst], worst_size, base_size)
+            print("\n".join(f"    {line}" for line in (diff or "(запросы те же)").splitlines()))
+
+    missing = uncovered_routes(main.app)
+    if missing:
+        print(f"Маршруты без бюджета ({len(missing)}): {', '.join(missing)}")
+    print("Все бюджеты соблюдены" if not failures else f"Нарушений: {failures}")
+    return failures
+
+
+if __name__ == "__main__":
+    sizes = DEFAULT_SIZES
+    if len(sys.argv) > 2 and sys.argv[1] == "--sizes":
+        sizes = tuple(int(size) for size in sys.argv[2].split(","))
+    sys.exit(1 if run(sizes) else 0)
@@ -5,15 +5,19 @@ from datetime import  date, timedelta
 from typing import List, Optional, Dict, Any
 from fastapi import HTTPException, status
 from dateutil.relativedelta import relativedelta
+from conflicts import check_conflicts_locked, find_conflicts, raise_on_conflicts
+from enrollment import enroll_student_sync
+from attendance_stats import attendance_statistics
 
 def get_classes_with_details(
     start_date: date = date.today(),
     end_date: date = date.today() + timedelta(days=7),
     dance_type: Optional[str] = None,
-    teacher_id: Optional[int] = None
+    teacher_id: Optional[int] = None,
+    session: Optional[Session] = None
 ) -> List[dict]:
     """Получение расписания с деталями о зале и преподавателе"""
-    with Session(engine) as session:
+    with session_scope(session) as session:
         query = (
             select(
                 Classes,
@@ -53,9 +57,9 @@ def get_classes_with_details(
             for cls, hall_number, capacity, teacher_name, specialization in results
         ]
 
-def get_students_with_email() -> List[dict]:
+def get_students_with_email(session: Optional[Session] = None) -> List[dict]:
     """Получение студентов с их email"""
-    with Session(engine) as session:
+    with session_scope(session) as session:
         query = (
             select(
                 Students,
@@ -77,10 +81,10 @@ def get_students_with_email() -> List[dict]:
             for student, email in results
         ]
     
-def get_student_by_email(email: str) -> Optional[Students]:
+def get_student_by_email(email: str, session: Optional[Session] = None) -> Optional[Students]:
     """Получение студента по email"""
     try:
-        with Session(engine) as session:
+        with session_scope(session) as session:
             print(f"Searching for student with email: {email}")  # Отладочный вывод
             statement = select(Students).where(Students.email == email)
             student = session.exec(statement).first()
@@ -172,14 +176,36 @@ def get_active_subscriptions(db: Session, student_id: int) -> List[Subscriptions
         print(f"Ошибка при получении активных подписок: {str(e)}")
         return []
 
+async def get_active_subscriptions_async(db: AsyncSession, student_id: int) -> List[Subscriptions]:
+    """Получение всех активных подписок студента (асинхронная версия get_active_subscriptions)"""
+    try:
+        result = await db.exec(
+            select(Subscriptions).where(
+                and_(
+                    Subscriptions.student_id == student_id,
+                    Subscriptions.end_date >= date.today(),
+                    Subscriptions.status == SubscriptionStatus.ACTIVE,
+                    Subscriptions.remaining_classes > 0
+                )
+            )
+        )
+        subscriptions = result.all()
+        print(f"Found {len(subscriptions)} active subscriptions")
+        return subscriptions
+
+    except Exception as e:
+        print(f"Ошибка при получении активных подписок: {str(e)}")
+        return []
+
 def get_class_schedule(
     date_from: Optional[date] = None,
     date_to: Optional[date] = None,
     dance_type: Optional[str] = None,
-    teacher_id: Optional[int] = None
+    teacher_id: Optional[int] = None,
+    session: Optional[Session] = None
 ) -> List[Classes]:
     """Получение расписания занятий с фильтрацией"""
-    with Session(engine) as session:
+    with session_scope(session) as session:
         statement = select(Classes)
         if date_from:
             if date_from < date.today():
@@ -201,9 +227,9 @@ def get_class_schedule(
             statement = statement.where(Classes.teacher_id == teacher_id)
         return session.exec(statement).all()
 
-def get_available_classes(student_id: int) -> List[Classes]:
+def get_available_classes(student_id: int, session: Optional[Session] = None) -> List[Classes]:
     """Получение доступных для записи занятий"""
-    with Session(engine) as session:
+    with session_scope(session) as session:
         subscription = get_active_subscription(session, student_id)
         if not subscription:
             raise HTTPException(
@@ -224,89 +250,20 @@ def get_available_classes(student_id: int) -> List[Classes]:
         )
         return session.exec(statement).all()
 
-def enroll_student_in_class(student_id: int, class_id: int) -> Dict[str, Any]:
-    with Session(engine) as session:
-        try:
-            # Проверяем наличие активного абонемента
-            subscription = get_active_subscription(session, student_id)
-            if not subscription:
-                raise HTTPException(
-                    status_code=400,
-                    detail="No active subscription found"
-                )
-
-            # Получаем информацию о занятии
-            class_ = session.get(Classes, class_id)
-            if not class_:
-                raise HTTPException(
-                    status_code=404,
-                    detail="Class not found"
-                )
-
-            # Получаем информацию о зале
-            hall = session.get(Halls, class_.hall_id)
-            if not hall:
-                raise HTTPException(
-                    status_code=404,
-                    detail="Hall not found"
-                )
-
-            # Проверяем вместимость зала
-            if class_.current_capacity >= hall.capacity:
-                raise HTTPException(
-                    status_code=400,
-                    detail="Class is full"
-                )
-
-            # Проверяем, не записан ли уже студент на это занятие
-            existing_enrollment = session.exec(
-                select(Attendance).where(
-                    Attendance.student_id == student_id,
-                    Attendance.class_id == class_id
-                )
-            ).first()
-
-            if existing_enrollment:
-                raise HTTPException(
-                    status_code=400,
-                    detail="Student is already enrolled in this class"
-                )
-
-            # Создаем запись о посещении
-            attendance = Attendance(
-                student_id=student_id,
-                class_id=class_id,
-                presence="Записан",
-                teacher_id=class_.teacher_id
-            )
-            session.add(attendance)
-            print("11111111111111111111")
-
-            # Увеличиваем текущую заполненность класса
-            class_.current_capacity += 1
-
-            # Сохраняем изменения
-            session.commit()
-            session.refresh(attendance)
-
-            return {
-                "message": "Successfully enrolled in class",
-                "attendance_id": attendance.id,
-                "remaining_slots": hall.capacity - class_.current_capacity
-            }
-
-        except HTTPException as e:
-            raise e
-        except Exception as e:
-            session.rollback()
-            raise HTTPException(
-                status_code=500,
-                detail=f"Error enrolling in class: {str(e)}"
-            )
+def enroll_student_in_class(student_id: int, class_id: int, session: Optional[Session] = None) -> Dict[str, Any]:
+    """Запись студента на занятие (атомарно, см. enrollment.py)"""
+    with session_scope(session) as session:
+        enrollment = enroll_student_sync(session, student_id, class_id)
+        hall = session.get(Halls, enrollment["hall_id"])
+        return {
+            "message": "Successfully enrolled in class",
+            "attendance_id": enrollment["attendance_id"],
+            "remaining_slots": hall.capacity - enrollment["current_capacity"]
+        }
 
-def mark_attendance(student_id: int, class_id: int, presence: str) -> Dict[str, Any]:
+def mark_attendance(student_id: int, class_id: int, presence: str, session: Optional[Session] = None) -> Dict[str, Any]:
     """Отметка посещаемости"""
-    with Session(engine) as session:
+    with session_scope(session) as session:
         attendance = session.exec(
             select(Attendance).where(
                 and_(
@@ -326,9 +283,9 @@ def mark_attendance(student_id: int, class_id: int, presence: str) -> Dict[str,
         session.commit()
         return {"message": "Attendance marked successfully"}
 
-def get_teacher_schedule(teacher_id: int, date_from: Optional[date] = None) -> List[Classes]:
+def get_teacher_schedule(teacher_id: int, date_from: Optional[date] = None, session: Optional[Session] = None) -> List[Classes]:
     """Получение расписания преподавателя"""
-    with Session(engine) as session:
+    with session_scope(session) as session:
         if date_from and date_from < date.today():
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
@@ -344,77 +301,32 @@ def get_attendance_statistics(
     date_from: Optional[date] = None,
     date_to: Optional[date] = None,
     dance_type: Optional[str] = None,
-    teacher_id: Optional[int] = None
+    teacher_id: Optional[int] = None,
+    session: Optional[Session] = None
 ) -> Dict[str, Any]:
-    """Получение статистики посещаемости"""
-    with Session(engine) as session:
-        if date_from and date_to and date_to < date_from:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="End date cannot be before start date"
-            )
-
-        statement = select(Attendance).join(Classes)
-        if date_from:
-            statement = statement.where(Classes.date >= date_from)
-        if date_to:
-            statement = statement.where(Classes.date <= date_to)
-        if dance_type:
-            statement = statement.where(Classes.type == dance_type)
-        if teacher_id:
-            statement = statement.where(Classes.teacher_id == teacher_id)
-
-        attendance_records = session.exec(statement).all()
+    """Получение статистики посещаемости (считается в БД одним запросом)"""
+    with session_scope(session) as session:
+        return attendance_statistics(session, date_from, date_to, dance_type, teacher_id)
 
-        statistics = {
-            "total_attendance": len(attendance_records),
-            "by_dance_type": {},
-            "by_teacher": {},
-            "by_date": {},
-            "attendance_rate": 0.0
-        }
-
-        total_registered = 0
-        total_present = 0
-
-        for record in attendance_records:
-            dance_type = record.class_.type
-            teacher_id = record.class_.teacher_id
-            date_str = record.class_.date.strftime("%Y-%m-%d")
-
-            statistics["by_dance_type"][dance_type] = statistics["by_dance_type"].get(dance_type, 0) + 1
-            statistics["by_teacher"][teacher_id] = statistics["by_teacher"].get(teacher_id, 0) + 1
-            statistics["by_date"][date_str] = statistics["by_date"].get(date_str, 0) + 1
-
-            if record.presence == "Записан":
-                total_registered += 1
-            if record.presence == "Присутствовал":
-                total_present += 1
-
-        if total_registered > 0:
-            statistics["attendance_rate"] = (total_present / total_registered) * 100
-
-        return statistics
-
-def get_student_attendance(student_id: int) -> List[Attendance]:
+def get_student_attendance(student_id: int, session: Optional[Session] = None) -> List[Attendance]:
     """Получение посещаемости студента"""
-    with Session(engine) as session:
+    with session_scope(session) as session:
         statement = select(Attendance).where(
             Attendance.student_id == student_id
         ).order_by(Attendance.created_at.desc())
         return session.exec(statement).all()
 
-def get_class_attendance(class_id: int) -> List[Attendance]:
+def get_class_attendance(class_id: int, session: Optional[Session] = None) -> List[Attendance]:
     """Получение посещаемости занятия"""
-    with Session(engine) as session:
+    with session_scope(session) as session:
         statement = select(Attendance).where(
             Attendance.class_id == class_id
         ).order_by(Attendance.created_at.desc())
         return session.exec(statement).all()
 
-def create_payment(student_id: int, amount: float, payment_method: str, status_payment:str) -> Payments:
+def create_payment(student_id: int, amount: float, payment_method: str, status_payment:str, session: Optional[Session] = None) -> Payments:
     """Создание платежа"""
-    with Session(engine) as session:
+    with session_scope(session) as session:
         payment = Payments(
             student_id=student_id,
             amount=amount,
@@ -426,9 +338,9 @@ def create_payment(student_id: int, amount: float, payment_method: str, status_p
         session.refresh(payment)
         return payment
 
-def create_subscription(student_id: int, payment_id: int, number_of_classes: int, start_date: date) -> Subscriptions:
+def create_subscription(student_id: int, payment_id: int, number_of_classes: int, start_date: date, session: Optional[Session] = None) -> Subscriptions:
     """Создание подписки"""
-    with Session(engine) as session:
+    with session_scope(session) as session:
         # Проверяем существование платежа
         payment = session.get(Payments, payment_id)
         if not payment:
@@ -459,21 +371,21 @@ def create_subscription(student_id: int, payment_id: int, number_of_classes: int
         session.refresh(subscription)
         return subscription
 
-def get_all_teachers() -> List[Teachers]:
+def get_all_teachers(session: Optional[Session] = None) -> List[Teachers]:
     """Получение списка всех преподавателей"""
-    with Session(engine) as session:
+    with session_scope(session) as session:
         statement = select(Teachers)
         return session.exec(statement).all()
     
-def get_all_halls() -> List[Halls]:
+def get_all_halls(session: Optional[Session] = None) -> List[Halls]:
     """Получение списка всех залов"""
-    with Session(engine) as session:
+    with session_scope(session) as session:
         statement = select(Halls)
         return session.exec(statement).all()
     
-def create_class(class_data: Dict[str, Any]) -> Classes:
+def create_class(class_data: Dict[str, Any], session: Optional[Session] = None) -> Classes:
     """Создание занятия"""
-    with Session(engine) as session:
+    with session_scope(session) as session:
         # Проверка существования зала и преподавателя
         hall = session.get(Halls, class_data.get('hall_id'))
         if not hall:
@@ -489,22 +401,15 @@ def create_class(class_data: Dict[str, Any]) -> Classes:
                 detail="Teacher not found"
             )
 
-        # Проверка на конфликты расписания
-        existing_class = session.exec(
-            select(Classes).where(
-                and_(
-                    Classes.hall_id == class_data['hall_id'],
-                    Classes.date == class_data['date']
-                )
-            )
-        ).first()
-        if existing_class:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Hall is already booked for this time"
-            )
+        # Проверка на конфликты расписания: пересечения по залу и по преподавателю
+        class_ = Classes.model_validate(class_data)
+        raise_on_conflicts(find_conflicts(
+            session, class_.date, class_.time, class_.duration_minutes, class_.hall_id, class_.teacher_id
+        ))
+        check_conflicts_locked(
+            session, [(class_.date, class_.time)], class_.duration_minutes, class_.hall_id, class_.teacher_id
+        )
 
-        class_ = Classes(**class_data)
         session.add(class_)
         session.commit()
         session.refresh(class_)
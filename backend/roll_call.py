@@ -0,0 +1,127 @@
+# Перекличка: отметка посещаемости всего занятия одним запросом.
+# Все изменения идут в одной транзакции фиксированным числом запросов при любом
+# размере группы: чтение записей занятия, один UPDATE списания занятий с абонементов
+# (по абонементу на студента, отмеченного присутствующим впервые) и по одному UPDATE
+# attendance на каждый новый статус. Правила те же, что у PUT /attendance/{id}:
+# занятие списывается при переходе в «Присутствовал», обратный переход не возвращает
+# занятие, без активного абонемента с оставшимися занятиями, действующего на дату
+# занятия, отметить нельзя.
+# Функции синхронные; async-эндпоинты вызывают их через AsyncSession.run_sync.
+from datetime import date, datetime
+from typing import Any, Dict, List
+
+from fastapi import HTTPException, status
+from sqlalchemy import case, func, literal, select, update
+from sqlmodel import Session
+
+from ll1 import Attendance, AttendanceStatus, Classes, Students, Subscriptions, SubscriptionStatus
+from enrollment import usable_subscription_conditions
+
+attendance_table = Attendance.__table__
+subscriptions_table = Subscriptions.__table__
+
+
+def charge_statement(student_ids: List[int], class_date: date):
+    """
+    Списание одного занятия с абонемента каждого студента: берется самый старый активный
+    абонемент с оставшимися занятиями, действующий на дату занятия (те же условия, что при
+    записи); абонемент, на котором занятия кончились, истекает. Условия на саму строку
+    повторяются, чтобы параллельное списание не увело остаток ниже нуля.
+    """
+    oldest = (
+        select(func.min(subscriptions_table.c.id))
+        .where(subscriptions_table.c.student_id.in_(student_ids), *usable_subscription_conditions(class_date))
+        .group_by(subscriptions_table.c.student_id)
+    )
+    return (
+        update(subscriptions_table)
+        .where(subscriptions_table.c.id.in_(oldest), *usable_subscription_conditions(class_date))
+        .values(
+            remaining_classes=subscriptions_table.c.remaining_classes - 1,
+            status=case(
+                (subscriptions_table.c.remaining_classes == 1,
+                 literal(SubscriptionStatus.EXPIRED, subscriptions_table.c.status.type)),
+                else_=subscriptions_table.c.status
+            )
+        )
+        .returning(subscriptions_table.c.student_id, subscriptions_table.c.status)
+    )
+
+
+def apply_roll_call(session: Session, class_id: int, marks: Dict[int, AttendanceStatus]) -> Dict[str, Any]:
+    """
+    Отметка посещаемости занятия по списку {student_id: статус}. Студенты, которых нет
+    в списке, не меняются. Если хоть одного студента из списка нет среди записанных или
+    ему нечем оплатить занятие, не меняется ничего (400 со списком причин).
+    Возвращает сводку изменений.
+    """
+    rows = session.exec(
+        select(
+            attendance_table.c.id, attendance_table.c.student_id, attendance_table.c.presence, Students.full_name,
+            Classes.date
+        )
+        .join(Students, Students.id == attendance_table.c.student_id)
+        .join(Classes, Classes.id == attendance_table.c.class_id)
+        .where(attendance_table.c.class_id == class_id, attendance_table.c.student_id.in_(list(marks)))
+    ).all()
+    by_student = {row.student_id: row for row in rows}
+
+    errors = [f"Студент {student_id} не записан на занятие" for student_id in marks if student_id not in by_student]
+    if errors:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail={"message": "Перекличка не сохранена", "errors": errors}
+        )
+
+    changes: Dict[AttendanceStatus, List[int]] = {presence: [] for presence in AttendanceStatus}
+    for student_id, presence in marks.items():
+        if by_student[student_id].presence != presence:
+            changes[presence].append(student_id)
+    newly_present = changes[AttendanceStatus.PRESENT]
+
+    now = datetime.now()
+    charged = {}
+    if newly_present:
+        class_date = by_student[newly_present[0]].date
+        charged = dict(session.exec(charge_statement(newly_present, class_date)).all())
+        unpaid = [student_id for student_id in newly_present if student_id not in charged]
+        if unpaid:
+            session.rollback()
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail={
+                    "message": "Перекличка не сохранена",
+                    "errors": [
+                        f"У студента {by_student[student_id].full_name} нет активной подписки "
+                        f"на дату занятия или закончились занятия"
+                        for student_id in unpaid
+                    ]
+                }
+            )
+
+    for presence, student_ids in changes.items():
+        if student_ids:
+            session.exec(
+                update(attendance_table)
+                .where(attendance_table.c.id.in_([by_student[student_id].id for student_id in student_ids]))
+                .values(presence=presence, updated_at=now)
+            )
+    session.commit()
+
+    changed = sum(len(student_ids) for student_ids in changes.values())
+    return {
+        "class_id": class_id,
+        "present": len(changes[AttendanceStatus.PRESENT]),
+        "registered": len(changes[AttendanceStatus.REGISTERED]),
+        "unchanged": len(marks) - changed,
+        "charged": len(charged),
+        "expired_subscriptions": sum(1 for status_ in charged.values() if status_ == SubscriptionStatus.EXPIRED)
+    }
+
+
+def class_teacher(session: Session, class_id: int) -> int:
+    """Преподаватель занятия (404, если занятия нет)"""
+    teacher_id = session.exec(select(Classes.teacher_id).where(Classes.id == class_id)).first()
+    if teacher_id is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Занятие не найдено")
+    return teacher_id[0]
@@ -0,0 +1,154 @@
+# Быстрая сериализация строк расписания (формат ClassResponse/AttendanceResponse) сразу в JSON-байты
+import json
+from datetime import date, time
+from functools import lru_cache
+from typing import Any, Dict, Optional
+
+from fastapi import Response
+
+try:
+    import orjson
+except ImportError:  # orjson необязателен: без него используется стандартный json
+    orjson = None
+
+
+@lru_cache(maxsize=4096)
+def format_date(value: date) -> tuple:
+    """ISO-дата и дата для интерфейса (дд.мм.гггг), один раз на каждую дату"""
+    return value.isoformat(), value.strftime('%d.%m.%Y')
+
+
+@lru_cache(maxsize=2048)
+def format_time(value: time) -> tuple:
+    """Время чч:мм:сс и чч:мм, один раз на каждое время"""
+    return value.strftime('%H:%M:%S'), value.strftime('%H:%M')
+
+
+def class_row(class_, hall_number: int, hall_capacity: int, teacher_name: str) -> Dict[str, Any]:
+    """Строка расписания с теми же полями и в том же порядке, что ClassResponse"""
+    iso_date, formatted_date = format_date(class_.date)
+    full_time, formatted_time = format_time(class_.time)
+    return {
+        "id": class_.id,
+        "time": full_time,
+        "type": class_.type,
+        "date": iso_date,
+        "current_capacity": class_.current_capacity,
+        "hall_number": hall_number,
+        "hall_capacity": hall_capacity,
+        "teacher_name": teacher_name,
+        "formatted_date": formatted_date,
+        "formatted_time": formatted_time,
+        "teacher_id": class_.teacher_id,
+        "hall_id": class_.hall_id,
+        "duration_minutes": class_.duration_minutes
+    }
+
+
+def attendance_row(attendance, student_name: str, class_data: Dict[str, Any]) -> Dict[str, Any]:
+    """Запись посещаемости в формате AttendanceResponse"""
+    return {
+        "id": attendance.id,
+        "presence": getattr(attendance.presence, "value", attendance.presence),
+        "student_id": attendance.student_id,
+        "class_id": attendance.class_id,
+        "teacher_id": attendance.teacher_id,
+        "student_name": student_name,
+        "class_": class_data
+    }
+
+
+def dumps(content: Any) -> bytes:
+    """JSON-байты: orjson, если установлен, иначе json с теми же настройками, что у FastAPI"""
+    if orjson is not None:
+        return orjson.dumps(content)
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+
+def json_response(content: Any, status_code: int = 200, headers: Optional[Dict[str, str]] = None) -> Response:
+    """Готовый ответ без повторной валидации по response_model (content — данные или байты)"""
+    body = content if isinstance(content, bytes) else dumps(content)
+    return Response(content=body, status_code=status_code, headers=headers, media_type="application/json")
+
+
+if __name__ == "__main__":
+    # Микробенчмарк: 10 000 строк расписания, прежний путь (dict дней недели, strftime,
+    # ClassResponse, jsonable_encoder + json.dumps) против class_row + dumps
+    from datetime import timedelta
+    from time import perf_counter
+    from types import SimpleNamespace
+
+    from fastapi.encoders import jsonable_encoder
+    from pydantic import BaseModel
+
+    class ClassResponse(BaseModel):
+        # Копия модели ответа из main.py (импорт main требует настроенной БД)
+        id: int
+        time: str
+        type: str
+        date: date
+        current_capacity: int
+        hall_number: int
+        hall_capacity: int
+        teacher_name: str
+        formatted_date: str
+        formatted_time: str
+        teacher_id: int
+        hall_id: int
+        duration_minutes: int = 60
+
+    ROWS = 10_000
+    start = date.today()
+    rows = [
+        (
+            SimpleNamespace(
+                id=i, time=time(9 + i % 12, 30 * (i % 2)), type="Hip-hop", date=start + timedelta(days=i % 14),
+                current_capacity=i % 15, teacher_id=1 + i % 5, hall_id=1 + i % 3,
+                duration_minutes=60
+            ),
+            101 + i % 3, 20, "Преподаватель"
+        )
+        for i in range(ROWS)
+    ]
+
+    def old_path():
+        result = []
+        for cls, hall_number, hall_capacity, teacher_name in rows:
+            formatted_date = cls.date.strftime('%d.%m.%Y')
+            formatted_time = cls.time.strftime('%H:%M')
+            day_of_week = cls.date.strftime('%A')
+            russian_days = {
+                'Monday': 'Понедельник', 'Tuesday': 'Вторник', 'Wednesday': 'Среда', 'Thursday': 'Четверг',
+                'Friday': 'Пятница', 'Saturday': 'Суббота', 'Sunday': 'Воскресенье'
+            }
+            russian_day_of_week = russian_days.get(day_of_week, day_of_week)
+            result.append(ClassResponse(
+                id=cls.id, time=cls.time.strftime('%H:%M:%S'), type=cls.type, date=cls.date,
+                current_capacity=cls.current_capacity, hall_number=hall_number, hall_capacity=hall_capacity,
+                teacher_name=teacher_name, remaining_slots=hall_capacity - cls.current_capacity,
+                formatted_date=formatted_date, formatted_time=formatted_time, day_of_week=russian_day_of_week,
+                teacher_id=cls.teacher_id, hall_id=cls.hall_id
+            ))
+        # Проверка по response_model и сериализация, как это делает FastAPI
+        validated = [ClassResponse.model_validate(item.model_dump()) for item in result]
+        return json.dumps(jsonable_encoder(validated), ensure_ascii=False, allow_nan=False,
+                          separators=(",", ":")).encode("utf-8")
+
+    def new_path():
+        return dumps([class_row(*row) for row in rows])
+
+    assert json.loads(old_path()) == json.loads(new_path())
+
+    def measure(fn, repeat=5):
+        best = float("inf")
+        for _ in range(repeat):
+            started = perf_counter()
+            fn()
+            best = min(best, perf_counter() - started)
+        return best * 1000
+
+    old_ms = measure(old_path)
+    new_ms = measure(new_path)
+    print(f"{ROWS} строк: прежний путь {old_ms:.1f} мс, class_row + dumps {new_ms:.1f} мс "
+          f"(x{old_ms / new_ms:.1f}, {'orjson' if orjson is not None else 'json'})")
+    print(f"format_date: {format_date.cache_info()}, format_time: {format_time.cache_info()}")
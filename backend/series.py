@@ -0,0 +1,196 @@
+# Серии повторяющихся занятий: даты по дням недели, проверка всех занятий серии
+# за один проход по индексу расписания (и одним запросом к БД под блокировкой
+# расписания перед записью) и создание одним многострочным INSERT.
+# Запись идет мимо ORM, поэтому индекс расписания обновляется через
+# record_class_changes, а updated_at выставляется явно (по нему считается ETag)
+import os
+from datetime import date, datetime, time, timedelta
+from typing import Any, Dict, Iterable, List, Tuple
+
+from fastapi import HTTPException, status
+from sqlalchemy import delete, func, insert, update
+from sqlmodel import Session, select
+
+from ll1 import Attendance, Classes, ClassSeries, Halls
+from conflicts import (
+    check_conflicts_locked, find_conflicts_many, raise_on_conflicts, record_class_changes, to_minutes
+)
+from waitlist import drop_queues, promote_many
+
+MAX_SERIES_OCCURRENCES = int(os.environ.get("MAX_SERIES_OCCURRENCES", "366"))
+
+classes_table = Classes.__table__
+
+
+def format_weekdays(weekdays: Iterable[int]) -> str:
+    """Дни недели для колонки class_series.weekdays: '0,2,4'"""
+    days = sorted(set(weekdays))
+    if not days or any(day < 0 or day > 6 for day in days):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Дни недели серии задаются числами от 0 (понедельник) до 6 (воскресенье)"
+        )
+    return ",".join(str(day) for day in days)
+
+
+def parse_weekdays(value: str) -> List[int]:
+    return [int(day) for day in value.split(",") if day]
+
+
+def occurrence_dates(start_date: date, end_date: date, weekdays: Iterable[int],
+                     exceptions: Iterable[date] = ()) -> List[date]:
+    """Даты занятий серии: выбранные дни недели с start_date по end_date, кроме exceptions"""
+    exceptions = set(exceptions)
+    dates = []
+    for weekday in set(weekdays):
+        day = start_date + timedelta(days=(weekday - start_date.weekday()) % 7)
+        while day <= end_date:
+            if day not in exceptions:
+                dates.append(day)
+            day += timedelta(days=7)
+    return sorted(dates)
+
+
+def interval(series_time: time, duration_minutes: int) -> Tuple[int, int]:
+    start = to_minutes(series_time)
+    return start, start + duration_minutes
+
+
+def series_classes(session: Session, series_id: int, from_date: date) -> List[Any]:
+    """Занятия серии начиная с from_date: (id, date, type, teacher_id, current_capacity)"""
+    return session.exec(
+        select(Classes.id, Classes.date, Classes.type, Classes.teacher_id, Classes.current_capacity)
+        .where(Classes.series_id == series_id, Classes.date >= from_date)
+        .order_by(Classes.date)
+    ).all()
+
+
+def create_series(session: Session, series: ClassSeries, exceptions: Iterable[date] = ()) -> List[Tuple[int, date]]:
+    """
+    Создание серии и всех ее занятий в одной транзакции. Все занятия проверяются
+    на пересечения заранее: при конфликте не создается ничего, а в ответе 409
+    перечислены все пересечения серии. Возвращает (id, дата) созданных занятий по датам.
+    """
+    dates = occurrence_dates(series.start_date, series.end_date, parse_weekdays(series.weekdays), exceptions)
+    if not dates:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="В серии нет ни одного занятия"
+        )
+    if len(dates) > MAX_SERIES_OCCURRENCES:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"В серии больше {MAX_SERIES_OCCURRENCES} занятий, разбейте ее на несколько"
+        )
+
+    occurrences = [(day, series.time) for day in dates]
+    raise_on_conflicts(find_conflicts_many(
+        session, occurrences, series.duration_minutes, series.hall_id, series.teacher_id
+    ))
+    check_conflicts_locked(session, occurrences, series.duration_minutes, series.hall_id, series.teacher_id)
+
+    session.add(series)
+    session.flush()
+
+    now = datetime.now()
+    rows = session.exec(
+        insert(classes_table)
+        .values([
+            {
+                "time": series.time, "type": series.type, "hall_id": series.hall_id,
+                "teacher_id": series.teacher_id, "date": day, "current_capacity": 0,
+                "duration_minutes": series.duration_minutes, "series_id": series.id,
+                "created_at": now, "updated_at": now
+            }
+            for day in dates
+        ])
+        .returning(classes_table.c.id, classes_table.c.date)
+    ).all()
+
+    start, end = interval(series.time, series.duration_minutes)
+    record_class_changes(session, {
+        class_id: (series.hall_id, series.teacher_id, day, start, end) for class_id, day in rows
+    })
+    session.commit()
+    session.refresh(series)
+    return sorted(((class_id, day) for class_id, day in rows), key=lambda row: row[1])
+
+
+def update_series(session: Session, series: ClassSeries, changes: Dict[str, Any],
+                  from_date: date) -> Tuple[List[Tuple], List[Tuple]]:
+    """
+    Изменение зала, преподавателя, времени, длительности или типа всех занятий серии
+    начиная с from_date одним UPDATE. Возвращает ключи расписания (date, type, teacher_id)
+    до и после изменения для сброса кэша.
+    """
+    targets = series_classes(session, series.id, from_date)
+    for field, value in changes.items():
+        setattr(series, field, value)
+
+    if targets:
+        ids = [row.id for row in targets]
+        occurrences = [(row.date, series.time) for row in targets]
+        raise_on_conflicts(find_conflicts_many(
+            session, occurrences, series.duration_minutes, series.hall_id, series.teacher_id, exclude_ids=ids
+        ))
+        check_conflicts_locked(
+            session, occurrences, series.duration_minutes, series.hall_id, series.teacher_id, exclude_ids=ids
+        )
+
+        if "hall_id" in changes and series.hall_id is not None:
+            hall = session.get(Halls, series.hall_id)
+            busiest = max(row.current_capacity for row in targets)
+            if busiest > hall.capacity:
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail=f"На занятие серии уже записано {busiest} человек, а вместимость зала {hall.capacity}"
+                )
+
+        session.exec(
+            update(classes_table)
+            .where(classes_table.c.series_id == series.id, classes_table.c.date >= from_date)
+            .values(
+                time=series.time, type=series.type, hall_id=series.hall_id, teacher_id=series.teacher_id,
+                duration_minutes=series.duration_minutes, updated_at=datetime.now()
+            )
+        )
+        start, end = interval(series.time, series.duration_minutes)
+        record_class_changes(session, {
+            row.id: (series.hall_id, series.teacher_id, row.date, start, end) for row in targets
+        })
+        if "hall_id" in changes:
+            # В новом зале может быть больше мест — их получает лист ожидания
+            promote_many(session, ids)
+
+    session.add(series)
+    session.commit()
+    session.refresh(series)
+    old_keys = [(row.date, row.type, row.teacher_id) for row in targets]
+    new_keys = [(row.date, series.type, series.teacher_id) for row in targets]
+    return old_keys, new_keys
+
+
+def cancel_series(session: Session, series: ClassSeries, from_date: date) -> List[Tuple]:
+    """
+    Отмена занятий серии начиная с from_date вместе с записями на них.
+    Если отменены все занятия серии, удаляется и сама серия, иначе она
+    заканчивается накануне from_date. Возвращает ключи расписания удаленных занятий.
+    """
+    targets = series_classes(session, series.id, from_date)
+    ids = [row.id for row in targets]
+    if ids:
+        drop_queues(session, ids)
+        session.exec(delete(Attendance.__table__).where(Attendance.__table__.c.class_id.in_(ids)))
+        session.exec(delete(classes_table).where(classes_table.c.id.in_(ids)))
+        record_class_changes(session, {class_id: None for class_id in ids})
+
+    remaining = session.exec(
+        select(func.count()).select_from(Classes).where(Classes.series_id == series.id)
+    ).one()
+    if from_date <= series.start_date or not remaining:
+        session.delete(series)
+    else:
+        series.end_date = min(series.end_date, from_date - timedelta(days=1))
+        session.add(series)
+    session.commit()
+    return [(row.date, row.type, row.teacher_id) for row in targets]
@@ -0,0 +1,237 @@
+# Лист ожидания на занятия: очередь FIFO по id на каждое занятие.
+# Место, освободившееся при отмене записи (или появившееся при переносе занятия
+# в зал побольше), сразу занимает первый в очереди — в той же транзакции, поэтому
+# свободное место не видно никому, пока очередь не пуста. Первые в очередях
+# берутся по индексу (class_id, id), а запись идет через те же условия, что и обычная
+# запись на занятие (enrollment.py), сразу для всех затронутых занятий.
+# Функции синхронные; async-эндпоинты вызывают их через AsyncSession.run_sync.
+from datetime import date, datetime
+from typing import Any, Dict, Iterable, List, Tuple
+
+from fastapi import HTTPException, status
+from sqlalchemy import delete, func, insert, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import Session
+
+from ll1 import Attendance, AttendanceStatus, Classes, Halls, Students, Waitlist
+from enrollment import diagnose_statement, take_seats_each_statement
+
+MAX_PROMOTIONS = 100
+
+waitlist_table = Waitlist.__table__
+classes_table = Classes.__table__
+halls_table = Halls.__table__
+attendance_table = Attendance.__table__
+
+
+def queue_heads(class_ids: List[int]):
+    """Первые в очередях занятий; если первый занят другой транзакцией, занятие пропускается"""
+    first = (
+        select(func.min(waitlist_table.c.id))
+        .where(waitlist_table.c.class_id.in_(class_ids))
+        .group_by(waitlist_table.c.class_id)
+    )
+    return (
+        select(waitlist_table.c.id, waitlist_table.c.class_id, waitlist_table.c.student_id)
+        .where(waitlist_table.c.id.in_(first))
+        .with_for_update(skip_locked=True)
+    )
+
+
+def promote_many(session: Session, class_ids: Iterable[int]) -> Dict[int, List[int]]:
+    """
+    Перевод студентов из начала очередей занятий на свободные места, пока места есть.
+    За проход берется первый в очереди на каждом занятии: места занимаются одним UPDATE,
+    записи вставляются одним INSERT, разобранные строки очереди удаляются одним DELETE,
+    так что число запросов зависит от числа мест на одном занятии, а не от числа занятий.
+    Студент, которого записать нельзя (нет абонемента, уже записан), убирается из очереди.
+    Commit делает вызывающий код. Возвращает {class_id: id записанных студентов}.
+    """
+    promoted: Dict[int, List[int]] = {}
+    pending = list(dict.fromkeys(class_ids))
+    now = datetime.now()
+    for _ in range(MAX_PROMOTIONS):
+        if not pending:
+            break
+        heads = {head.class_id: head for head in session.exec(queue_heads(pending)).all()}
+        if not heads:
+            break
+        head_student = (
+            select(waitlist_table.c.student_id)
+            .where(
+                waitlist_table.c.id.in_([head.id for head in heads.values()]),
+                waitlist_table.c.class_id == classes_table.c.id
+            )
+            .correlate(classes_table)
+            .scalar_subquery()
+        )
+        seats = {
+            seat.id: seat for seat in session.exec(take_seats_each_statement(head_student, list(heads), now)).all()
+        }
+        # Место есть, а первого в очереди записать нельзя — он убирается, очередь разбирается дальше
+        skipped = []
+        missed = [class_id for class_id in heads if class_id not in seats]
+        if missed:
+            skipped = session.exec(
+                select(classes_table.c.id)
+                .join(halls_table, halls_table.c.id == classes_table.c.hall_id)
+                .where(classes_table.c.id.in_(missed), classes_table.c.current_capacity < halls_table.c.capacity)
+            ).scalars().all()
+
+        done = [heads[class_id].id for class_id in (*seats, *skipped)]
+        if not done:
+            break
+        session.exec(delete(waitlist_table).where(waitlist_table.c.id.in_(done)))
+        if seats:
+            session.exec(insert(attendance_table).values([
+                {
+                    "student_id": heads[class_id].student_id, "class_id": class_id, "teacher_id": seat.teacher_id,
+                    "presence": AttendanceStatus.REGISTERED, "created_at": now, "updated_at": now
+                }
+                for class_id, seat in seats.items()
+            ]))
+        for class_id in seats:
+            promoted.setdefault(class_id, []).append(heads[class_id].student_id)
+        pending = [
+            *skipped,
+            *(class_id for class_id, seat in seats.items() if seat.current_capacity < seat.capacity)
+        ]
+    return promoted
+
+
+def promote(session: Session, class_id: int) -> List[int]:
+    """Перевод студентов из очереди одного занятия на свободные места (см. promote_many)"""
+    return promote_many(session, [class_id]).get(class_id, [])
+
+
+def position(session: Session, class_id: int, entry_id: int) -> int:
+    return session.exec(
+        select(func.count()).select_from(waitlist_table)
+        .where(waitlist_table.c.class_id == class_id, waitlist_table.c.id <= entry_id)
+    ).one()[0]
+
+
+def join_waitlist(session: Session, student_id: int, class_id: int) -> Dict[str, Any]:
+    """Постановка в очередь на заполненное занятие; строка занятия блокируется до commit"""
+    row = session.exec(diagnose_statement(student_id, class_id).with_for_update(of=classes_table)).first()
+    if row is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Занятие не найдено")
+    if row.date < date.today():
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Занятие уже прошло")
+    if row.already_enrolled:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Студент уже записан на это занятие")
+    if row.capacity is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Зал не найден")
+    if row.current_capacity < row.capacity:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="На занятии есть свободные места, запишитесь на него"
+        )
+    if not row.has_subscription:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Нет активного абонемента с оставшимися занятиями на дату занятия"
+        )
+    try:
+        entry_id = session.exec(
+            insert(waitlist_table)
+            .values(class_id=class_id, student_id=student_id, created_at=datetime.now())
+            .returning(waitlist_table.c.id)
+        ).scalar_one()
+        place = position(session, class_id, entry_id)
+        session.commit()
+    except IntegrityError:
+        session.rollback()
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Студент уже в листе ожидания")
+    return {"waitlist_id": entry_id, "position": place}
+
+
+def leave_waitlist(session: Session, student_id: int, class_id: int) -> None:
+    removed = session.exec(
+        delete(waitlist_table)
+        .where(waitlist_table.c.class_id == class_id, waitlist_table.c.student_id == student_id)
+        .returning(waitlist_table.c.id)
+    ).first()
+    if removed is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Студента нет в листе ожидания")
+    session.commit()
+
+
+def release_seats_statement(class_ids: List[int], now: datetime):
+    """Один UPDATE, освобождающий по месту на каждом из занятий"""
+    return (
+        update(classes_table)
+        .where(classes_table.c.id.in_(class_ids), classes_table.c.current_capacity > 0)
+        .values(current_capacity=classes_table.c.current_capacity - 1, updated_at=now)
+        .returning(classes_table.c.id, classes_table.c.date, classes_table.c.type, classes_table.c.teacher_id)
+    )
+
+
+def cancel_enrollment(session: Session, student_id: int, class_id: int) -> Dict[str, Any]:
+    """Отмена записи на будущее занятие; освободившееся место сразу получает очередь"""
+    removed = session.exec(
+        delete(attendance_table)
+        .where(
+            attendance_table.c.student_id == student_id,
+            attendance_table.c.class_id == class_id,
+            attendance_table.c.presence == AttendanceStatus.REGISTERED
+        )
+        .returning(attendance_table.c.id)
+    ).first()
+    if removed is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Запись на занятие не найдена")
+    seat = session.exec(release_seats_statement([class_id], datetime.now())).first()
+    if seat is None or seat.date < date.today():
+        session.rollback()
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Нельзя отменить запись на прошедшее занятие")
+    promoted = promote(session, class_id)
+    session.commit()
+    return {"date": seat.date, "type": seat.type, "teacher_id": seat.teacher_id, "promoted": len(promoted)}
+
+
+def release_student_seats(session: Session, student_id: int) -> List[Tuple]:
+    """
+    Освобождение мест студента на будущих занятиях (перед удалением студента) с переводом
+    очереди на эти места, и удаление студента из всех очередей. Без commit. Места
+    освобождаются одним UPDATE, очереди разбираются через promote_many.
+    Возвращает ключи расписания (date, type, teacher_id) затронутых занятий.
+    """
+    session.exec(delete(waitlist_table).where(waitlist_table.c.student_id == student_id))
+    class_ids = session.exec(
+        delete(attendance_table)
+        .where(
+            attendance_table.c.student_id == student_id,
+            attendance_table.c.presence == AttendanceStatus.REGISTERED,
+            attendance_table.c.class_id.in_(
+                select(classes_table.c.id).where(classes_table.c.date >= date.today())
+            )
+        )
+        .returning(attendance_table.c.class_id)
+    ).scalars().all()
+    if not class_ids:
+        return []
+    released = session.exec(release_seats_statement(class_ids, datetime.now())).all()
+    promote_many(session, [seat.id for seat in released])
+    return [(seat.date, seat.type, seat.teacher_id) for seat in released]
+
+
+def drop_queues(session: Session, class_ids: Iterable[int]) -> None:
+    """Удаление очередей занятий, которые удаляются (без commit)"""
+    class_ids = list(class_ids)
+    if class_ids:
+        session.exec(delete(waitlist_table).where(waitlist_table.c.class_id.in_(class_ids)))
+
+
+def class_waitlist(session: Session, class_id: int) -> List[Dict[str, Any]]:
+    """Очередь занятия по порядку (для администратора)"""
+    rows = session.exec(
+        select(waitlist_table.c.id, waitlist_table.c.student_id, Students.full_name, waitlist_table.c.created_at)
+        .join(Students, Students.id == waitlist_table.c.student_id)
+        .where(waitlist_table.c.class_id == class_id)
+        .order_by(waitlist_table.c.id)
+    ).all()
+    return [
+        {"position": n, "waitlist_id": row.id, "student_id": row.student_id,
+         "student_name": row.full_name, "created_at": row.created_at}
+        for n, row in enumerate(rows, start=1)
+    ]
@@ -22,14 +22,66 @@ api.interceptors.request.use(
   }
 )
 
+// Сохранение пары токенов из ответа /login или /token/refresh
+const saveTokens = (data) => {
+  localStorage.setItem('token', data.access_token)
+  if (data.refresh_token) {
+    localStorage.setItem('refresh_token', data.refresh_token)
+  }
+}
+
+const redirectToLogin = () => {
+  localStorage.removeItem('token')
+  localStorage.removeItem('refresh_token')
+  window.location.href = '/login'
+}
+
+// Один запрос /token/refresh на все ответы 401, пришедшие одновременно
+let refreshing = null
+
+const refreshTokens = () => {
+  if (!refreshing) {
+    const refreshToken = localStorage.getItem('refresh_token')
+    refreshing = (refreshToken
+      ? axios.post(`${config.api.baseURL}/token/refresh`, { refresh_token: refreshToken }, {
+        headers: config.api.headers
+      })
+      : Promise.reject(new Error('Нет refresh-токена'))
+    )
+      .then(response => {
+        saveTokens(response.data)
+        return response.data.access_token
+      })
+      .finally(() => {
+        refreshing = null
+      })
+  }
+  return refreshing
+}
+
 // Добавляем перехватчик для обработки ответов
 api.interceptors.response.use(
   response => response,
   error => {
+    const request = error.config
     if (error.response && error.response.status === 401) {
-      // Если токен истек или недействителен, очищаем localStorage и перенаправляем на страницу входа
-      localStorage.removeItem('token')
-      window.location.href = '/login'
+      // Access-токен истек или устарел после изменения профиля: получаем новый по
+      // refresh-токену и повторяем запрос один раз. Если refresh-токен тоже не принят
+      // (пароль изменен, пользователь удален), отправляем на страницу входа
+      if (request && !request._retried && request.url !== '/login') {
+        request._retried = true
+        return refreshTokens().then(
+          token => {
+            request.headers['token'] = token
+            return api(request)
+          },
+          () => {
+            redirectToLogin()
+            return Promise.reject(error)
+          }
+        )
+      }
+      redirectToLogin()
     }
     return Promise.reject(error)
   }
@@ -47,6 +99,13 @@ const classesApi = {
       'token': localStorage.getItem('token'),
       'Content-Type': 'application/json'
     }
+  }),
+  // Запись на несколько занятий сразу: { class_ids } или { series_id, from_date }, mode: all_or_nothing | best_effort
+  enrollMany: (payload) => api.post('/classes/enroll', payload, {
+    headers: {
+      'token': localStorage.getItem('token'),
+      'Content-Type': 'application/json'
+    }
   })
 }
 
@@ -80,10 +139,21 @@ const hallsApi = {
 const attendanceApi = {
   mark: (data) => api.post('/attendance/', data),
   getAll: () => api.get('/admin/attendance/'),
-  getStatistics: (params) => api.get('/attendance/statistics/', { params }),
+  getStatistics: (params) => api.get('/admin/attendance/statistics', { params }),
   getStudentAttendance: (studentId) => api.get(`/attendance/student/${studentId}/`),
   getClassAttendance: (classId) => api.get(`/attendance/class/${classId}/`),
-  updateAttendance: (attendanceId, data) => api.put(`/attendance/${attendanceId}/`, data)
+  updateAttendance: (attendanceId, data) => api.put(`/attendance/${attendanceId}/`, data),
+  // Перекличка: marks — [{ student_id, presence }] для всего занятия
+  rollCall: (classId, marks) => api.put(`/attendance/class/${classId}`, { marks }, {
+    headers: {
+      'token': localStorage.getItem('token')
+    }
+  })
+}
+
+// Когортная аналитика (ADMIN)
+const analyticsApi = {
+  getCohorts: (months = 12) => api.get('/admin/analytics/cohorts', { params: { months } })
 }
 
 // Методы для работы с подписками
@@ -106,7 +176,7 @@ const authApi = {
       password: credentials.password
     })
     if (response.data?.access_token) {
-      localStorage.setItem('token', response.data.access_token)
+      saveTokens(response.data)
     }
     return response
   },
@@ -130,6 +200,7 @@ export {
   studentsApi,
   hallsApi,
   attendanceApi,
+  analyticsApi,
   subscriptionsApi,
   paymentsApi,
   authApi
@@ -30,6 +30,7 @@ export default createStore({
         localStorage.setItem('token', token)
       } else {
         localStorage.removeItem('token')
+        localStorage.removeItem('refresh_token')
       }
     },
     CLEAR_AUTH(state) {